@@ -2,6 +2,7 @@ import { NextRequest, NextResponse } from 'next/server';
 import fs from 'fs';
 import path from 'path';
 import { getDatasetPaths, DatasetType, CohortYear, TreatmentType } from '@/lib/config';
+import { loadPyramidManifest } from '@/lib/image-pyramid';
 
 export async function GET(
   request: NextRequest,
@@ -14,6 +15,10 @@ export async function GET(
   const treatmentTypeParam = searchParams.get('treatment') || 'surgery';
   const cohortYear: CohortYear = (cohortYearParam === '2019') ? '2019' : (cohortYearParam === '2024') ? '2024' : '2025';
   const treatmentType: TreatmentType = (treatmentTypeParam === 'nac') ? 'nac' : 'surgery';
+  // Optional downscale factor (2, 4 or 8) for list views and thumbnails; v is the
+  // source hash /api/patients adds so a changed image gets a new URL
+  const scaleParam = searchParams.get('scale');
+  const versionParam = searchParams.get('v');
   
   // Expecting: [dataset, type, filename] e.g. /api/images/original/images/file.jpg
   // Or fallback: [type, filename] (default to original)
@@ -68,6 +73,30 @@ export async function GET(
       return NextResponse.json({ error: `File not found: ${safeFilename}`, path: filePath }, { status: 404 });
   }
 
+  // Serve a downscaled variant when one exists; otherwise fall through to the original
+  if (scaleParam && type !== 'annotations') {
+    const manifest = loadPyramidManifest(paths.root);
+    const entry = manifest?.files[`${type}/${safeFilename}`];
+    const variant = entry?.variants[scaleParam];
+    if (manifest && entry && variant) {
+      const variantPath = path.join(paths.root, 'pyramid', variant);
+      if (fs.existsSync(variantPath)) {
+        // Only a URL pinned to the current source hash may be cached forever; a bare
+        // filename URL is revalidated against the ETag after a few minutes
+        const etag = `"${entry.sha1}-${scaleParam}"`;
+        const headers = {
+          'Content-Type': manifest.format === 'webp' ? 'image/webp' : 'image/jpeg',
+          'Cache-Control': versionParam === entry.sha1 ? 'public, max-age=31536000, immutable' : 'public, max-age=300',
+          ETag: etag,
+        };
+        if (request.headers.get('if-none-match') === etag) {
+          return new NextResponse(null, { status: 304, headers });
+        }
+        return new NextResponse(fs.readFileSync(variantPath), { headers });
+      }
+    }
+  }
+
   const fileBuffer = fs.readFileSync(filePath);
   
   // Determine Content-Type
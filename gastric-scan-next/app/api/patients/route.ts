@@ -2,6 +2,8 @@ import { NextRequest, NextResponse } from 'next/server';
 import fs from 'fs';
 import path from 'path';
 import { getDatasetPaths, DatasetType, CohortYear, TreatmentType, getClinicalDataPath } from '@/lib/config';
+import { lookupClinicalRecords } from '@/lib/clinical-store';
+import { loadPyramidManifest, variantQuery } from '@/lib/image-pyramid';
 
 // Video index cache
 let videoIndexCache: Record<string, any[]> | null = null;
@@ -75,18 +77,6 @@ export async function GET(request: NextRequest) {
       return NextResponse.json({ error: 'Dataset directory not found' }, { status: 404 });
     }
 
-    // Load Clinical Data based on cohort year and treatment type
-    let clinicalData: Record<string, any> = {};
-    try {
-        const clinicalDataPath = getClinicalDataPath(cohortYear, treatmentType);
-        if (fs.existsSync(clinicalDataPath)) {
-            const fileContent = fs.readFileSync(clinicalDataPath, 'utf-8');
-            clinicalData = JSON.parse(fileContent);
-        }
-    } catch (e) {
-        console.warn("Failed to load clinical data", e);
-    }
-
     const files = fs.readdirSync(paths.images);
     const jpgFiles = files.filter(file => file.toLowerCase().endsWith('.jpg'));
 
@@ -137,6 +127,8 @@ export async function GET(request: NextRequest) {
 
     // Load video index
     const videoIndex = loadVideoIndex();
+    // Downscaled variants for the thumbnail URLs (absent until build_image_pyramid.py has run)
+    const pyramid = loadPyramidManifest(paths.root);
 
     const patients = filteredFiles.map(filename => {
       // Filename format for 2025: Group_Phase_PatientID.jpg or Group_Phase_PatientID (X).jpg
@@ -215,6 +207,10 @@ export async function GET(request: NextRequest) {
       // Get videos for this patient
       const videos = videoIndex[pureId] || [];
 
+      const query = `?cohort=${cohortYear}&treatment=${treatmentType}`;
+      const imageThumbQuery = variantQuery(pyramid, 'images', filename);
+      const overlayThumbQuery = hasTransparentOverlay ? variantQuery(pyramid, 'lymph_node_analysis', overlayFilename) : '';
+
       return {
         id: filename,
         id_short: filename.replace(".jpg", ""), 
@@ -226,11 +222,23 @@ export async function GET(request: NextRequest) {
         overlay_url: hasOverlay ? `/api/images/${dataset}/overlays/${encodedOverlayFilename}?cohort=${cohortYear}&treatment=${treatmentType}` : "",
         overlay_transparent_url: hasTransparentOverlay ? `/api/images/${dataset}/lymph_node_analysis/${encodedOverlayFilename}?cohort=${cohortYear}&treatment=${treatmentType}` : "",
         json_url: hasAnnotation ? `/api/images/${dataset}/annotations/${encodedJsonFilename}?cohort=${cohortYear}&treatment=${treatmentType}` : "",
-        clinical: clinicalData[pureId] || null,
+        // Downscaled copies for grids; same as the full-size URLs when no variant exists
+        thumbnail_url: `/api/images/${dataset}/images/${encodedFilename}${query}${imageThumbQuery}`,
+        overlay_transparent_thumbnail_url: hasTransparentOverlay ? `/api/images/${dataset}/lymph_node_analysis/${encodedOverlayFilename}${query}${overlayThumbQuery}` : "",
+        clinical: null as Record<string, any> | null,
         video_urls: videos.length > 0 ? videos : undefined
       };
     });
 
+    // Load Clinical Data based on cohort year and treatment type, only for the patients listed
+    try {
+        const clinicalDataPath = getClinicalDataPath(cohortYear, treatmentType);
+        const clinicalData = lookupClinicalRecords(clinicalDataPath, patients.map(p => p.patient_id));
+        patients.forEach(p => { p.clinical = clinicalData[p.patient_id] || null; });
+    } catch (e) {
+        console.warn("Failed to load clinical data", e);
+    }
+
     // Sort patients: Priority to those with clinical data, then by ID
     patients.sort((a, b) => {
       // 1. Clinical data presence
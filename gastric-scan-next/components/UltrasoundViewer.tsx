@@ -593,7 +593,7 @@ export const UltrasoundViewer: React.FC<UltrasoundViewerProps> = ({ patient, sib
                 }`}
               >
                 <OptimizedImage 
-                  src={img.image_url} 
+                  src={img.thumbnail_url || img.image_url} 
                   alt={img.id_short} 
                   className="max-h-full max-w-full object-contain"
                   priority={idx < 4}
@@ -602,7 +602,7 @@ export const UltrasoundViewer: React.FC<UltrasoundViewerProps> = ({ patient, sib
                 {img.overlay_transparent_url && (
                   <div className="absolute inset-0 flex items-center justify-center pointer-events-none">
                     <OptimizedImage 
-                      src={img.overlay_transparent_url} 
+                      src={img.overlay_transparent_thumbnail_url || img.overlay_transparent_url} 
                       alt="Overlay" 
                       className="max-h-full max-w-full object-contain opacity-80"
                       silentError={true}
@@ -0,0 +1,96 @@
+import fs from 'fs';
+
+// Reader for the patient-keyed store written by scripts/clinical_store.py next to
+// each clinical_data*.json: "<name>.records.jsonl" holds one record per line and
+// "<name>.records.idx" maps patient IDs to [byteOffset, byteLength].
+
+type ClinicalRecord = Record<string, any>;
+
+interface StoreIndex {
+  version: number;
+  size: number;
+  offsets: Record<string, [number, number]>;
+}
+
+const STORE_VERSION = 1;
+
+const indexCache = new Map<string, { mtimeMs: number; index: StoreIndex }>();
+const jsonCache = new Map<string, { mtimeMs: number; data: Record<string, ClinicalRecord> }>();
+// Decoded store records per index. indexCache swaps in a new index object whenever the
+// index file's mtime changes, so records cached against the old one are dropped with it.
+const recordCache = new WeakMap<StoreIndex, Map<string, ClinicalRecord>>();
+
+export const getClinicalStorePaths = (jsonPath: string) => {
+  const stem = jsonPath.replace(/\.json$/i, '');
+  return { records: `${stem}.records.jsonl`, index: `${stem}.records.idx` };
+};
+
+// Index of a store that is newer than its JSON and matches its records file, else null
+function loadIndex(jsonPath: string): StoreIndex | null {
+  const paths = getClinicalStorePaths(jsonPath);
+  const indexStat = fs.statSync(paths.index, { throwIfNoEntry: false });
+  const recordsStat = fs.statSync(paths.records, { throwIfNoEntry: false });
+  const jsonStat = fs.statSync(jsonPath, { throwIfNoEntry: false });
+  if (!indexStat || !recordsStat) return null;
+  if (jsonStat && indexStat.mtimeMs < jsonStat.mtimeMs) return null;
+
+  const cached = indexCache.get(paths.index);
+  let index = cached && cached.mtimeMs === indexStat.mtimeMs ? cached.index : null;
+  if (!index) {
+    index = JSON.parse(fs.readFileSync(paths.index, 'utf-8')) as StoreIndex;
+    indexCache.set(paths.index, { mtimeMs: indexStat.mtimeMs, index });
+  }
+  if (index.version !== STORE_VERSION || index.size !== recordsStat.size) return null;
+  return index;
+}
+
+function loadJson(jsonPath: string): Record<string, ClinicalRecord> {
+  const stat = fs.statSync(jsonPath, { throwIfNoEntry: false });
+  if (!stat) return {};
+  const cached = jsonCache.get(jsonPath);
+  if (cached && cached.mtimeMs === stat.mtimeMs) return cached.data;
+  const data = JSON.parse(fs.readFileSync(jsonPath, 'utf-8'));
+  jsonCache.set(jsonPath, { mtimeMs: stat.mtimeMs, data });
+  return data;
+}
+
+/**
+ * Clinical records of the given patients. Only the requested records are read and
+ * parsed from the store, once per index version; without a fresh store the whole JSON
+ * is parsed once and cached.
+ */
+export function lookupClinicalRecords(jsonPath: string, patientIds: Iterable<string>): Record<string, ClinicalRecord> {
+  const ids = new Set(patientIds);
+  const result: Record<string, ClinicalRecord> = {};
+
+  const index = loadIndex(jsonPath);
+  if (index) {
+    const records = recordCache.get(index) ?? new Map<string, ClinicalRecord>();
+    recordCache.set(index, records);
+    const missing = [...ids].filter(id => index.offsets[id] && !records.has(id));
+    if (missing.length > 0) {
+      const fd = fs.openSync(getClinicalStorePaths(jsonPath).records, 'r');
+      try {
+        for (const id of missing) {
+          const [offset, length] = index.offsets[id];
+          const buffer = Buffer.allocUnsafe(length);
+          fs.readSync(fd, buffer, 0, length, offset);
+          records.set(id, JSON.parse(buffer.toString('utf-8')));
+        }
+      } finally {
+        fs.closeSync(fd);
+      }
+    }
+    for (const id of ids) {
+      const record = records.get(id);
+      if (record) result[id] = record;
+    }
+    return result;
+  }
+
+  const data = loadJson(jsonPath);
+  for (const id of ids) {
+    if (data[id]) result[id] = data[id];
+  }
+  return result;
+}
@@ -0,0 +1,44 @@
+import fs from 'fs';
+import path from 'path';
+
+// Downscaled variants written by scripts/build_image_pyramid.py (<root>/pyramid/manifest.json).
+// Variants are named by the SHA-1 of their source file, so a URL that carries the hash
+// (?scale=4&v=<sha1>) changes whenever the source image does and can be cached forever.
+
+export interface PyramidManifest {
+  format: string;
+  files: Record<string, { sha1: string; variants: Record<string, string> }>;
+}
+
+// Scale of the thumbnails listed by /api/patients (1/4 of the original width)
+export const THUMBNAIL_SCALE = '4';
+
+const pyramidCache = new Map<string, { mtimeMs: number; manifest: PyramidManifest }>();
+
+export function loadPyramidManifest(root: string): PyramidManifest | null {
+  const manifestPath = path.join(root, 'pyramid', 'manifest.json');
+  try {
+    const { mtimeMs } = fs.statSync(manifestPath);
+    const cached = pyramidCache.get(manifestPath);
+    if (cached && cached.mtimeMs === mtimeMs) {
+      return cached.manifest;
+    }
+    const manifest = JSON.parse(fs.readFileSync(manifestPath, 'utf-8')) as PyramidManifest;
+    pyramidCache.set(manifestPath, { mtimeMs, manifest });
+    return manifest;
+  } catch {
+    return null;
+  }
+}
+
+// Query suffix ("&scale=4&v=<sha1>") selecting a variant of <folder>/<filename>, or '' without one
+export function variantQuery(
+  manifest: PyramidManifest | null,
+  folder: string,
+  filename: string,
+  scale: string = THUMBNAIL_SCALE
+): string {
+  const entry = manifest?.files[`${folder}/${filename}`];
+  if (!entry || !entry.variants[scale]) return '';
+  return `&scale=${scale}&v=${entry.sha1}`;
+}
@@ -83,8 +83,9 @@ export function getConceptStateFromPatient(patient: Patient | null): ConceptStat
 
   return {
     // 使用 DEFAULT_STATE 中的值作为默认值，而不是 0
-    c1: parseConceptValue(features.ki67, DEFAULT_STATE.c1),
-    c2: parseConceptValue(features.cps, DEFAULT_STATE.c2),
+    // 优先使用提取脚本解析好的数值，旧数据才回退到解析原文
+    c1: features.ki67_pct ?? parseConceptValue(features.ki67, DEFAULT_STATE.c1),
+    c2: features.cps_value ?? parseConceptValue(features.cps, DEFAULT_STATE.c2),
     c3: parseConceptValue(features.pd1, DEFAULT_STATE.c3),
     c4: parseConceptValue(features.foxp3, DEFAULT_STATE.c4),
     c5: parseConceptValue(features.cd3, DEFAULT_STATE.c5),
@@ -92,8 +93,8 @@ export function getConceptStateFromPatient(patient: Patient | null): ConceptStat
     c7: parseConceptValue(features.cd8, DEFAULT_STATE.c7),
     differentiation: parseDifferentiation(features.differentiation),
     lauren: parseLauren(features.lauren),
-    vascularInvasion: parseInvasion(features.vascular),
-    neuralInvasion: parseInvasion(features.neural),
+    vascularInvasion: features.vascular_invasion !== undefined ? Number(features.vascular_invasion) : parseInvasion(features.vascular),
+    neuralInvasion: features.neural_invasion !== undefined ? Number(features.neural_invasion) : parseInvasion(features.neural),
   };
 }
 
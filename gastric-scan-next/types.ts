@@ -34,6 +34,8 @@ export const DEFAULT_STATE: ConceptState = {
   neuralInvasion: 0
 };
 
+export type MarkerStatus = 'negative' | 'scattered' | 'positive';
+
 export interface ConceptFeatures {
   ki67?: string;
   cps?: string;
@@ -46,6 +48,17 @@ export interface ConceptFeatures {
   neural?: string;
   differentiation?: string;
   lauren?: string;
+  // 由 scripts/concept_values.py 从上面的原文片段解析出的类型化字段
+  ki67_pct?: number;
+  cps_value?: number;
+  cps_comparator?: '<' | '<=' | '=' | '>=' | '>';
+  pd1_status?: MarkerStatus;
+  foxp3_status?: MarkerStatus;
+  cd3_status?: MarkerStatus;
+  cd4_status?: MarkerStatus;
+  cd8_status?: MarkerStatus;
+  vascular_invasion?: boolean;
+  neural_invasion?: boolean;
 }
 
 export interface ClinicalData {
@@ -91,6 +104,8 @@ export interface Patient {
   overlay_url: string;
   overlay_transparent_url?: string;
   json_url: string;
+  thumbnail_url?: string; // Downscaled image (?scale=) for grids
+  overlay_transparent_thumbnail_url?: string;
   clinical?: ClinicalData;
   video_urls?: VideoInfo[]; // Associated videos
 }
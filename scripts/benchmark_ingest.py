@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Benchmark the DICOM/NIfTI ingest pipeline on synthetic, PHI-free fixtures.
+
+Synthetic DICOM frames (pydicom) and matching NIfTI masks (nibabel) are
+generated with the file naming of each cohort (2019, 2019 NAC, 2024, 2024 NAC),
+then the cohort's own matching and ``process_single_file`` code is run at
+several worker counts. For every run the script reports files/s, MB/s, peak
+RSS and the per-stage time breakdown recorded by ``ingest_utils.STAGE_TIMES``
+(prescan, decode, match, contour, encode, write).
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import cv2
+import nibabel as nib
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, UltrasoundImageStorage, generate_uid
+
+import ingest_utils
+from ingest_utils import prescan_pairs
+
+STAGES = ("prescan", "decode", "match", "contour", "encode", "write", "other")
+
+# Each cohort: ingest module, output prefix, whether process_single_file takes
+# a queue argument, and how its DICOM / NIfTI files are named on disk.
+COHORTS: Dict[str, Dict[str, object]] = {
+    "2019": {
+        "module": "process_2019_project",
+        "prefix": "Surgery_2019",
+        "has_queue": False,
+        "dcm_name": "{pid}-{seq}.dcm",
+        "nii_name": "1-{pid}-{seq}(13).nii",
+    },
+    "2019_nac": {
+        "module": "process_2019_nac_project",
+        "prefix": "NAC_2019",
+        "has_queue": True,
+        "dcm_name": "{pid}-{seq}.dcm",
+        "nii_name": "1-{pid}-{seq}(16).nii",
+    },
+    "2024": {
+        "module": "process_2024_project",
+        "prefix": "Surgery_2024",
+        "has_queue": True,
+        "dcm_name": "{pid}-{seq}.dcm",
+        "nii_name": "{pid}-{seq}(13).nii.gz",
+    },
+    "2024_nac": {
+        "module": "process_2024_nac_project",
+        "prefix": "NAC_2024",
+        "has_queue": True,
+        "dcm_name": "{pid}-{seq}.dcm",
+        "nii_name": "{pid}-{seq}(13).nii.gz",
+    },
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark ingest throughput on synthetic data.")
+    parser.add_argument(
+        "--cohorts",
+        nargs="+",
+        choices=sorted(COHORTS),
+        default=sorted(COHORTS),
+        help="Cohort naming conventions to benchmark (default: all).",
+    )
+    parser.add_argument("--patients", type=int, default=8, help="Synthetic patients per cohort.")
+    parser.add_argument("--frames", type=int, default=4, help="Frames per patient.")
+    parser.add_argument("--width", type=int, default=1024, help="Frame width in pixels.")
+    parser.add_argument("--height", type=int, default=768, help="Frame height in pixels.")
+    parser.add_argument(
+        "--grayscale",
+        action="store_true",
+        help="Generate 16-bit MONOCHROME2 frames instead of 8-bit RGB.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Worker counts to run (default: 1 2 4 and the CPU count).",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        default=None,
+        help="Directory for fixtures and outputs (default: a temporary directory).",
+    )
+    parser.add_argument("--json", type=Path, default=None, help="Optional path for a JSON report.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the fixtures.")
+    return parser.parse_args()
+
+
+def synthetic_frame(rng: np.random.Generator, height: int, width: int, grayscale: bool) -> np.ndarray:
+    """Speckle-like texture with a darker elliptical lesion, roughly ultrasound shaped."""
+    noise = rng.gamma(2.0, 40.0, size=(height, width)).astype(np.float32)
+    noise = cv2.GaussianBlur(noise, (0, 0), 3)
+    cv2.ellipse(noise, (width // 2, height // 2), (width // 6, height // 8), 0, 0, 360, 30.0, -1)
+    if grayscale:
+        return np.clip(noise * 64, 0, 65535).astype(np.uint16)
+    gray = np.clip(noise, 0, 255).astype(np.uint8)
+    return np.repeat(gray[:, :, None], 3, axis=2)
+
+
+def write_dicom(path: Path, pixels: np.ndarray, patient_id: str) -> None:
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = UltrasoundImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = UltrasoundImageStorage
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.PatientID = patient_id
+    ds.Modality = "US"
+    ds.Rows, ds.Columns = pixels.shape[:2]
+    if pixels.ndim == 3:
+        ds.SamplesPerPixel = 3
+        ds.PhotometricInterpretation = "RGB"
+        ds.PlanarConfiguration = 0
+        ds.BitsAllocated = ds.BitsStored = 8
+        ds.HighBit = 7
+    else:
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = pixels.tobytes()
+    pydicom.dcmwrite(str(path), ds, enforce_file_format=True)
+
+
+def write_mask(path: Path, height: int, width: int) -> None:
+    """Lesion mask stored transposed (W, H, 1), as exported by the annotation tool."""
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(mask, (width // 2, height // 2), (width // 6, height // 8), 15, 0, 360, 1, -1)
+    nib.save(nib.Nifti1Image(mask.T[:, :, None], np.eye(4)), str(path))
+
+
+def generate_cohort(root: Path, spec: Dict[str, object], args: argparse.Namespace) -> Tuple[Path, Path]:
+    dicom_dir = root / "DICOM"
+    nii_dir = root / "NII"
+    dicom_dir.mkdir(parents=True, exist_ok=True)
+    nii_dir.mkdir(parents=True, exist_ok=True)
+
+    rng = np.random.default_rng(args.seed)
+    frame = synthetic_frame(rng, args.height, args.width, args.grayscale)
+    for p in range(args.patients):
+        pid = str(1000000 + p)
+        for seq in range(1, args.frames + 1):
+            names = {"pid": pid, "seq": seq}
+            write_dicom(dicom_dir / spec["dcm_name"].format(**names), frame, pid)
+            write_mask(nii_dir / spec["nii_name"].format(**names), args.height, args.width)
+    return dicom_dir, nii_dir
+
+
+def match_pairs(module, spec: Dict[str, object], dicom_dir: Path, nii_dir: Path) -> List[tuple]:
+    """Use the cohort script's own matcher so the 'match' stage is realistic."""
+    dcm_files = sorted(os.listdir(dicom_dir))
+    nii_files = sorted(os.listdir(nii_dir))
+    pairs = []
+    for dcm_file in dcm_files:
+        if hasattr(module, "match_dicom_to_nii_with_queue"):
+            matched = module.match_dicom_to_nii_with_queue(dcm_file, nii_files, "1")
+        else:
+            matched = module.match_dicom_to_nii(dcm_file, nii_files)
+        if not matched:
+            continue
+        pair = (str(dicom_dir / dcm_file), str(nii_dir / matched), spec["prefix"])
+        if spec["has_queue"]:
+            pair += ("1",)
+        pairs.append(pair)
+    return pairs
+
+
+def peak_rss_bytes() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_job(job: Tuple[str, tuple, Dict[str, str]]) -> Tuple[bool, Dict[str, float], float, int]:
+    module_name, pair, out_dirs = job
+    module = importlib.import_module(module_name)
+    ingest_utils.STAGE_TIMES.clear()
+    start = time.perf_counter()
+    dcm_path, nii_path, prefix = pair[:3]
+    if len(pair) > 3:
+        ok, _ = module.process_single_file(dcm_path, nii_path, out_dirs, prefix, queue=pair[3])
+    else:
+        ok, _ = module.process_single_file(dcm_path, nii_path, out_dirs, prefix)
+    elapsed = time.perf_counter() - start
+    return ok, dict(ingest_utils.STAGE_TIMES), elapsed, peak_rss_bytes()
+
+
+def make_out_dirs(root: Path) -> Dict[str, str]:
+    if root.exists():
+        shutil.rmtree(root)
+    out_dirs = {
+        "images": root / "images",
+        "annotations": root / "annotations",
+        "overlays": root / "overlays",
+        "overlaysTransparent": root / "lymph_node_analysis",
+    }
+    for path in out_dirs.values():
+        path.mkdir(parents=True, exist_ok=True)
+    return {key: str(path) for key, path in out_dirs.items()}
+
+
+def benchmark_cohort(name: str, workdir: Path, args: argparse.Namespace, worker_counts: List[int]) -> List[Dict[str, object]]:
+    spec = COHORTS[name]
+    module = importlib.import_module(spec["module"])
+    dicom_dir, nii_dir = generate_cohort(workdir / "fixtures" / name, spec, args)
+    input_bytes = sum(f.stat().st_size for d in (dicom_dir, nii_dir) for f in d.iterdir())
+
+    results = []
+    for workers in worker_counts:
+        out_dirs = make_out_dirs(workdir / "output" / name / f"w{workers}")
+        stages = dict.fromkeys(STAGES, 0.0)
+        start = time.perf_counter()
+
+        t0 = time.perf_counter()
+        pairs = match_pairs(module, spec, dicom_dir, nii_dir)
+        stages["match"] = time.perf_counter() - t0
+
+        ingest_utils.STAGE_TIMES.clear()
+        valid_pairs, _ = prescan_pairs(pairs)
+        stages["prescan"] = ingest_utils.STAGE_TIMES.get("prescan", 0.0)
+
+        jobs = [(spec["module"], pair, out_dirs) for pair in valid_pairs]
+        processed = 0
+        peak_rss = peak_rss_bytes()
+        job_time = 0.0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for ok, job_stages, elapsed, rss in pool.map(run_job, jobs):
+                processed += int(ok)
+                job_time += elapsed
+                peak_rss = max(peak_rss, rss)
+                for stage, seconds in job_stages.items():
+                    stages[stage] = stages.get(stage, 0.0) + seconds
+        wall = time.perf_counter() - start
+
+        measured = sum(stages[s] for s in ("decode", "contour", "encode", "write"))
+        stages["other"] = max(job_time - measured, 0.0)
+        results.append({
+            "cohort": name,
+            "workers": workers,
+            "files": processed,
+            "wall_s": wall,
+            "files_per_s": processed / wall if wall else 0.0,
+            "mb_per_s": input_bytes / 1e6 / wall if wall else 0.0,
+            "peak_rss_mb": peak_rss / 1e6,
+            "stages_s": stages,
+        })
+    return results
+
+
+def print_results(results: List[Dict[str, object]]) -> None:
+    header = f"{'cohort':<10}{'workers':>8}{'files':>7}{'wall s':>9}{'files/s':>9}{'MB/s':>8}{'RSS MB':>9}"
+    header += "".join(f"{s:>9}" for s in STAGES)
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        line = (
+            f"{r['cohort']:<10}{r['workers']:>8}{r['files']:>7}{r['wall_s']:>9.2f}"
+            f"{r['files_per_s']:>9.1f}{r['mb_per_s']:>8.1f}{r['peak_rss_mb']:>9.0f}"
+        )
+        line += "".join(f"{r['stages_s'][s]:>9.2f}" for s in STAGES)
+        print(line)
+    print("Stage columns are CPU seconds summed over all workers.")
+
+
+def main() -> None:
+    args = parse_args()
+    worker_counts = args.workers or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="ingest_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    print(f"Fixtures and outputs under: {workdir}")
+
+    results = []
+    for name in args.cohorts:
+        results.extend(benchmark_cohort(name, workdir, args, worker_counts))
+
+    print_results(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"JSON report written to: {args.json}")
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Build downscaled (1/2, 1/4, 1/8) variants of every cohort image for list views.
+
+For each dataset root, the files in ``images/``, ``overlays/`` and
+``lymph_node_analysis/`` get WebP (or JPEG) variants under ``<root>/pyramid``.
+Variants are content-addressed by the SHA-1 of the source bytes:
+
+    <root>/pyramid/objects/ab/abcdef..._4.webp
+
+so hard-linked or byte-identical copies (overlays vs. lymph_node_analysis)
+share one set of files. ``<root>/pyramid/manifest.json`` maps
+``<folder>/<filename>`` to its hash, original size and variant paths; the Next.js
+image route consults it for ``?scale=2|4|8`` requests.
+
+Runs are incremental: files whose size and mtime match the manifest are not
+read again, and hashes whose variants already exist are not re-encoded.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = Path("/Users/huangyijun/Projects/胃癌T分期")
+DEFAULT_DATASETS = [
+    PROJECT_ROOT / "Gastric_Cancer_Dataset",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_Cropped",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2019",
+    PROJECT_ROOT / "2019年直接手术" / "Cropped",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2019_nac",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2024",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2024_Cropped",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2024_nac",
+]
+FOLDERS = ("images", "overlays", "lymph_node_analysis")
+SCALES = (2, 4, 8)
+PYRAMID_DIR = "pyramid"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Build 1/2, 1/4 and 1/8 resolution variants of cohort images."
+    )
+    parser.add_argument(
+        "--datasets",
+        type=Path,
+        nargs="+",
+        default=DEFAULT_DATASETS,
+        help="Dataset roots that contain images/, overlays/ and lymph_node_analysis/.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["webp", "jpg"],
+        default="webp",
+        help="Variant encoding (default: webp).",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=80,
+        help="Encoder quality for the variants (default: 80).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of encoding processes (default: CPU count).",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete variant files no longer referenced by the manifest.",
+    )
+    return parser.parse_args()
+
+
+def object_path(sha1: str, scale: int, fmt: str) -> str:
+    """Variant path relative to the pyramid directory."""
+    return f"objects/{sha1[:2]}/{sha1}_{scale}.{fmt}"
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def encode(img, fmt: str, quality: int) -> bytes:
+    if fmt == "webp":
+        ok, buffer = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    else:
+        ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError(f"Failed to encode {fmt}")
+    return buffer.tobytes()
+
+
+def build_variants(job: Tuple[str, str, str, int]) -> Optional[Dict[str, object]]:
+    """
+    Hash one source file and write whichever of its variants are missing.
+
+    The 1/2 level is decoded directly at reduced resolution (libjpeg DCT
+    scaling); 1/4 and 1/8 are area-downsampled from it. The original size is
+    read from the header, so nothing is decoded when all variants exist.
+    """
+    src, pyramid_dir, fmt, quality = job
+    data = Path(src).read_bytes()
+    sha1 = hashlib.sha1(data).hexdigest()
+    variants = {str(scale): object_path(sha1, scale, fmt) for scale in SCALES}
+    missing = [scale for scale in SCALES if not (Path(pyramid_dir) / variants[str(scale)]).exists()]
+
+    try:
+        with Image.open(io.BytesIO(data)) as header:
+            width, height = header.size
+    except OSError:
+        return None
+
+    if missing:
+        level = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_2)
+        if level is None:
+            return None
+        (Path(pyramid_dir) / "objects" / sha1[:2]).mkdir(parents=True, exist_ok=True)
+        for scale in SCALES:
+            if scale > SCALES[0]:
+                level = cv2.resize(
+                    level,
+                    (max(1, level.shape[1] // 2), max(1, level.shape[0] // 2)),
+                    interpolation=cv2.INTER_AREA,
+                )
+            if scale in missing:
+                write_atomic(Path(pyramid_dir) / variants[str(scale)], encode(level, fmt, quality))
+
+    stat = os.stat(src)
+    return {
+        "sha1": sha1,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "width": width,
+        "height": height,
+        "variants": variants,
+    }
+
+
+def load_manifest(path: Path, fmt: str) -> Dict[str, Dict[str, object]]:
+    """Previous manifest entries, or nothing when missing or built with another format."""
+    if not path.exists():
+        return {}
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("format") != fmt:
+        return {}
+    return manifest.get("files", {})
+
+
+def build_dataset(root: Path, fmt: str, quality: int, workers: Optional[int], prune: bool) -> Dict[str, int]:
+    pyramid_dir = root / PYRAMID_DIR
+    pyramid_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = pyramid_dir / MANIFEST_NAME
+    previous = load_manifest(manifest_path, fmt)
+
+    files: Dict[str, Dict[str, object]] = {}
+    jobs: List[Tuple[str, str, str, int]] = []
+    keys: List[str] = []
+    for folder in FOLDERS:
+        folder_dir = root / folder
+        if not folder_dir.exists():
+            continue
+        for path in sorted(folder_dir.glob("*.jpg")):
+            if path.name.startswith("._"):
+                continue
+            key = f"{folder}/{path.name}"
+            stat = path.stat()
+            entry = previous.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns and all(
+                (pyramid_dir / rel).exists() for rel in entry["variants"].values()
+            ):
+                files[key] = entry
+                continue
+            jobs.append((str(path), str(pyramid_dir), fmt, quality))
+            keys.append(key)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for key, entry in zip(keys, pool.map(build_variants, jobs, chunksize=16)):
+            if entry is None:
+                failed += 1
+                print(f"[WARN] Unable to decode {root / key}")
+                continue
+            files[key] = entry
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "format": fmt,
+        "scales": list(SCALES),
+        "files": files,
+    }
+    write_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    pruned = 0
+    if prune:
+        referenced = {rel for entry in files.values() for rel in entry["variants"].values()}
+        for path in (pyramid_dir / "objects").glob("*/*"):
+            if path.relative_to(pyramid_dir).as_posix() not in referenced:
+                path.unlink()
+                pruned += 1
+
+    return {
+        "files": len(files),
+        "updated": len(jobs) - failed,
+        "unchanged": len(files) - (len(jobs) - failed),
+        "failed": failed,
+        "pruned": pruned,
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    for root in args.datasets:
+        if not root.exists():
+            print(f"[WARN] Missing dataset: {root}")
+            continue
+        stats = build_dataset(root, args.format, args.quality, args.workers, args.prune)
+        print(
+            f"{root}: {stats['files']} files, {stats['updated']} updated, "
+            f"{stats['unchanged']} unchanged, {stats['failed']} failed, {stats['pruned']} pruned"
+        )
+
+
+if __name__ == "__main__":
+    main()
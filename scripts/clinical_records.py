@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Compact, schema-checked in-memory form of the clinical_data*.json cohorts.
+
+A cohort is held as one NumPy structured array with a row per patient:
+
+    numeric  age, length, thickness, cea, ca199         float64, NaN when missing
+    flags    cea_positive, ca199_positive                bool
+    enums    sex, location, differentiation, lauren,     int16 code into the table's
+             pT, pN, pM, pStage                          category list, -1 when None
+
+The pathology free text and concept_features are not kept in the array: they
+are read per patient from the clinical store (clinical_store.py) when it is
+fresh, otherwise the report strings are interned. Each JSON record is checked
+against RECORD_LAYOUT when the table is built, and the table is cached next to
+the JSON as ``<name>.records.npz`` so later processes skip the JSON entirely.
+
+Enum columns keep the raw strings (cohorts code stages differently: "T4a",
+"4", "4.0"), so ``to_dict`` returns the original record; ``t_stage()`` and
+``n_stage()`` give harmonized stage numbers as vectors for cohort statistics.
+
+    from clinical_records import load_cohort
+    table = load_cohort("gastric-scan-next/data/clinical_data_2019.json")
+    np.bincount(table.t_stage()[~np.isnan(table.t_stage())].astype(int))
+    table.record("7").pT
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+from clinical_store import ClinicalStore, is_fresh
+from convert_clinical import N_STAGE_CODES_2019, RECORD_LAYOUT, T_STAGE_CODES_2019, stage_number
+
+PROJECT_ROOT = Path("/Users/huangyijun/Projects/胃癌T分期")
+CLINICAL_DIR = PROJECT_ROOT / "gastric-scan-next" / "data"
+CACHE_SUFFIX = ".records.npz"
+CACHE_VERSION = 1
+
+NUMERIC_FIELDS = ("age", "length", "thickness", "cea", "ca199")
+FLAG_FIELDS = ("cea_positive", "ca199_positive")
+ENUM_FIELDS = ("sex", "location", "differentiation", "lauren", "pT", "pN", "pM", "pStage")
+TEXT_FIELD = "type"
+# Kept alongside the layout (merge_clinical_features.py), served lazily like the text
+EXTRA_KEYS = ("concept_features",)
+
+def _leaf_paths(layout: Mapping[str, object], prefix: Tuple[str, ...] = ()) -> Dict[str, Tuple[str, ...]]:
+    paths: Dict[str, Tuple[str, ...]] = {}
+    for key, value in layout.items():
+        if isinstance(value, dict):
+            paths.update(_leaf_paths(value, prefix + (key,)))
+        else:
+            paths[value] = prefix + (key,)
+    return paths
+
+
+# Field name -> key path in the JSON record, e.g. "cea" -> ("biomarkers", "cea")
+FIELD_PATHS = _leaf_paths(RECORD_LAYOUT)
+
+RECORD_DTYPE = np.dtype(
+    [(name, "f8") for name in NUMERIC_FIELDS]
+    + [(name, "?") for name in FLAG_FIELDS]
+    + [(name, "i2") for name in ENUM_FIELDS]
+)
+
+
+@dataclass(frozen=True, slots=True)
+class ClinicalRecord:
+    """One patient's structured fields; the report text is fetched separately."""
+
+    patient_id: str
+    age: Optional[float]
+    sex: Optional[str]
+    length: Optional[float]
+    thickness: Optional[float]
+    location: Optional[str]
+    cea: Optional[float]
+    ca199: Optional[float]
+    cea_positive: bool
+    ca199_positive: bool
+    differentiation: Optional[str]
+    lauren: Optional[str]
+    pT: Optional[str]
+    pN: Optional[str]
+    pM: Optional[str]
+    pStage: Optional[str]
+
+
+def _get(record: Mapping[str, object], path: Tuple[str, ...]) -> object:
+    value: object = record
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def validate_record(pid: str, record: object) -> List[str]:
+    """Schema problems of one JSON record (empty when it is valid)."""
+    if not isinstance(record, dict):
+        return [f"{pid}: record is {type(record).__name__}, not an object"]
+    errors = []
+    unknown = set(record) - set(RECORD_LAYOUT) - set(EXTRA_KEYS)
+    if unknown:
+        errors.append(f"{pid}: unknown key(s) {', '.join(sorted(unknown))}")
+    for name, path in FIELD_PATHS.items():
+        value = _get(record, path)
+        if name in NUMERIC_FIELDS:
+            ok = value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+        elif name in FLAG_FIELDS:
+            ok = isinstance(value, bool)
+        else:
+            ok = value is None or isinstance(value, str)
+        if not ok:
+            errors.append(f"{pid}: {'.'.join(path)} has invalid value {value!r}")
+    return errors
+
+
+def _stage_numbers(categories: List[str], codes: Mapping[int, str], letter: str) -> np.ndarray:
+    """Stage number per category: "T4a", "4" (coded) and "4.0" all give 4; unknown gives NaN."""
+    numbers = [stage_number(category, codes, letter) for category in categories]
+    return np.array([np.nan if number is None else number for number in numbers], dtype=float)
+
+
+class ClinicalTable:
+    """One cohort as a structured array plus lazily read report text."""
+
+    def __init__(
+        self,
+        json_path: Path,
+        patient_ids: np.ndarray,
+        data: np.ndarray,
+        categories: Dict[str, List[str]],
+        texts: Optional[Dict[str, str]] = None,
+    ):
+        self.json_path = json_path
+        self.patient_ids = patient_ids
+        self.data = data
+        self.categories = categories
+        self._texts = texts
+        self._rows: Optional[Dict[str, int]] = None
+        self._store: Optional[ClinicalStore] = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, patient_id: object) -> bool:
+        return str(patient_id) in self._index()
+
+    def _index(self) -> Dict[str, int]:
+        if self._rows is None:
+            self._rows = {pid: row for row, pid in enumerate(self.patient_ids.tolist())}
+        return self._rows
+
+    def row(self, patient_id: object) -> int:
+        """Row of a patient; raises KeyError for unknown IDs."""
+        return self._index()[str(patient_id)]
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.patient_ids.nbytes
+
+    # ----- columns -----
+
+    def column(self, field: str) -> np.ndarray:
+        """Numeric and flag fields as they are stored; enum fields decoded to an object array (None when missing)."""
+        if field not in ENUM_FIELDS:
+            return self.data[field]
+        lookup = np.array(self.categories[field] + [None], dtype=object)
+        return lookup[self.data[field]]
+
+    def codes(self, field: str) -> np.ndarray:
+        """int16 codes of an enum field into ``categories[field]``, -1 when missing."""
+        return self.data[field]
+
+    def t_stage(self) -> np.ndarray:
+        """pT as T0-T4 numbers (T4a/T4b count as 4), NaN when missing or unparseable."""
+        return self._stage_vector("pT", T_STAGE_CODES_2019, "T")
+
+    def n_stage(self) -> np.ndarray:
+        """pN as N0-N3 numbers, NaN when missing, unparseable or only known as N+."""
+        return self._stage_vector("pN", N_STAGE_CODES_2019, "N")
+
+    def _stage_vector(self, field: str, codes: Mapping[int, str], letter: str) -> np.ndarray:
+        numbers = np.append(_stage_numbers(self.categories[field], codes, letter), np.nan)
+        return numbers[self.data[field]]
+
+    # ----- records -----
+
+    def record(self, patient_id: object) -> ClinicalRecord:
+        row = self.data[self.row(patient_id)]
+        values = {}
+        for name in NUMERIC_FIELDS:
+            value = float(row[name])
+            values[name] = None if np.isnan(value) else value
+        for name in FLAG_FIELDS:
+            values[name] = bool(row[name])
+        for name in ENUM_FIELDS:
+            code = int(row[name])
+            values[name] = None if code < 0 else self.categories[name][code]
+        return ClinicalRecord(patient_id=str(patient_id), **values)
+
+    def _raw(self, patient_id: str) -> Optional[Dict[str, object]]:
+        if self._store is None:
+            self._store = ClinicalStore(self.json_path)
+        return self._store.get(patient_id)
+
+    def pathology_text(self, patient_id: object) -> str:
+        pid = str(patient_id)
+        self.row(pid)
+        if self._texts is not None:
+            return self._texts.get(pid, "")
+        raw = self._raw(pid) or {}
+        return (raw.get("pathology") or {}).get(TEXT_FIELD) or ""
+
+    def to_dict(self, patient_id: object) -> Dict[str, object]:
+        """The record in the JSON layout (concept_features included when the store is available)."""
+        record = self.record(patient_id)
+        values = {name: getattr(record, name) for name in FIELD_PATHS if name != TEXT_FIELD}
+        values[TEXT_FIELD] = self.pathology_text(patient_id)
+
+        def build(layout: Mapping[str, object]) -> Dict[str, object]:
+            return {key: build(value) if isinstance(value, dict) else values[value] for key, value in layout.items()}
+
+        result = build(RECORD_LAYOUT)
+        if self._texts is None:
+            raw = self._raw(str(patient_id)) or {}
+            result.update({key: raw[key] for key in EXTRA_KEYS if key in raw})
+        return result
+
+    def close(self) -> None:
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+def build_table(json_path: Path, records: Mapping[str, object]) -> Tuple[np.ndarray, np.ndarray, Dict[str, List[str]]]:
+    """Validate the JSON records and convert them to (patient_ids, structured array, categories)."""
+    errors = [error for pid, record in records.items() for error in validate_record(pid, record)]
+    if errors:
+        more = f" (and {len(errors) - 5} more)" if len(errors) > 5 else ""
+        raise ValueError(f"{json_path}: invalid clinical records: {'; '.join(errors[:5])}{more}")
+
+    data = np.zeros(len(records), dtype=RECORD_DTYPE)
+    columns = {name: [_get(record, FIELD_PATHS[name]) for record in records.values()] for name in FIELD_PATHS}
+    for name in NUMERIC_FIELDS:
+        data[name] = np.array([np.nan if v is None else v for v in columns[name]], dtype="f8")
+    for name in FLAG_FIELDS:
+        data[name] = columns[name]
+    categories: Dict[str, List[str]] = {}
+    for name in ENUM_FIELDS:
+        values = columns[name]
+        categories[name] = sorted({v for v in values if v is not None})
+        lookup = {category: code for code, category in enumerate(categories[name])}
+        data[name] = [-1 if v is None else lookup[v] for v in values]
+    patient_ids = np.array(list(records), dtype=str)
+    return patient_ids, data, categories
+
+
+def cache_path(json_path: Path) -> Path:
+    stem = json_path.with_suffix("")
+    return stem.with_name(stem.name + CACHE_SUFFIX)
+
+
+def _load_cache(json_path: Path) -> Optional[Tuple[np.ndarray, np.ndarray, Dict[str, List[str]]]]:
+    path = cache_path(json_path)
+    if not path.exists() or path.stat().st_mtime_ns < json_path.stat().st_mtime_ns:
+        return None
+    with np.load(path, allow_pickle=False) as npz:
+        meta = json.loads(str(npz["meta"]))
+        if meta.get("version") != CACHE_VERSION or npz["data"].dtype != RECORD_DTYPE:
+            return None
+        return npz["patient_ids"], npz["data"], meta["categories"]
+
+
+def _write_cache(json_path: Path, patient_ids: np.ndarray, data: np.ndarray, categories: Dict[str, List[str]]) -> None:
+    path = cache_path(json_path)
+    meta = json.dumps({"version": CACHE_VERSION, "categories": categories}, ensure_ascii=False)
+    tmp = path.with_name(f".{path.name}.tmp{os.getpid()}.npz")
+    try:
+        np.savez(tmp, patient_ids=patient_ids, data=data, meta=np.array(meta))
+        os.replace(tmp, path)
+    except OSError as e:
+        # A read-only data directory only costs the next process a JSON parse
+        print(f"[WARN] Could not cache {path.name}: {e}")
+
+
+def load_cohort(json_path: Union[str, Path], cache: bool = True) -> ClinicalTable:
+    """
+    Compact table for one clinical JSON. Raises ValueError when a record does not
+    match RECORD_LAYOUT.
+    """
+    json_path = Path(json_path)
+    fresh_store = is_fresh(json_path)
+    cached = _load_cache(json_path) if cache and fresh_store else None
+    if cached is not None:
+        return ClinicalTable(json_path, *cached)
+
+    records = json.loads(json_path.read_text(encoding="utf-8"))
+    patient_ids, data, categories = build_table(json_path, records)
+    texts = None
+    if fresh_store:
+        if cache:
+            _write_cache(json_path, patient_ids, data, categories)
+    else:
+        # No store to read from later: keep the reports, deduplicated
+        texts = {
+            pid: sys.intern((record.get("pathology") or {}).get(TEXT_FIELD) or "")
+            for pid, record in records.items()
+        }
+    return ClinicalTable(json_path, patient_ids, data, categories, texts)
+
+
+def _deep_size(value: object) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_size(v) for v in value)
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert clinical JSON to the compact record tables and report memory use.")
+    parser.add_argument(
+        "files",
+        type=Path,
+        nargs="*",
+        help=f"Clinical JSON files (default: every clinical_data*.json in {CLINICAL_DIR})",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the .records.npz cache.")
+    args = parser.parse_args()
+
+    files = args.files or sorted(
+        path for path in CLINICAL_DIR.glob("clinical_data*.json") if not path.name.endswith(".min.json")
+    )
+    for json_path in files:
+        if not json_path.exists():
+            print(f"[WARN] Missing clinical JSON: {json_path}")
+            continue
+        records = json.loads(json_path.read_text(encoding="utf-8"))
+        table = load_cohort(json_path, cache=not args.no_cache)
+        dict_bytes = _deep_size(records)
+        stages = table.t_stage()
+        known = stages[~np.isnan(stages)].astype(int)
+        distribution = ", ".join(f"T{t}: {n}" for t, n in enumerate(np.bincount(known, minlength=5)) if n)
+        print(
+            f"{json_path.name}: {len(table)} patients, {dict_bytes / len(table):.0f} B/patient as dicts, "
+            f"{table.nbytes / len(table):.0f} B/patient compact (reports read on demand); pT {distribution or '-'}"
+        )
+        table.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Patient-keyed store next to each ``clinical_data*.json`` for per-patient lookups.
+
+For ``clinical_data_2024.json`` the store is two files:
+
+    clinical_data_2024.records.jsonl   one compact JSON record per line
+    clinical_data_2024.records.idx     JSON: {"version", "size", "offsets": {patient_id: [offset, length]}}
+
+A lookup reads the small index once and then only the bytes of the requested
+records, so the cost of fetching a patient does not depend on the cohort size.
+The JSON file stays the source of truth; the converters and
+merge_clinical_features.py rewrite the store whenever they rewrite it, and
+readers (this module and ``gastric-scan-next/lib/clinical-store.ts``) fall back
+to the JSON when the store is missing or older than it.
+
+SQLite would be the obvious choice in Python, but the Next.js server runs on
+Node 20 without a built-in SQLite driver; plain byte offsets are read there
+with ``fs.readSync`` and no extra dependency.
+
+    from clinical_store import ClinicalStore
+    with ClinicalStore("gastric-scan-next/data/clinical_data_2024.json") as store:
+        record = store.get("1375062")
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+PROJECT_ROOT = Path("/Users/huangyijun/Projects/胃癌T分期")
+CLINICAL_DIR = PROJECT_ROOT / "gastric-scan-next" / "data"
+RECORDS_SUFFIX = ".records.jsonl"
+INDEX_SUFFIX = ".records.idx"
+STORE_VERSION = 1
+
+Record = Dict[str, object]
+
+
+def store_paths(json_path: Union[str, Path]) -> Tuple[Path, Path]:
+    """(records, index) paths of the store belonging to a clinical JSON file."""
+    json_path = Path(json_path)
+    stem = json_path.with_suffix("")
+    return stem.with_name(stem.name + RECORDS_SUFFIX), stem.with_name(stem.name + INDEX_SUFFIX)
+
+
+def _replace(path: Path, payload: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.tmp{os.getpid()}")
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+
+def write_store(data: Mapping[str, Record], json_path: Union[str, Path]) -> Path:
+    """Write the store for ``data`` (the content of ``json_path``); returns the records path."""
+    records_path, index_path = store_paths(json_path)
+    lines: List[bytes] = []
+    offsets: Dict[str, List[int]] = {}
+    offset = 0
+    for pid, record in data.items():
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        offsets[str(pid)] = [offset, len(line)]
+        lines.append(line)
+        offset += len(line) + 1
+    payload = b"".join(line + b"\n" for line in lines)
+    index = {"version": STORE_VERSION, "size": len(payload), "offsets": offsets}
+    # Records first: a reader that sees the new index always finds matching records
+    _replace(records_path, payload)
+    _replace(index_path, json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return records_path
+
+
+def build_store(json_path: Union[str, Path]) -> Path:
+    """Build the store from an existing clinical JSON file."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        return write_store(json.load(f), json_path)
+
+
+def is_fresh(json_path: Union[str, Path]) -> bool:
+    """True when the store exists and was written after the JSON file."""
+    records_path, index_path = store_paths(json_path)
+    if not (records_path.exists() and index_path.exists()):
+        return False
+    return index_path.stat().st_mtime_ns >= Path(json_path).stat().st_mtime_ns
+
+
+class ClinicalStore:
+    """
+    Read-only view of one store; records are decoded only when requested.
+    Raises FileNotFoundError when the store is missing and ValueError when the
+    index does not match the records file.
+    """
+
+    def __init__(self, json_path: Union[str, Path]):
+        self.json_path = Path(json_path)
+        records_path, index_path = store_paths(json_path)
+        if not index_path.exists():
+            raise FileNotFoundError(f"Clinical store '{index_path}' does not exist; run clinical_store.py.")
+        index = json.loads(index_path.read_text(encoding="utf-8"))
+        if index.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported clinical store version in '{index_path}'")
+        self._offsets: Dict[str, List[int]] = index["offsets"]
+        self._file = open(records_path, "rb")
+        if os.fstat(self._file.fileno()).st_size != index["size"]:
+            self._file.close()
+            raise ValueError(f"Clinical store '{records_path}' does not match its index; rebuild it.")
+
+    def __enter__(self) -> "ClinicalStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, patient_id: object) -> bool:
+        return str(patient_id) in self._offsets
+
+    def patient_ids(self) -> List[str]:
+        return list(self._offsets)
+
+    def get(self, patient_id: object, default: Optional[Record] = None) -> Optional[Record]:
+        entry = self._offsets.get(str(patient_id))
+        if entry is None:
+            return default
+        offset, length = entry
+        return json.loads(os.pread(self._file.fileno(), length, offset))
+
+    def get_many(self, patient_ids: Iterable[object]) -> Dict[str, Record]:
+        """Records of the given patients that exist, keyed by patient ID."""
+        found = {}
+        for pid in patient_ids:
+            record = self.get(pid)
+            if record is not None:
+                found[str(pid)] = record
+        return found
+
+    def items(self) -> Iterator[Tuple[str, Record]]:
+        for pid in self._offsets:
+            yield pid, self.get(pid)
+
+
+def lookup(json_path: Union[str, Path], patient_ids: Iterable[object]) -> Dict[str, Record]:
+    """Records for ``patient_ids``, from the store when it is fresh and from the JSON otherwise."""
+    if is_fresh(json_path):
+        with ClinicalStore(json_path) as store:
+            return store.get_many(patient_ids)
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {str(pid): data[str(pid)] for pid in patient_ids if str(pid) in data}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build patient-keyed stores next to the clinical JSON files.")
+    parser.add_argument(
+        "files",
+        type=Path,
+        nargs="*",
+        help=f"Clinical JSON files (default: every clinical_data*.json in {CLINICAL_DIR})",
+    )
+    args = parser.parse_args()
+
+    files = args.files or sorted(
+        path for path in CLINICAL_DIR.glob("clinical_data*.json") if not path.name.endswith(".min.json")
+    )
+    for json_path in files:
+        if not json_path.exists():
+            print(f"[WARN] Missing clinical JSON: {json_path}")
+            continue
+        records_path = build_store(json_path)
+        with ClinicalStore(json_path) as store:
+            print(f"{json_path.name}: {len(store)} records -> {records_path.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Accuracy and throughput benchmark for the pathology concept extractor.
+
+``concept_gold.jsonl`` holds synthetic report sentences in the hospital's
+phrasing, one JSON object per line:
+
+    {"id": "g003", "text": "...CPS<1，间质免疫细胞PD-1个别阳性...",
+     "expect": {"cps_value": 1.0, "cps_comparator": "<", "pd1_status": "scattered"}}
+
+``expect`` lists the typed values of concept_values.py that the report states;
+a field that is not listed must come out empty. For every field a prediction
+equal to the label is a true positive, any other non-empty prediction a false
+positive, and a label that was not predicted exactly a false negative (a wrong
+value counts as both). Failing cases are written with the evidence string and
+its offsets in the cleaned report.
+
+Throughput is measured for extraction plus typing on corpora of several sizes,
+built by repeating the gold sentences or the reports in ``--corpus`` JSON files.
+
+    python scripts/concept_benchmark.py --sizes 1000 10000 --failures failures.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from concept_values import TABLE_COLUMNS, normalize_concepts
+from extract_pathology_concepts import clean_series, extract_concepts
+
+GOLD_PATH = Path(__file__).parent / "concept_gold.jsonl"
+FIELDS = TABLE_COLUMNS[1:]
+
+
+def field_concept(field: str) -> str:
+    """Extractor concept a typed field is derived from, e.g. cps_comparator -> cps."""
+    return field.split("_")[0]
+
+
+def load_gold(path: Path) -> list[dict[str, object]]:
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            unknown = set(case["expect"]) - set(FIELDS)
+            if unknown:
+                raise ValueError(f"{path}:{number}: unknown field(s) {', '.join(sorted(unknown))}")
+            cases.append(case)
+    return cases
+
+
+def run_extractor(texts: pd.Series, workers: int | None = 1) -> tuple[pd.DataFrame, pd.DataFrame, pd.Series]:
+    """Concepts with offsets, typed values and the cleaned reports the offsets refer to."""
+    cleaned = clean_series(texts)
+    concepts = extract_concepts(texts, workers, offsets=True)
+    return concepts, normalize_concepts(concepts, cleaned), cleaned
+
+
+def _plain(value: object) -> object:
+    return None if pd.isna(value) else value.item() if hasattr(value, "item") else value
+
+
+def _same(expected: object, predicted: object) -> bool:
+    if isinstance(expected, float) and isinstance(predicted, float):
+        return math.isclose(expected, predicted, abs_tol=1e-6)
+    return expected == predicted
+
+
+def evaluate(
+    cases: list[dict[str, object]], workers: int | None = 1
+) -> tuple[dict[str, dict[str, float]], list[dict[str, object]]]:
+    """
+    Per-field counts and scores, plus one failure record per wrong field.
+
+    Each report is extracted on its own, like a one-row workbook, so concepts
+    absent from a report also come back as all-empty columns.
+    """
+    counts = {field: {"tp": 0, "fp": 0, "fn": 0} for field in FIELDS}
+    failures = []
+    for case in cases:
+        concepts, values, cleaned = run_extractor(pd.Series([case["text"]]), workers)
+        row = 0
+        for field in FIELDS:
+            expected = case["expect"].get(field)
+            predicted = _plain(values.at[row, field])
+            if predicted is None and expected is None:
+                continue
+            if predicted is not None and expected is not None and _same(expected, predicted):
+                counts[field]["tp"] += 1
+                continue
+            if predicted is not None:
+                counts[field]["fp"] += 1
+            if expected is not None:
+                counts[field]["fn"] += 1
+
+            concept = field_concept(field)
+            evidence = _plain(concepts.at[row, concept])
+            start = _plain(concepts.at[row, f"{concept}_start"])
+            failures.append({
+                "id": case["id"],
+                "field": field,
+                "expected": expected,
+                "predicted": predicted,
+                "evidence": evidence,
+                "start": None if start is None else int(start),
+                "end": None if start is None else int(start) + len(evidence),
+                "text": cleaned.iat[row],
+            })
+
+    scores = {}
+    for field, c in counts.items():
+        precision = c["tp"] / (c["tp"] + c["fp"]) if c["tp"] + c["fp"] else float("nan")
+        recall = c["tp"] / (c["tp"] + c["fn"]) if c["tp"] + c["fn"] else float("nan")
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        scores[field] = {**c, "precision": precision, "recall": recall, "f1": f1}
+    return scores, failures
+
+
+def load_corpus(paths: list[Path]) -> list[str]:
+    """Pathology reports from clinical JSON files (record["pathology"]["type"])."""
+    texts = []
+    for path in paths:
+        records = json.loads(path.read_text(encoding="utf-8"))
+        texts.extend(
+            text for record in records.values()
+            if (text := (record.get("pathology") or {}).get("type"))
+        )
+    return texts
+
+
+def measure_throughput(
+    texts: list[str], sizes: list[int], workers: int | None = 1, repeat: int = 3
+) -> list[dict[str, float]]:
+    """Best-of-``repeat`` reports/second for corpora of each size."""
+    results = []
+    # Warm-up so the first size does not pay for imports and regex compilation
+    run_extractor(pd.Series(texts), workers)
+    for size in sizes:
+        corpus = pd.Series((texts * (size // len(texts) + 1))[:size])
+        best = math.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run_extractor(corpus, workers)
+            best = min(best, time.perf_counter() - start)
+        results.append({"reports": size, "seconds": best, "reports_per_s": size / best})
+    return results
+
+
+def print_scores(scores: dict[str, dict[str, float]]) -> None:
+    print(f"{'field':<20}{'tp':>5}{'fp':>5}{'fn':>5}{'precision':>11}{'recall':>8}{'f1':>7}")
+    for field, s in scores.items():
+        print(
+            f"{field:<20}{s['tp']:>5}{s['fp']:>5}{s['fn']:>5}"
+            f"{s['precision']:>11.3f}{s['recall']:>8.3f}{s['f1']:>7.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark concept extraction accuracy and throughput.")
+    parser.add_argument("--gold", type=Path, default=GOLD_PATH, help="Labeled gold file (JSON Lines).")
+    parser.add_argument(
+        "--sizes", type=int, nargs="*", default=[100, 1000, 10000],
+        help="Corpus sizes for the throughput runs (none to skip).",
+    )
+    parser.add_argument(
+        "--corpus", type=Path, nargs="+", default=None,
+        help="Clinical JSON files whose reports form the throughput corpus (default: the gold sentences).",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Processes for extraction.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per size; the fastest is reported.")
+    parser.add_argument("--failures", type=Path, default=None, help="Write failing cases here as JSON Lines.")
+    parser.add_argument(
+        "--min-f1", type=float, default=None,
+        help="Exit with status 1 when a labeled field scores below this F1.",
+    )
+    args = parser.parse_args()
+
+    cases = load_gold(args.gold)
+    scores, failures = evaluate(cases, args.workers)
+    print(f"{len(cases)} gold reports, {len(failures)} failing field(s)")
+    print_scores(scores)
+
+    if args.failures:
+        with open(args.failures, "w", encoding="utf-8") as f:
+            for failure in failures:
+                f.write(json.dumps(failure, ensure_ascii=False) + "\n")
+        print(f"Failures written to {args.failures}")
+    else:
+        for failure in failures:
+            span = f"[{failure['start']}:{failure['end']}] {failure['evidence']!r}" if failure["evidence"] else "-"
+            print(f"  {failure['id']} {failure['field']}: expected {failure['expected']!r}, "
+                  f"got {failure['predicted']!r}, evidence {span}")
+
+    if args.sizes:
+        texts = load_corpus(args.corpus) if args.corpus else [case["text"] for case in cases]
+        print(f"\nThroughput ({args.workers} worker(s), corpus of {len(texts)} distinct reports)")
+        for result in measure_throughput(texts, args.sizes, args.workers, args.repeat):
+            print(f"  {result['reports']:>8} reports  {result['seconds']:8.3f}s  {result['reports_per_s']:>10.0f} reports/s")
+
+    if args.min_f1 is not None:
+        low = [
+            field for field, s in scores.items()
+            if s["tp"] + s["fn"] and not s["f1"] >= args.min_f1
+        ]
+        if low:
+            print(f"F1 below {args.min_f1}: {', '.join(low)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
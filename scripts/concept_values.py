@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Typed values for extracted pathology concepts.
+
+The extractor keeps the matched evidence string ("Ki67约60%", "CPS＜1",
+"PD-1散在阳性"); this module turns a whole column of evidence into typed
+columns with ``Series.str`` operations:
+
+    ki67_pct            float, 0-100 (the midpoint for ranges such as 30-40%)
+    cps_value           float
+    cps_comparator      "<", "<=", ">", ">=" or "="
+    <marker>_status     "negative" / "scattered" / "positive" for PD-1, FoxP3, CD3, CD4, CD8
+    vascular_invasion   True / False
+    neural_invasion     True / False
+
+Missing or unparseable values are left empty. Invasion is read from the
+clauses around every vascular/neural marker in the cleaned report, found
+independently of the evidence match: the extractor only matches when 见/有/无
+follows the marker, so "未见明显脉管内瘤栓" or "间质见脉管瘤栓及神经侵犯" have no
+evidence at all. Ki-67 falls back to the whole clause after the marker when the
+evidence stops early, as in "Ki-67(+,约30-40%)".
+"""
+
+from __future__ import annotations
+
+import re
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+STATUS_MARKERS = ("pd1", "foxp3", "cd3", "cd4", "cd8")
+INVASION_MARKERS = ("vascular", "neural")
+STATUSES = ["negative", "scattered", "positive"]
+COMPARATORS = ["<", "<=", "=", ">=", ">"]
+
+KI67_PATTERN = r"(?P<low>\d+(?:\.\d+)?)\s*(?:[-~～]\s*(?P<high>\d+(?:\.\d+)?)\s*)?[%％]"
+KI67_APPROX_PATTERN = r"约\s*(\d+(?:\.\d+)?)\s*阳性"
+CPS_PATTERN = r"CPS\D*?(?P<comparator>[<>≤≥＜＞]=?)?\s*(?P<value>\d+(?:\.\d+)?)"
+COMPARATOR_MAP = {"<": "<", "＜": "<", "<=": "<=", "≤": "<=", ">": ">", "＞": ">", ">=": ">=", "≥": ">="}
+
+SCATTERED_PATTERN = r"散在|少量|个别"
+NEGATIVE_PATTERN = r"阴性|\(-\)|-$"
+POSITIVE_PATTERN = r"阳性|\+$"
+
+CLAUSE_BREAK = re.compile(r"[,.;:!?]")
+INVASION_NEGATION = r"未见|未|无|阴性"
+INVASION_POSITIVE = r"见|有|侵犯|浸润|瘤栓|阳性"
+# The extractor's TRIGGERS for the invasion concepts (extract_pathology_concepts imports
+# this module, so they are restated here), minus "脉管内皮" (CD31 staining) and "神经内分泌"
+INVASION_TRIGGERS = {
+    "vascular": re.compile(r"(?:脉管|血管)(?!内皮)"),
+    "neural": re.compile(r"神经(?!内分泌)"),
+}
+# Text from a marker to the end of its clause; parentheses and decimal points do not end it
+MARKER_CLAUSE = re.compile(r"(?:[^,;.()]|\.(?=\d)|\([^()]*\))*")
+
+# Column order of the concept table
+TABLE_COLUMNS = [
+    "patient_id",
+    "ki67_pct",
+    "cps_value",
+    "cps_comparator",
+    *(f"{marker}_status" for marker in STATUS_MARKERS),
+    *(f"{marker}_invasion" for marker in INVASION_MARKERS),
+]
+
+
+def ki67_percent(evidence: pd.Series) -> pd.Series:
+    parts = evidence.str.extract(KI67_PATTERN)
+    # "Ki67约60阳性" drops the percent sign
+    approx = evidence.str.extract(KI67_APPROX_PATTERN, expand=False)
+    low = pd.to_numeric(parts["low"].fillna(approx), errors="coerce").astype("float64")
+    high = pd.to_numeric(parts["high"], errors="coerce").astype("float64")
+    value = ((low + high) / 2).fillna(low)
+    # OCR slips such as "Ki67约704性" are not percentages
+    return value.where(value.between(0, 100))
+
+
+def cps_score(evidence: pd.Series) -> tuple[pd.Series, pd.Series]:
+    parts = evidence.str.extract(CPS_PATTERN, flags=re.IGNORECASE)
+    value = pd.to_numeric(parts["value"], errors="coerce").astype("float64")
+    comparator = parts["comparator"].map(COMPARATOR_MAP).where(value.notna())
+    comparator = comparator.mask(value.notna() & comparator.isna(), "=")
+    return value, pd.Categorical(comparator, categories=COMPARATORS)
+
+
+def marker_status(evidence: pd.Series) -> pd.Categorical:
+    """The extractor's patterns stop at the first status word, so the end of the evidence decides."""
+    text = evidence.fillna("")
+    status = pd.Series(pd.NA, index=evidence.index, dtype=object)
+    status = status.mask(text.str.contains(POSITIVE_PATTERN, regex=True), "positive")
+    status = status.mask(text.str.contains(SCATTERED_PATTERN, regex=True), "scattered")
+    status = status.mask(text.str.contains(NEGATIVE_PATTERN, regex=True), "negative")
+    return pd.Categorical(status.where(evidence.notna()), categories=STATUSES)
+
+
+def invasion(cleaned: pd.Series, marker: str) -> pd.Series:
+    """
+    For every occurrence of the marker, the clause before it plus the clause it
+    starts, e.g. "间质未见明显脉管内瘤栓及神经侵犯" or "脉管内见瘤栓"; a negation in
+    it means no invasion. Any positive occurrence makes the report positive.
+    """
+    trigger = INVASION_TRIGGERS[marker]
+    results = []
+    for text in cleaned.tolist():
+        found = pd.NA
+        for match in trigger.finditer(text):
+            before = CLAUSE_BREAK.split(text[: match.start()])[-1]
+            after = CLAUSE_BREAK.split(text[match.start():], maxsplit=1)[0]
+            clause = before + after
+            if re.search(INVASION_NEGATION, clause):
+                found = False if found is pd.NA else found
+            elif re.search(INVASION_POSITIVE, clause):
+                found = True
+                break
+        results.append(found)
+    return pd.Series(results, index=cleaned.index, dtype="boolean")
+
+
+def marker_clause(cleaned: pd.Series, starts: pd.Series) -> pd.Series:
+    """Text from each evidence offset to the end of its clause (NA without evidence)."""
+    clauses = [
+        None if pd.isna(start) else MARKER_CLAUSE.match(text, int(start)).group()
+        for text, start in zip(cleaned.tolist(), starts.tolist())
+    ]
+    return pd.Series(clauses, index=cleaned.index, dtype="string")
+
+
+def normalize_concepts(concepts: pd.DataFrame, cleaned: pd.Series) -> pd.DataFrame:
+    """
+    Typed columns for a frame from ``extract_concepts(..., offsets=True)``.
+
+    ``cleaned`` is the cleaned report column the offsets refer to.
+    """
+    def evidence(concept: str) -> pd.Series:
+        # A concept that never matched comes back as an all-NaN float column
+        return concepts[concept].astype("string")
+
+    values = pd.DataFrame(index=concepts.index)
+    values["ki67_pct"] = ki67_percent(evidence("ki67")).fillna(
+        ki67_percent(marker_clause(cleaned, concepts["ki67_start"]))
+    )
+    values["cps_value"], values["cps_comparator"] = cps_score(evidence("cps"))
+    for marker in STATUS_MARKERS:
+        values[f"{marker}_status"] = marker_status(evidence(marker))
+    for marker in INVASION_MARKERS:
+        values[f"{marker}_invasion"] = invasion(cleaned, marker)
+    return values
+
+
+def typed_features(values: pd.DataFrame) -> list[dict[str, object]]:
+    """Per-row dicts of the non-empty typed values, ready to merge into concept_features."""
+    columns = {name: values[name].astype(object).where(values[name].notna(), None).tolist() for name in values}
+    return [
+        {name: value for name, value in zip(columns, row) if value is not None}
+        for row in zip(*columns.values())
+    ]
+
+
+def with_table_dtypes(table: pd.DataFrame) -> pd.DataFrame:
+    table = table.reindex(columns=TABLE_COLUMNS)
+    table["patient_id"] = table["patient_id"].astype(str)
+    table["ki67_pct"] = pd.to_numeric(table["ki67_pct"]).astype("Float64")
+    table["cps_value"] = pd.to_numeric(table["cps_value"]).astype("Float64")
+    table["cps_comparator"] = pd.Categorical(table["cps_comparator"], categories=COMPARATORS)
+    for marker in STATUS_MARKERS:
+        table[f"{marker}_status"] = pd.Categorical(table[f"{marker}_status"], categories=STATUSES)
+    for marker in INVASION_MARKERS:
+        table[f"{marker}_invasion"] = table[f"{marker}_invasion"].astype("boolean")
+    return table
+
+
+def concept_table(results: dict[str, dict[str, object]]) -> pd.DataFrame:
+    """One row per patient with the typed concept columns, from parse_excel() results."""
+    rows = [{"patient_id": pid, **entry.get("concept_features", {})} for pid, entry in results.items()]
+    return with_table_dtypes(pd.DataFrame(rows, columns=TABLE_COLUMNS if not rows else None))
+
+
+def default_table_path(directory: Path) -> Path:
+    return directory / ("pathology_concept_table.parquet" if pyarrow is not None else "pathology_concept_table.csv")
+
+
+def write_table(table: pd.DataFrame, path: Path) -> None:
+    """Parquet keeps the categorical and nullable dtypes; CSV is the fallback without pyarrow."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+
+def load_table(path: Path) -> pd.DataFrame:
+    """Read a table written by write_table with its dtypes restored."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    return with_table_dtypes(pd.read_csv(path, dtype={"patient_id": str}))
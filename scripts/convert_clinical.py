@@ -0,0 +1,459 @@
+"""
+临床数据 Excel → JSON 统一转换器（取代各 cohort 脚本里逐行 iterrows 的映射）
+
+每个 cohort 在 COHORTS 里声明：Excel 路径、输出路径、病人ID列，以及每个字段
+对应的源列和编码表。转换按列进行（pd.to_numeric / Series.map / 向量化比较），
+耗时随列数而不是 行数×列数 增长；新增 cohort 只需加一条配置。
+
+用法:
+    python scripts/convert_clinical.py            # 转换全部 cohort
+    python scripts/convert_clinical.py 2019 2024  # 只转换指定 cohort
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from clinical_store import write_store
+from excel_snapshot import read_excel, sheet_names
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PROJECT_ROOT = "/Users/huangyijun/Projects/胃癌T分期"
+OUTPUT_DIR = os.path.join(PROJECT_ROOT, "gastric-scan-next", "data")
+
+# 源列不存在时的默认处理：按全空列转换（与 row.get() 返回 None 的旧行为一致）
+FROM_EMPTY = object()
+
+# ===== 编码表 =====
+SEX_CODES = {"男": "Male", "1": "Male", "1.0": "Male", "女": "Female", "0": "Female", "0.0": "Female"}
+SEX_CODES_EN = {**SEX_CODES, "male": "Male", "female": "Female"}
+
+LOCATION_CODES = {0: "Cardia/Fundus", 1: "Body", 2: "Angle/Antrum", 3: "Whole Stomach"}
+LOCATION_CODES_2019 = {0: "Cardia/Fundus", 1: "Body/Angle", 2: "Antrum/Pylorus", 3: "Multiple Sites"}
+
+DIFFERENTIATION_CODES = {
+    1: "Well Differentiated",
+    2: "Moderately Differentiated",
+    3: "Mod-Poorly Differentiated",
+    4: "Poorly Differentiated",
+    5: "Undetermined",
+}
+
+T_STAGE_CODES_2019 = {0: "Normal", 1: "T1", 2: "T2", 3: "T3", 4: "T4a", 5: "T4b"}
+
+N_STAGE_CODES_2019 = {
+    0: "N0",
+    1: "N1",  # 1-6 nodes
+    2: "N2",  # 7-15 nodes
+    3: "N3",  # 16+ nodes
+    4: "N+",  # Several nodes
+}
+
+# 分期写法："4"、"4.0"（按 2019 编码解释）、"T4a"、"ypT3"
+STAGE_PATTERN = re.compile(r"^(?:y?p)?(?P<prefix>[TN]?)(?P<number>\d)(?:\.0)?(?P<sub>[a-c]?)$")
+
+# ===== 常用列名 =====
+COL_SEX = "性别： 0=女， 1=男"
+COL_LOCATION = "肿瘤位置0=贲门、胃底，1=胃体，2=胃角、胃窦，3=全胃"
+COL_LOCATION_2019 = "超声位置分四类：0=贲门+胃底；1=胃体+胃角；2=胃窦+幽门；3=多部位"
+COL_CEA_POS = "CEA：0=阴性， 1=阳性"
+COL_CA199_POS = "CA199：0=阴性， 1=阳性"
+COL_CA199_POS_2019 = "CA199:  0=阴性，  1=阳性 "
+COL_DIFFERENTIATION = "分化程度（1=高分化，2=中分化，3=中-低分化，4=低分化，5=不确定）"
+COL_LAUREN = "Lauren分型（1.肠型，2.弥漫型，3混合型，4不确定）"
+COL_PT = ("pT:1=T1（局限在粘膜及粘膜下层），2=T2（肿瘤侵犯肌层及浆膜下层），3=T3（肿瘤侵透浆膜层），"
+          "4=T4a（侵犯较浅且到达了浆膜层），5=T4b（侵犯较深且到达了邻近组织或脏器）")
+COL_T_2019 = ("T:0=正常，1=T1（局限在粘膜及粘膜下层），2=T2（肿瘤侵犯肌层及浆膜下层），3=T3（肿瘤侵透浆膜层），"
+              "4=T4a（侵犯较浅且到达了浆膜层），5=T4b（侵犯较深且到达了邻近组织或脏器）")
+COL_N = "N:0=N0，1=N1，2=N2，3=N3a，4=3b"
+COL_N_2019 = "N:0=阴性，1=1-6个淋巴结转移，2=7-15个淋巴结转移，3=16个以上淋巴结转移，4=数个淋巴结"
+COL_M = "M：0=没有远处转移，   1=有远处转移"
+COL_STAGE = "pStage(1=I;2=II;3=III,4=IV)"
+
+
+@dataclass(frozen=True)
+class Column:
+    """
+    一个输出字段的来源和类型
+    kind:
+      number  数值，无法解析为 None
+      text    去空白的字符串，空值为 ""
+      code    数值编码（取整）查 codes，查不到为 "Unknown"
+      label   文本查 codes（小写后匹配），查不到为 "Unknown"
+      binary  数值 1 → labels[1]，其他数值 → labels[0]；非数值按 label 处理
+      flag    数值等于 1 为 True
+    sources: 候选列名，逐行按顺序取第一个非空值（同旧脚本的 `a or b`，数值 0 也算空）
+    per_row: False 时不逐行补空，只用第一个存在的列
+    absent: 所有候选列都不存在时的取值（默认按全空列转换）
+    """
+    kind: str
+    sources: tuple
+    codes: dict = None
+    labels: tuple = None
+    per_row: bool = True
+    absent: object = FROM_EMPTY
+
+
+def col(kind, *sources, **options):
+    return Column(kind, sources, **options)
+
+
+def optional(kind, *sources, **options):
+    """2024 两个 cohort 的表头不固定，缺列时字段输出 null（或 absent 指定的值）"""
+    options.setdefault("absent", None)
+    return Column(kind, sources, **options)
+
+
+@dataclass(frozen=True)
+class ClinicalCohort:
+    name: str
+    excel_path: str
+    output_path: str
+    patient_id: Column
+    fields: dict
+    all_sheets: bool = True
+
+
+# 输出 JSON 的结构：叶子是 fields 里的字段名，所有 cohort 共用
+RECORD_LAYOUT = {
+    "age": "age",
+    "sex": "sex",
+    "tumorSize": {"length": "length", "thickness": "thickness"},
+    "location": "location",
+    "biomarkers": {
+        "cea": "cea",
+        "ca199": "ca199",
+        "cea_positive": "cea_positive",
+        "ca199_positive": "ca199_positive",
+    },
+    "pathology": {
+        "type": "type",
+        "differentiation": "differentiation",
+        "lauren": "lauren",
+        "pT": "pT",
+        "pN": "pN",
+        "pM": "pM",
+        "pStage": "pStage",
+    },
+}
+
+COHORTS = {
+    "2025": ClinicalCohort(
+        name="2025",
+        excel_path=os.path.join(PROJECT_ROOT, "2025胃癌临床整理.xlsx"),
+        output_path=os.path.join(OUTPUT_DIR, "clinical_data.json"),
+        patient_id=col("text", "住院号"),
+        fields={
+            "age": col("number", "年龄"),
+            "sex": col("label", COL_SEX, codes=SEX_CODES),
+            "length": col("number", "长径：cm"),
+            "thickness": col("number", "厚径：cm"),
+            "location": col("code", COL_LOCATION, codes=LOCATION_CODES),
+            "cea": col("number", "CEA"),
+            "ca199": col("number", "CA199"),
+            "cea_positive": col("flag", COL_CEA_POS),
+            "ca199_positive": col("flag", COL_CA199_POS),
+            "type": col("text", "病理"),
+            "differentiation": col("code", COL_DIFFERENTIATION, codes=DIFFERENTIATION_CODES),
+            "lauren": col("text", COL_LAUREN),
+            "pT": col("text", COL_PT),
+            "pN": col("text", COL_N),
+            "pM": col("text", COL_M),
+            "pStage": col("text", COL_STAGE),
+        },
+    ),
+    "2019": ClinicalCohort(
+        name="2019",
+        excel_path=os.path.join(PROJECT_ROOT, "2019年直接手术", "2019.xlsx"),
+        output_path=os.path.join(OUTPUT_DIR, "clinical_data_2019.json"),
+        patient_id=col("text", "ID"),
+        all_sheets=False,
+        fields={
+            "age": col("number", "年龄：岁"),
+            "sex": col("binary", COL_SEX, codes=SEX_CODES, labels=("Female", "Male")),
+            "length": col("number", "长径：cm"),
+            "thickness": col("number", "厚径：cm"),
+            "location": col("code", COL_LOCATION_2019, codes=LOCATION_CODES_2019),
+            # 2019年数据中没有CEA/CA199数值，只有阳性/阴性
+            "cea": col("number"),
+            "ca199": col("number"),
+            "cea_positive": col("flag", COL_CEA_POS),
+            "ca199_positive": col("flag", COL_CA199_POS_2019),
+            "type": col("text", "病理"),
+            "differentiation": col("code", COL_DIFFERENTIATION, codes=DIFFERENTIATION_CODES),
+            "lauren": col("text", COL_LAUREN),
+            "pT": col("code", COL_T_2019, codes=T_STAGE_CODES_2019),
+            "pN": col("code", COL_N_2019, codes=N_STAGE_CODES_2019),
+            "pM": col("text", COL_M),
+            "pStage": col("text", COL_STAGE),
+        },
+    ),
+    "2019_nac": ClinicalCohort(
+        name="2019_nac",
+        excel_path=os.path.join(PROJECT_ROOT, "胃癌勾画新辅助治疗", "2019新辅助治疗", "2019新辅助.xlsx"),
+        output_path=os.path.join(OUTPUT_DIR, "clinical_data_2019_nac.json"),
+        # 优先使用ID列，没有则使用住院号
+        patient_id=col("text", "ID", "住院号"),
+        fields={
+            "age": col("number", "年龄：岁", "年龄"),
+            "sex": col("binary", COL_SEX, codes=SEX_CODES, labels=("Female", "Male")),
+            "length": col("number", "长径：cm", "长径"),
+            "thickness": col("number", "厚径：cm", "厚径"),
+            "location": col("code", COL_LOCATION_2019, codes=LOCATION_CODES_2019),
+            "cea": col("number"),
+            "ca199": col("number"),
+            "cea_positive": col("flag", COL_CEA_POS),
+            "ca199_positive": col("flag", COL_CA199_POS_2019),
+            "type": col("text", "病理"),
+            "differentiation": col("code", COL_DIFFERENTIATION, codes=DIFFERENTIATION_CODES),
+            "lauren": col("text", COL_LAUREN),
+            "pT": col("text", COL_PT),
+            "pN": col("text", COL_N_2019),
+            "pM": col("text", COL_M),
+            "pStage": col("text", COL_STAGE),
+        },
+    ),
+    "2024": ClinicalCohort(
+        name="2024",
+        excel_path=os.path.join(PROJECT_ROOT, "2024年胃癌直接手术", "胃癌2024（最新整理）0505.xlsx"),
+        output_path=os.path.join(OUTPUT_DIR, "clinical_data_2024.json"),
+        patient_id=col("text", "住院号"),
+        fields={
+            "age": col("number", "年龄"),
+            "sex": col("label", "性别", codes=SEX_CODES_EN),
+            "length": optional("number", "长径：cm"),
+            "thickness": optional("number", "厚径：cm"),
+            "location": optional("text", COL_LOCATION_2019),
+            "cea": optional("number", "CEA"),
+            "ca199": optional("number", "CA199"),
+            "cea_positive": optional("flag", COL_CEA_POS, absent=False),
+            "ca199_positive": optional("flag", COL_CA199_POS, absent=False),
+            "type": col("text", "病理诊断", "病理", per_row=False),
+            "differentiation": optional("text", COL_DIFFERENTIATION),
+            "lauren": optional("text", COL_LAUREN),
+            "pT": optional("text", COL_PT),
+            "pN": optional("text", COL_N),
+            "pM": optional("text", COL_M),
+            "pStage": optional("text", COL_STAGE),
+        },
+    ),
+    "2024_nac": ClinicalCohort(
+        name="2024_nac",
+        excel_path=os.path.join(PROJECT_ROOT, "胃癌勾画新辅助治疗", "2024新辅助治疗", "24新辅助治疗后.xlsx"),
+        output_path=os.path.join(OUTPUT_DIR, "clinical_data_2024_nac.json"),
+        patient_id=col("text", "住院号"),
+        fields={
+            "age": col("number", "年龄"),
+            "sex": col("label", COL_SEX, codes=SEX_CODES_EN),
+            "length": col("number", "长径"),
+            "thickness": col("number", "厚径"),
+            "location": col("text", COL_LOCATION),
+            "cea": col("number", "CEA"),
+            "ca199": col("number", "CA199"),
+            "cea_positive": optional("flag", COL_CEA_POS, absent=False),
+            "ca199_positive": optional("flag", COL_CA199_POS_2019, absent=False),
+            "type": col("text", "病理诊断", "病理", per_row=False),
+            "differentiation": optional("text", COL_DIFFERENTIATION),
+            "lauren": optional("text", COL_LAUREN),
+            "pT": optional("text", COL_PT),
+            "pN": optional("text", COL_N_2019),
+            "pM": optional("text", COL_M),
+            "pStage": optional("text", COL_STAGE),
+        },
+    ),
+}
+
+
+def stage_number(value, codes, letter):
+    """
+    pT/pN 的分期数字：编码 4 和 5（T4a/T4b）、"4.0"、"T4b" 都得 4，Normal 得 0；
+    缺失、N+ 等无法识别的值返回 None
+    """
+    text = str(value).strip()
+    match = STAGE_PATTERN.match(text)
+    if text == "Normal":
+        label = text
+    elif not match or match.group("prefix") not in ("", letter):
+        return None
+    elif match.group("prefix"):
+        label = f"{letter}{match.group('number')}"
+    else:
+        label = codes.get(int(match.group("number")), "")
+    if label == "Normal":
+        return 0
+    if re.match(rf"^{letter}\d", label):
+        return int(label[1])
+    return None
+
+
+# ===== 按列转换 =====
+def to_number(s):
+    return pd.to_numeric(s, errors="coerce").astype(float)
+
+
+def to_text(s):
+    return s.astype(object).where(s.notna(), "").astype(str).str.strip()
+
+
+def to_code(s, codes):
+    return np.trunc(to_number(s)).map(codes).fillna("Unknown")
+
+
+def to_label(s, codes):
+    return to_text(s).str.lower().map(codes).fillna("Unknown")
+
+
+def to_binary(s, codes, labels):
+    numeric = to_number(s)
+    result = to_label(s, codes)
+    return result.mask(numeric.notna(), np.where(numeric == 1, labels[1], labels[0]))
+
+
+def to_flag(s):
+    return to_number(s).eq(1)
+
+
+def convert_source(s, column):
+    if column.kind == "number":
+        return to_number(s)
+    if column.kind == "text":
+        return to_text(s)
+    if column.kind == "code":
+        return to_code(s, column.codes)
+    if column.kind == "label":
+        return to_label(s, column.codes)
+    if column.kind == "binary":
+        return to_binary(s, column.codes, column.labels)
+    if column.kind == "flag":
+        return to_flag(s)
+    raise ValueError(f"Unknown column kind: {column.kind}")
+
+
+def is_empty(s):
+    """Python 真值为假的值：NaN、""、0"""
+    return s.isna() | s.eq("") | s.eq(0)
+
+
+def convert_column(df, column):
+    """把一个字段转成 Python 值列表（NaN → None），多个源列按顺序补空"""
+    present = [name for name in column.sources if name in df.columns]
+    if not present and column.absent is not FROM_EMPTY:
+        return [column.absent] * len(df)
+    # 缺失的候选列按全空列参与补空（row.get() 返回 None）
+    names = column.sources if column.per_row else present[:1]
+
+    result = None
+    for name in names or (None,):
+        if name in df.columns:
+            source = df[name]
+        else:
+            source = pd.Series(np.nan, index=df.index, dtype=object)
+        converted = convert_source(source, column)
+        result = converted if result is None else result.mask(is_empty(result), converted)
+
+    if column.kind == "number":
+        return result.astype(object).where(result.notna(), None).tolist()
+    return result.tolist()
+
+
+def build_records(layout, columns):
+    """按 RECORD_LAYOUT 自底向上把各列拼成嵌套字典"""
+    keys = list(layout)
+    values = [
+        build_records(leaf, columns) if isinstance(leaf, dict) else columns[leaf]
+        for leaf in layout.values()
+    ]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+def convert_frame(df, cohort):
+    """DataFrame → {病人ID: 记录}；没有ID的行跳过，重复ID保留最后一行"""
+    ids = pd.Series(convert_column(df, cohort.patient_id), index=df.index)
+    df = df[ids != ""]
+    ids = ids[ids != ""]
+    columns = {name: convert_column(df, column) for name, column in cohort.fields.items()}
+    return dict(zip(ids.tolist(), build_records(RECORD_LAYOUT, columns)))
+
+
+def read_cohort_excel(cohort):
+    """读取 cohort 的 Excel；工作簿只解析一次，之后从 excel_snapshot 的快照读取"""
+    print(f"Reading Excel: {cohort.excel_path}")
+    if not cohort.all_sheets:
+        df = read_excel(cohort.excel_path)
+        print(f"Total rows: {len(df)}")
+        return df
+
+    # 读取并合并所有sheet
+    names = sheet_names(cohort.excel_path)
+    print(f"Found {len(names)} sheets: {names}")
+    all_dfs = []
+    for sheet_name in names:
+        try:
+            df_sheet = read_excel(cohort.excel_path, sheet_name=sheet_name)
+            print(f"  Sheet '{sheet_name}': {len(df_sheet)} rows")
+            all_dfs.append(df_sheet)
+        except Exception as e:
+            print(f"  Error reading sheet '{sheet_name}': {e}")
+    if not all_dfs:
+        return None
+    df = pd.concat(all_dfs, ignore_index=True)
+    print(f"Total rows after merging: {len(df)}")
+    return df
+
+
+def dump_json(data, path):
+    """优先用 orjson 序列化；输出格式与 json.dump(indent=2, ensure_ascii=False) 一致"""
+    if orjson is not None:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(payload)
+
+
+def convert_cohort(name):
+    cohort = COHORTS[name]
+    start = time.time()
+    df = read_cohort_excel(cohort)
+    if df is None:
+        print("No data found in any sheet!")
+        return None
+
+    clinical_data = convert_frame(df, cohort)
+    print(f"Processed {len(clinical_data)} patients.")
+
+    # 保存为JSON
+    os.makedirs(os.path.dirname(cohort.output_path), exist_ok=True)
+    dump_json(clinical_data, cohort.output_path)
+    # 按病人ID查询用的记录文件 + 偏移索引，须在 JSON 之后写（读端据 mtime 判断是否过期）
+    write_store(clinical_data, cohort.output_path)
+    print(f"Saved to: {cohort.output_path} ({time.time() - start:.2f}s)")
+    return clinical_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert clinical Excel sheets to gastric-scan-next JSON.")
+    parser.add_argument("cohorts", nargs="*",
+                        help=f"Cohorts to convert (default: all of {', '.join(COHORTS)})")
+    args = parser.parse_args()
+
+    names = args.cohorts or list(COHORTS)
+    unknown = [name for name in names if name not in COHORTS]
+    if unknown:
+        parser.error(f"unknown cohort(s): {', '.join(unknown)}")
+    for name in names:
+        convert_cohort(name)
+
+
+if __name__ == "__main__":
+    main()
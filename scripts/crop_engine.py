@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Shared crop engine used by batch_crop.py, crop_year_dataset.py and crop_tool.py.
+
+For every overlay in <source>/overlays the matching image, annotation and
+lymph_node_analysis overlay are cropped to the same rectangle. Work is spread
+over a process pool; JPEG quality is configurable and annotations are written
+with imageData stripped.
+
+With lossless=True JPEG files are cropped in the DCT domain (jpegtran) instead
+of being decoded and re-encoded: the crop offset is snapped to the nearest MCU
+boundary (8 or 16 px depending on chroma subsampling), pixels inside the ROI
+stay bit-exact, and annotations are shifted by the snapped offset. The
+jpegtran-cffi binding is used when installed, otherwise the jpegtran command
+line tool; without either the snapped rectangle is decoded and re-encoded.
+
+With auto_roi=True the crop rectangle is detected per frame layout
+(roi_detector.detect_roi) instead of using one fixed rectangle. Detection runs
+once per layout signature (frame size plus a fingerprint of the static UI
+border) and the results are kept in <output>/roi_cache.json, so later runs skip
+it entirely.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from dataset_manifest import DEFAULT_MANIFEST, folder_names
+from roi_detector import DARK_THRESHOLD, detect_roi
+
+try:
+    import jpegtran
+except ImportError:
+    jpegtran = None
+
+# Default crop rectangle (x1, y1, x2, y2) of the 2025 pipeline: x=115, y=118, w=1051, h=757
+DEFAULT_CROP = (115, 118, 115 + 1051, 118 + 757)
+DEFAULT_JPEG_QUALITY = 95
+ROI_CACHE_NAME = "roi_cache.json"
+
+JPEGTRAN_BIN = shutil.which("jpegtran")
+# SOF markers that carry frame dimensions (DHT/JPG/DAC share the 0xC4/0xC8/0xCC slots)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Layout fingerprint: the frame is reduced to a grid of cells and only the outer
+# rings of cells (the UI around the scan sector) are compared
+LAYOUT_GRID = (32, 24)
+LAYOUT_RING = 2
+
+
+def ensure_dir(path):
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+
+def clamp(value, min_v, max_v):
+    return max(min_v, min(max_v, value))
+
+
+def clamp_rect(crop_rect, width, height):
+    """Clamp the rectangle to the image; return None when nothing is left."""
+    x1, y1, x2, y2 = crop_rect
+    x1 = clamp(x1, 0, width)
+    x2 = clamp(x2, 0, width)
+    y1 = clamp(y1, 0, height)
+    y2 = clamp(y2, 0, height)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def lossless_available():
+    return jpegtran is not None or JPEGTRAN_BIN is not None
+
+
+def iter_jpeg_segments(path):
+    """
+    Yield (marker, payload) for the JPEG header segments up to the start of scan.
+    Yields nothing for non-JPEG files.
+    """
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return
+            if byte != b"\xff":
+                continue
+            marker = f.read(1)
+            while marker == b"\xff":
+                marker = f.read(1)
+            if not marker:
+                return
+            code = marker[0]
+            if code == 0x01 or 0xD0 <= code <= 0xD9:
+                continue
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return
+            length = struct.unpack(">H", length_bytes)[0]
+            payload = f.read(length - 2)
+            yield code, payload
+            if code == 0xDA:
+                return
+
+
+def read_jpeg_header(path):
+    """
+    Parse the JPEG frame header without decoding any pixels.
+    Returns (width, height, mcu_width, mcu_height), or None for non-JPEG files.
+    """
+    for code, segment in iter_jpeg_segments(path):
+        if code not in SOF_MARKERS:
+            continue
+        if len(segment) < 6:
+            return None
+        height, width, components = struct.unpack(">HHB", segment[1:6])
+        h_max = v_max = 1
+        for i in range(components):
+            sampling = segment[6 + 3 * i + 1]
+            h_max = max(h_max, sampling >> 4)
+            v_max = max(v_max, sampling & 0x0F)
+        return width, height, 8 * h_max, 8 * v_max
+    return None
+
+
+def layout_signature(path):
+    """
+    Scanner/preset signature of a frame: its size plus a fingerprint of the
+    static UI border around the scan sector. The frame is decoded at 1/4 scale,
+    thresholded and opened like roi_detector.detect_roi (so text and tick marks
+    drop out), reduced to a LAYOUT_GRID of cells and the outer LAYOUT_RING rings
+    are kept as one bit per cell. Frames from the same device and preset share
+    one signature regardless of how they were encoded or which patient they show.
+    Returns None for unreadable files.
+    """
+    small = cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if small is None:
+        return None
+    header = read_jpeg_header(path)
+    if header is not None:
+        width, height = header[:2]
+    else:
+        img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+        height, width = img.shape[:2]
+
+    mask = cv2.morphologyEx((small > DARK_THRESHOLD).astype(np.uint8), cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+    grid = cv2.resize(mask.astype(np.float32), LAYOUT_GRID, interpolation=cv2.INTER_AREA) > 0.5
+    ring = LAYOUT_RING
+    border = np.concatenate([
+        grid[:ring].ravel(), grid[-ring:].ravel(),
+        grid[ring:-ring, :ring].ravel(), grid[ring:-ring, -ring:].ravel(),
+    ])
+    digest = hashlib.sha1(np.packbits(border).tobytes()).hexdigest()[:12]
+    return f"{width}x{height}-ui-{digest}"
+
+
+def snap_rect(crop_rect, mcu_width, mcu_height, width, height):
+    """
+    Move the top-left corner of an already clamped rectangle to the nearest MCU
+    boundary, keep its size, and clamp it to the image again.
+    """
+    x1, y1, x2, y2 = crop_rect
+    sx1 = min(int(round(x1 / mcu_width)) * mcu_width, (width - 1) // mcu_width * mcu_width)
+    sy1 = min(int(round(y1 / mcu_height)) * mcu_height, (height - 1) // mcu_height * mcu_height)
+    return clamp_rect((sx1, sy1, sx1 + (x2 - x1), sy1 + (y2 - y1)), width, height)
+
+
+def lossless_crop(src, crop_rect):
+    """DCT-domain crop of an MCU-aligned rectangle; returns JPEG bytes or None when unavailable."""
+    x1, y1, x2, y2 = crop_rect
+    if jpegtran is not None:
+        return jpegtran.JPEGImage(src).crop(x1, y1, x2 - x1, y2 - y1).as_blob()
+    if JPEGTRAN_BIN is not None:
+        result = subprocess.run(
+            [JPEGTRAN_BIN, "-copy", "none", "-crop", f"{x2 - x1}x{y2 - y1}+{x1}+{y1}", src],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+        return result.stdout
+    return None
+
+
+def shift_annotation(data, crop_rect, target_image_name):
+    """Shift LabelMe points into the crop, clamp them to its bounds and drop imageData."""
+    x1, y1, x2, y2 = crop_rect
+    crop_width = x2 - x1
+    crop_height = y2 - y1
+
+    new_shapes = []
+    for shape in data.get("shapes", []):
+        points = shape.get("points", [])
+        new_points = []
+        for px, py in points:
+            nx = clamp(px - x1, 0, crop_width)
+            ny = clamp(py - y1, 0, crop_height)
+            new_points.append([nx, ny])
+        if new_points:
+            shape["points"] = new_points
+            new_shapes.append(shape)
+    data["shapes"] = new_shapes
+    data["imageHeight"] = crop_height
+    data["imageWidth"] = crop_width
+    data["imagePath"] = f"../images/{target_image_name}"
+    data["imageData"] = None
+    return data
+
+
+def encode_jpeg(img, quality):
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("Failed to encode JPEG")
+    return buffer.tobytes()
+
+
+def write_bytes(path, data):
+    # Remove first so a hard-linked target never rewrites its sibling file.
+    if os.path.lexists(path):
+        os.remove(path)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def link_or_write(src, dst, data):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        write_bytes(dst, data)
+
+
+def build_jobs(source_root, output_root, crop_rect, quality=DEFAULT_JPEG_QUALITY, lossless=False,
+               manifest=DEFAULT_MANIFEST):
+    """
+    Create one job per overlay (plus lymph_node_analysis files without an overlay).
+    Every job carries the source/target paths of all files that share the crop.
+    File lists come from the dataset manifest when it is current for source_root
+    (dataset_manifest.folder_names), otherwise from the directories.
+    """
+    source_root = Path(source_root)
+    output_root = Path(output_root)
+    overlays_dir = source_root / "overlays"
+    images_dir = source_root / "images"
+    annotations_dir = source_root / "annotations"
+    lymph_dir = source_root / "lymph_node_analysis"
+
+    images = set(folder_names(source_root, "images", manifest))
+    annotations = set(folder_names(source_root, "annotations", manifest, ".json"))
+    lymph_names = folder_names(source_root, "lymph_node_analysis", manifest)
+    lymph = set(lymph_names)
+
+    jobs = []
+    seen_lymph = set()
+    for name in folder_names(source_root, "overlays", manifest):
+        overlay_path = overlays_dir / name
+        image_name = name.replace("_overlay.jpg", ".jpg")
+        image_path = images_dir / image_name
+        annotation_path = annotations_dir / name.replace("_overlay.jpg", ".json")
+        lymph_path = lymph_dir / name
+        if name in lymph:
+            seen_lymph.add(name)
+        jobs.append({
+            "overlay": (str(overlay_path), str(output_root / "overlays" / name)),
+            "image": (str(image_path), str(output_root / "images" / image_name)) if image_name in images else None,
+            "annotation": (str(annotation_path), str(output_root / "annotations" / annotation_path.name)) if annotation_path.name in annotations else None,
+            "lymph": (str(lymph_path), str(output_root / "lymph_node_analysis" / name)) if name in lymph else None,
+            "image_name": image_name,
+            "rect": tuple(crop_rect),
+            "quality": quality,
+            "lossless": lossless,
+        })
+
+    for name in lymph_names:
+        if name in seen_lymph:
+            continue
+        jobs.append({
+            "overlay": None,
+            "image": None,
+            "annotation": None,
+            "lymph": (str(lymph_dir / name), str(output_root / "lymph_node_analysis" / name)),
+            "image_name": None,
+            "rect": tuple(crop_rect),
+            "quality": quality,
+            "lossless": lossless,
+        })
+    return jobs
+
+
+def job_reference(job):
+    """Source file used to detect a job's ROI; the raw image is preferred over overlays."""
+    for key in ("image", "overlay", "lymph"):
+        if job[key]:
+            return job[key][0]
+    return None
+
+
+def detect_layout_rect(path):
+    """Detected crop rectangle of one sample frame as a list, or None."""
+    img = cv2.imread(path)
+    rect = detect_roi(img) if img is not None else None
+    return list(rect) if rect else None
+
+
+def resolve_rois(jobs, fallback_rect, cache_path=None, workers=None):
+    """
+    Assign a detected crop rectangle to every job, detecting once per layout signature.
+    Signatures are computed in a process pool; detection then runs, also in the
+    pool, on one sample frame per signature missing from the cache.
+    Layouts where detection fails keep fallback_rect. The signature -> rect cache is
+    read from and written back to cache_path when given.
+    Returns the cache dict.
+    """
+    cache = {}
+    if cache_path is not None and Path(cache_path).exists():
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+
+    references = [(job, job_reference(job)) for job in jobs]
+    references = [(job, src) for job, src in references if src]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        signatures = list(pool.map(layout_signature, [src for _, src in references], chunksize=32))
+        samples = {}
+        for (_, src), signature in zip(references, signatures):
+            if signature is not None and signature not in cache:
+                samples.setdefault(signature, src)
+        for signature, rect in zip(samples, pool.map(detect_layout_rect, samples.values())):
+            cache[signature] = rect
+
+    for (job, _), signature in zip(references, signatures):
+        if signature is None:
+            continue
+        if cache[signature]:
+            job["rect"] = tuple(cache[signature])
+        else:
+            job["rect"] = tuple(fallback_rect)
+
+    if cache_path is not None:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+    return cache
+
+
+def crop_job(job):
+    """
+    Crop every file of one job. The rectangle is clamped once from the first
+    decoded frame and reused for the others when they share its dimensions.
+    A lymph_node_analysis file hard-linked to its overlay is not decoded again;
+    the cropped overlay bytes are reused.
+    In lossless mode the frame size comes from the JPEG header and the rectangle
+    is snapped to the MCU grid, so the annotation is shifted by the snapped offset.
+    The annotation uses the rectangle of the image it belongs to, not that of
+    whichever file was cropped last.
+    Returns (overlay_cropped, message, clamped), where clamped describes the first
+    file whose frame was too small for the rectangle (None when none was).
+    """
+    rect = None
+    frame_key = None
+    overlay_bytes = None
+    overlay_ok = False
+    clamped = None
+
+    def crop_file(src, dst):
+        nonlocal rect, frame_key, clamped
+        img = None
+        header = read_jpeg_header(src) if job.get("lossless") else None
+        if header is not None:
+            width, height, mcu_width, mcu_height = header
+            key = (height, width, mcu_width, mcu_height)
+        else:
+            img = cv2.imread(src)
+            if img is None:
+                return None, f"Unable to read image: {src}"
+            height, width = img.shape[:2]
+            key = (height, width)
+        if frame_key != key:
+            frame_key = key
+            rect = clamp_rect(job["rect"], width, height)
+            if rect is not None and rect != tuple(job["rect"]) and clamped is None:
+                clamped = f"{src} ({width}x{height}): {tuple(job['rect'])} -> {rect}"
+            if rect is not None and header is not None:
+                rect = snap_rect(rect, mcu_width, mcu_height, width, height)
+        if rect is None:
+            return None, f"Invalid crop for {src}: {job['rect']}"
+
+        data = lossless_crop(src, rect) if header is not None else None
+        if data is None:
+            if img is None:
+                img = cv2.imread(src)
+                if img is None:
+                    return None, f"Unable to read image: {src}"
+            x1, y1, x2, y2 = rect
+            data = encode_jpeg(img[y1:y2, x1:x2], job["quality"])
+        write_bytes(dst, data)
+        return data, None
+
+    messages = []
+    # The annotation belongs to the image; the overlay's rect stands in without one
+    annotation_rect = None
+    if job["overlay"]:
+        overlay_bytes, message = crop_file(*job["overlay"])
+        overlay_ok = overlay_bytes is not None
+        if overlay_ok:
+            annotation_rect = rect
+        if message:
+            messages.append(message)
+
+    if job["image"]:
+        image_bytes, message = crop_file(*job["image"])
+        if image_bytes is not None:
+            annotation_rect = rect
+        if message:
+            messages.append(message)
+
+    if job["lymph"]:
+        src, dst = job["lymph"]
+        if overlay_ok and os.path.samefile(src, job["overlay"][0]):
+            link_or_write(job["overlay"][1], dst, overlay_bytes)
+        else:
+            _, message = crop_file(src, dst)
+            if message:
+                messages.append(message)
+
+    if job["annotation"] and annotation_rect is not None:
+        src, dst = job["annotation"]
+        with open(src, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        shifted = shift_annotation(data, annotation_rect, job["image_name"])
+        with open(dst, "w", encoding="utf-8") as f:
+            json.dump(shifted, f, indent=2, ensure_ascii=False)
+
+    return overlay_ok, "; ".join(messages), clamped
+
+
+def crop_dataset(source_root, output_root, crop_rect=DEFAULT_CROP, quality=DEFAULT_JPEG_QUALITY,
+                 workers=None, progress=None, should_stop=None, lossless=False, auto_roi=False,
+                 manifest=DEFAULT_MANIFEST):
+    """
+    Crop a whole dataset on a process pool.
+    lossless=True crops JPEGs in the DCT domain on the MCU grid (see module docstring).
+    auto_roi=True detects the rectangle per layout; crop_rect is the fallback.
+    progress(done, total) is called after every job; should_stop() is polled
+    between jobs and cancels the jobs that have not started yet.
+    Frames smaller than the rectangle are cropped to their own bounds; this is
+    reported as one message with the number of affected jobs.
+    Returns (processed_overlays, total_jobs, messages).
+    """
+    output_root = Path(output_root)
+    for sub in ("images", "overlays", "annotations", "lymph_node_analysis"):
+        ensure_dir(output_root / sub)
+
+    jobs = build_jobs(source_root, output_root, crop_rect, quality, lossless, manifest)
+    if auto_roi:
+        resolve_rois(jobs, crop_rect, output_root / ROI_CACHE_NAME, workers)
+    total = len(jobs)
+    processed = 0
+    messages = []
+    clamped_jobs = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(crop_job, job) for job in jobs]
+        for done, future in enumerate(futures, start=1):
+            if should_stop is not None and should_stop():
+                for pending in futures[done - 1:]:
+                    pending.cancel()
+                break
+            overlay_ok, message, clamped = future.result()
+            processed += int(overlay_ok)
+            if message:
+                messages.append(message)
+            if clamped:
+                clamped_jobs.append(clamped)
+            if progress is not None:
+                progress(done, total)
+    if clamped_jobs:
+        messages.append(
+            f"Crop rectangle clamped to smaller frames in {len(clamped_jobs)} job(s), e.g. {clamped_jobs[0]}"
+        )
+    return processed, total, messages
@@ -1,12 +1,17 @@
 import os
-import cv2
 import glob
-import numpy as np
-from flask import Flask, render_template_string, request, jsonify, send_file
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template_string, request, jsonify
 import threading
 import webbrowser
 import time
 
+import cv2
+
+from crop_engine import DEFAULT_JPEG_QUALITY, crop_dataset
+
 app = Flask(__name__)
 
 # Configuration
@@ -14,9 +19,21 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DATASET_ROOT = os.path.join(PROJECT_ROOT, "Gastric_Cancer_Dataset")
 OUTPUT_ROOT = os.path.join(PROJECT_ROOT, "Gastric_Cancer_Dataset_Cropped")
 
+JPEG_QUALITY = DEFAULT_JPEG_QUALITY
+
 # Default image to show for cropping
 DEFAULT_IMAGE = "Chemo_1MC_1424711 (3)_overlay.jpg"
 
+# The preview is a downscaled copy; the browser maps selections back to full resolution
+PREVIEW_MAX_WIDTH = 960
+PREVIEW_CACHE = {}
+
+# Crop jobs run one after another on a background thread (each job uses a process pool)
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+FINISHED_STATES = ("done", "cancelled", "error")
+
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html>
@@ -45,8 +62,10 @@ HTML_TEMPLATE = """
         <div>
             Crop Area: <span id="coords">None</span>
         </div>
-        <br>
+        <label><input type="checkbox" id="lossless"> Lossless (JPEG block-aligned, offset snaps to 8/16 px)</label>
+        <br><br>
         <button id="cropBtn" onclick="startCrop()" disabled>Start Batch Crop</button>
+        <button id="cancelBtn" onclick="cancelCrop()" style="display: none;">Cancel</button>
         <div id="status"></div>
     </div>
 
@@ -63,14 +82,25 @@ HTML_TEMPLATE = """
         let startX, startY, endX, endY;
         let isDrawing = false;
         let hasSelection = false;
+        let previewScale = 1;
+        let currentJob = null;
         
-        // Load image
+        // Load downscaled preview; previewScale converts preview pixels to original pixels
         img.onload = function() {
             canvas.width = img.width;
             canvas.height = img.height;
             ctx.drawImage(img, 0, 0);
         };
-        img.src = "/image";
+        fetch('/image_info')
+            .then(response => response.json())
+            .then(info => {
+                previewScale = info.scale;
+                img.src = "/image";
+            });
+
+        function toOriginal(value) {
+            return Math.round(value * previewScale);
+        }
 
         function getMousePos(evt) {
             const rect = canvas.getBoundingClientRect();
@@ -112,7 +142,8 @@ HTML_TEMPLATE = """
             if (x2 - x1 > 10 && y2 - y1 > 10) {
                 hasSelection = true;
                 document.getElementById('cropBtn').disabled = false;
-                document.getElementById('coords').innerText = `x=${x1}, y=${y1}, w=${x2-x1}, h=${y2-y1}`;
+                document.getElementById('coords').innerText =
+                    `x=${toOriginal(x1)}, y=${toOriginal(y1)}, w=${toOriginal(x2) - toOriginal(x1)}, h=${toOriginal(y2) - toOriginal(y1)}`;
                 
                 // Store final normalized coords
                 startX = x1; startY = y1; endX = x2; endY = y2;
@@ -152,23 +183,24 @@ HTML_TEMPLATE = """
             const status = document.getElementById('status');
             btn.disabled = true;
             btn.innerText = "Processing...";
-            status.innerText = "Starting batch processing... check terminal for details.";
+            status.innerText = "Submitting crop job...";
 
             fetch('/process', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
-                    x1: startX,
-                    y1: startY,
-                    x2: endX,
-                    y2: endY
+                    x1: toOriginal(startX),
+                    y1: toOriginal(startY),
+                    x2: toOriginal(endX),
+                    y2: toOriginal(endY),
+                    lossless: document.getElementById('lossless').checked
                 })
             })
             .then(response => response.json())
             .then(data => {
-                btn.innerText = "Done!";
-                status.innerText = data.message;
-                alert("Processing Complete! Saved to: " + data.output_path);
+                currentJob = data.job_id;
+                document.getElementById('cancelBtn').style.display = 'inline-block';
+                watchJob(currentJob);
             })
             .catch(error => {
                 btn.innerText = "Error";
@@ -176,6 +208,44 @@ HTML_TEMPLATE = """
                 status.innerText = "Error: " + error;
             });
         }
+
+        function watchJob(jobId) {
+            const btn = document.getElementById('cropBtn');
+            const status = document.getElementById('status');
+            const source = new EventSource('/jobs/' + jobId + '/events');
+            source.onmessage = function(event) {
+                const job = JSON.parse(event.data);
+                if (job.state === 'queued') {
+                    status.innerText = "Waiting for the previous job to finish...";
+                } else if (job.state === 'running') {
+                    const eta = job.eta_seconds === null ? '?' : Math.round(job.eta_seconds) + 's';
+                    status.innerText = `Processed ${job.done}/${job.total} (${job.rate.toFixed(1)} jobs/s, ETA ${eta})`;
+                }
+                if (['done', 'cancelled', 'error'].includes(job.state)) {
+                    source.close();
+                    document.getElementById('cancelBtn').style.display = 'none';
+                    btn.disabled = false;
+                    btn.innerText = "Start Batch Crop";
+                    if (job.state === 'done') {
+                        status.innerText = `Done: processed ${job.processed} images. Saved to: ${job.output_path}`;
+                    } else if (job.state === 'cancelled') {
+                        status.innerText = `Cancelled after ${job.done}/${job.total} jobs.`;
+                    } else {
+                        status.innerText = "Error: " + job.error;
+                    }
+                }
+            };
+            source.onerror = function() {
+                source.close();
+                status.innerText = "Lost connection to the server; job " + jobId + " may still be running.";
+            };
+        }
+
+        function cancelCrop() {
+            if (!currentJob) return;
+            fetch('/jobs/' + currentJob + '/cancel', { method: 'POST' });
+            document.getElementById('status').innerText = "Cancelling...";
+        }
     </script>
 </body>
 </html>
@@ -185,77 +255,164 @@ HTML_TEMPLATE = """
 def index():
     return render_template_string(HTML_TEMPLATE)
 
-@app.route('/image')
-def get_image():
+def find_preview_source():
     # Try to find the default image
     img_path = os.path.join(DATASET_ROOT, "overlays", DEFAULT_IMAGE)
-    if not os.path.exists(img_path):
-        # Fallback to first jpg in overlays
-        files = glob.glob(os.path.join(DATASET_ROOT, "overlays", "*.jpg"))
-        if files:
-            img_path = files[0]
-        else:
-            return "No images found in " + os.path.join(DATASET_ROOT, "overlays"), 404
-            
-    return send_file(img_path, mimetype='image/jpeg')
+    if os.path.exists(img_path):
+        return img_path
+    # Fallback to first jpg in overlays
+    files = glob.glob(os.path.join(DATASET_ROOT, "overlays", "*.jpg"))
+    return files[0] if files else None
+
+def get_preview(img_path):
+    """Downscaled JPEG of img_path and its scale factor, cached per file path/mtime/size."""
+    stat = os.stat(img_path)
+    key = (img_path, stat.st_mtime_ns, stat.st_size)
+    if key not in PREVIEW_CACHE:
+        img = cv2.imread(img_path)
+        if img is None:
+            return None, 1.0
+        height, width = img.shape[:2]
+        scale = max(1.0, width / PREVIEW_MAX_WIDTH)
+        if scale > 1.0:
+            img = cv2.resize(img, (round(width / scale), round(height / scale)), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            return None, 1.0
+        PREVIEW_CACHE.clear()
+        PREVIEW_CACHE[key] = (buffer.tobytes(), scale)
+    return PREVIEW_CACHE[key]
+
+@app.route('/image_info')
+def get_image_info():
+    img_path = find_preview_source()
+    if img_path is None:
+        return jsonify({"error": "No images found in " + os.path.join(DATASET_ROOT, "overlays")}), 404
+    _, scale = get_preview(img_path)
+    return jsonify({"path": os.path.basename(img_path), "scale": scale})
+
+@app.route('/image')
+def get_image():
+    img_path = find_preview_source()
+    if img_path is None:
+        return "No images found in " + os.path.join(DATASET_ROOT, "overlays"), 404
+    data, _ = get_preview(img_path)
+    if data is None:
+        return "Unable to read " + img_path, 500
+    return Response(data, mimetype='image/jpeg', headers={"Cache-Control": "max-age=3600"})
+
+def job_snapshot(job):
+    """JSON-serialisable view of a job with rate (jobs/s) and ETA (s)."""
+    elapsed = (job["finished_at"] or time.time()) - job["started_at"] if job["started_at"] else 0.0
+    rate = job["done"] / elapsed if elapsed > 0 else 0.0
+    eta = (job["total"] - job["done"]) / rate if rate > 0 else None
+    return {
+        "job_id": job["id"],
+        "state": job["state"],
+        "done": job["done"],
+        "total": job["total"],
+        "processed": job["processed"],
+        "rate": rate,
+        "eta_seconds": eta,
+        "elapsed_seconds": elapsed,
+        "rect": job["rect"],
+        "lossless": job["lossless"],
+        "output_path": OUTPUT_ROOT,
+        "warnings": len(job["messages"]),
+        "error": job["error"],
+    }
+
+def run_crop_job(job):
+    if job["cancel"].is_set():
+        job["state"] = "cancelled"
+        return
+    job["state"] = "running"
+    job["started_at"] = time.time()
+    print(f"Starting batch crop {job['id']}. ROI: {job['rect']}")
+
+    def report_progress(done, total):
+        job["done"] = done
+        job["total"] = total
+        if done % 100 == 0 or done == total:
+            print(f"Processed {done}/{total} images...")
+
+    try:
+        processed_count, total, messages = crop_dataset(
+            DATASET_ROOT, OUTPUT_ROOT, job["rect"], quality=JPEG_QUALITY, progress=report_progress,
+            should_stop=job["cancel"].is_set, lossless=job["lossless"],
+        )
+        for message in messages:
+            print(f"Warning: {message}")
+        job["processed"] = processed_count
+        job["total"] = total
+        job["messages"] = messages
+        job["state"] = "cancelled" if job["cancel"].is_set() else "done"
+    except Exception as e:
+        job["error"] = str(e)
+        job["state"] = "error"
+    finally:
+        job["finished_at"] = time.time()
 
 @app.route('/process', methods=['POST'])
 def process():
     data = request.json
     x1, y1 = int(data['x1']), int(data['y1'])
     x2, y2 = int(data['x2']), int(data['y2'])
-    
-    # Ensure output directories exist
-    os.makedirs(os.path.join(OUTPUT_ROOT, "images"), exist_ok=True)
-    os.makedirs(os.path.join(OUTPUT_ROOT, "overlays"), exist_ok=True)
-    
-    # Get all images
-    # We assume corresponding filenames in images/ and overlays/
-    overlay_files = glob.glob(os.path.join(DATASET_ROOT, "overlays", "*.jpg"))
-    
-    processed_count = 0
-    
-    print(f"Starting batch crop. ROI: ({x1},{y1}) to ({x2},{y2})")
-    print(f"Found {len(overlay_files)} overlays to process.")
-    
-    for overlay_path in overlay_files:
-        filename = os.path.basename(overlay_path)
-        
-        # Process Overlay
-        img_overlay = cv2.imread(overlay_path)
-        if img_overlay is not None:
-            cropped_overlay = img_overlay[y1:y2, x1:x2]
-            cv2.imwrite(os.path.join(OUTPUT_ROOT, "overlays", filename), cropped_overlay)
-        
-        # Process Original Image (if exists)
-        # The overlay has _overlay.jpg, the original is usually .jpg
-        # But checking the user's filenames: "Chemo_1MC_1424711 (3)_overlay.jpg"
-        # The original should be "Chemo_1MC_1424711 (3).jpg"
-        
-        original_filename = filename.replace("_overlay.jpg", ".jpg")
-        original_path = os.path.join(DATASET_ROOT, "images", original_filename)
-        
-        if os.path.exists(original_path):
-            img_orig = cv2.imread(original_path)
-            if img_orig is not None:
-                # Resize check? Assuming original and overlay are same size
-                if img_orig.shape[:2] != img_overlay.shape[:2]:
-                    # If sizes differ, we might need to scale coordinates?
-                    # Usually they match in this pipeline. Let's assume match.
-                    pass
-                    
-                cropped_orig = img_orig[y1:y2, x1:x2]
-                cv2.imwrite(os.path.join(OUTPUT_ROOT, "images", original_filename), cropped_orig)
-        
-        processed_count += 1
-        if processed_count % 100 == 0:
-            print(f"Processed {processed_count} images...")
+    lossless = bool(data.get('lossless', False))
+
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "state": "queued",
+        "rect": (x1, y1, x2, y2),
+        "lossless": lossless,
+        "done": 0,
+        "total": 0,
+        "processed": 0,
+        "messages": [],
+        "error": None,
+        "started_at": None,
+        "finished_at": None,
+        "cancel": threading.Event(),
+    }
+    with JOBS_LOCK:
+        JOBS[job["id"]] = job
+    JOB_EXECUTOR.submit(run_crop_job, job)
+    return jsonify({"status": "queued", "job_id": job["id"]}), 202
+
+def lookup_job(job_id):
+    with JOBS_LOCK:
+        return JOBS.get(job_id)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = lookup_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job_snapshot(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = lookup_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def stream():
+        while True:
+            snapshot = job_snapshot(job)
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot["state"] in FINISHED_STATES:
+                break
+            time.sleep(0.5)
+
+    return Response(stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
 
-    return jsonify({
-        "status": "success", 
-        "message": f"Processed {processed_count} images.",
-        "output_path": OUTPUT_ROOT
-    })
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = lookup_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    job["cancel"].set()
+    return jsonify(job_snapshot(job))
 
 def open_browser():
     time.sleep(1.5)
@@ -268,5 +425,5 @@ if __name__ == '__main__':
     # Run browser opener in separate thread
     threading.Thread(target=open_browser).start()
     
-    app.run(host='0.0.0.0', port=5001, debug=False)
+    app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
 
@@ -1,124 +1,43 @@
 #!/usr/bin/env python3
 import argparse
-import glob
-import json
 import os
 from pathlib import Path
 
-import cv2
+from crop_engine import DEFAULT_CROP, DEFAULT_JPEG_QUALITY, build_jobs, crop_dataset, lossless_available, resolve_rois
+from dataset_manifest import DEFAULT_MANIFEST
 
-# Default crop rectangle (same as the 2025 pipeline)
-DEFAULT_CROP = (115, 118, 115 + 1051, 118 + 757)
 
-
-def ensure_dir(path: Path):
-    path.mkdir(parents=True, exist_ok=True)
-
-
-def clamp(value, min_v, max_v):
-    return max(min_v, min(max_v, value))
-
-
-def crop_image(image_path: Path, crop_rect, target_path: Path):
-    img = cv2.imread(str(image_path))
-    if img is None:
-        print(f"[WARN] Unable to read image: {image_path}")
-        return False
-
-    h, w = img.shape[:2]
-    x1, y1, x2, y2 = crop_rect
-    x1 = clamp(x1, 0, w)
-    x2 = clamp(x2, 0, w)
-    y1 = clamp(y1, 0, h)
-    y2 = clamp(y2, 0, h)
-
-    if x2 <= x1 or y2 <= y1:
-        print(f"[WARN] Invalid crop for {image_path}: {crop_rect}")
-        return False
-
-    cropped = img[y1:y2, x1:x2]
-    cv2.imwrite(str(target_path), cropped)
-    return True
-
-
-def shift_annotation(data: dict, crop_rect, target_image_name):
-    x1, y1, x2, y2 = crop_rect
-    crop_width = x2 - x1
-    crop_height = y2 - y1
-
-    new_shapes = []
-    for shape in data.get("shapes", []):
-        points = shape.get("points", [])
-        new_points = []
-        for px, py in points:
-            nx = px - x1
-            ny = py - y1
-            nx = clamp(nx, 0, crop_width)
-            ny = clamp(ny, 0, crop_height)
-            new_points.append([nx, ny])
-        if new_points:
-            shape["points"] = new_points
-            new_shapes.append(shape)
-    data["shapes"] = new_shapes
-    data["imageHeight"] = crop_height
-    data["imageWidth"] = crop_width
-    data["imagePath"] = f"../images/{target_image_name}"
-    data["imageData"] = None
-    return data
-
-
-def process_dataset(source_root: Path, output_root: Path, crop_rect, dry_run=False):
-    overlays_dir = source_root / "overlays"
-    images_dir = source_root / "images"
-    annotations_dir = source_root / "annotations"
-    lymph_dir = source_root / "lymph_node_analysis"
-
-    if not overlays_dir.exists():
-        print(f"[ERROR] Overlays directory missing: {overlays_dir}")
+def process_dataset(source_root: Path, output_root: Path, crop_rect, dry_run=False,
+                    quality=DEFAULT_JPEG_QUALITY, workers=None, lossless=False, auto_roi=False,
+                    manifest=DEFAULT_MANIFEST):
+    if not (source_root / "overlays").exists():
+        print(f"[ERROR] Overlays directory missing: {source_root / 'overlays'}")
         return
 
-    target_dirs = {
-        "images": output_root / "images",
-        "overlays": output_root / "overlays",
-        "annotations": output_root / "annotations",
-        "lymph_node_analysis": output_root / "lymph_node_analysis",
-    }
-
-    for path in target_dirs.values():
-        ensure_dir(path)
-
-    overlay_files = sorted(overlays_dir.glob("*.jpg"))
-    print(f"Found {len(overlay_files)} overlay images in {overlays_dir}")
-
-    processed = 0
-    for overlay_path in overlay_files:
-        relative_name = overlay_path.name
-        image_name = relative_name.replace("_overlay.jpg", ".jpg")
-
-        if dry_run:
-            processed += 1
-            continue
-
-        overlay_target = target_dirs["overlays"] / relative_name
-        if crop_image(overlay_path, crop_rect, overlay_target):
-            processed += 1
+    if dry_run:
+        jobs = build_jobs(source_root, output_root, crop_rect, quality, manifest=manifest)
+        overlays = sum(1 for job in jobs if job["overlay"])
+        print(f"Found {overlays} overlay images in {source_root / 'overlays'}")
+        if auto_roi:
+            layouts = resolve_rois(jobs, crop_rect, workers=workers)
+            for signature, rect in sorted(layouts.items()):
+                print(f"[INFO] Layout {signature}: {rect if rect else 'not detected, using ' + str(tuple(crop_rect))}")
+        print(f"Processed {overlays} overlay files (dry run, nothing written)")
+        return
 
-        original_path = images_dir / image_name
-        if original_path.exists():
-            crop_image(original_path, crop_rect, target_dirs["images"] / image_name)
+    if lossless and not lossless_available():
+        print("[WARN] jpegtran not found; lossless crop falls back to re-encoding the MCU-snapped rectangle")
 
-        annotation_path = annotations_dir / relative_name.replace("_overlay.jpg", ".json")
-        if annotation_path.exists():
-            with open(annotation_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            shifted = shift_annotation(data, crop_rect, image_name)
-            with open(target_dirs["annotations"] / annotation_path.name, "w", encoding="utf-8") as f:
-                json.dump(shifted, f, indent=2, ensure_ascii=False)
+    def report_progress(done, total):
+        if done % 200 == 0 or done == total:
+            print(f"[INFO] {done}/{total} crop jobs finished")
 
-    if lymph_dir.exists() and not dry_run:
-        lymph_files = sorted(lymph_dir.glob("*.jpg"))
-        for lymph_path in lymph_files:
-            crop_image(lymph_path, crop_rect, target_dirs["lymph_node_analysis"] / lymph_path.name)
+    processed, _, messages = crop_dataset(
+        source_root, output_root, crop_rect, quality=quality, workers=workers, progress=report_progress,
+        lossless=lossless, auto_roi=auto_roi, manifest=manifest,
+    )
+    for message in messages:
+        print(f"[WARN] {message}")
 
     print(f"Processed {processed} overlay files and created cropped set under {output_root}")
 
@@ -149,6 +68,28 @@ def main():
         default=DEFAULT_CROP,
         help="Manual crop rectangle (x1 y1 x2 y2)",
     )
+    parser.add_argument(
+        "--quality", type=int, default=DEFAULT_JPEG_QUALITY, help="JPEG quality of the cropped files"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Worker processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--auto-roi",
+        action="store_true",
+        help="Detect the scan region per scanner/preset layout; --coords becomes the fallback",
+    )
+    parser.add_argument(
+        "--lossless",
+        action="store_true",
+        help="Crop JPEGs in the DCT domain (jpegtran); the offset snaps to the 8/16 px MCU grid",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=DEFAULT_MANIFEST,
+        help="Shared dataset manifest; folders it does not list or that changed since are listed from disk",
+    )
 
     args = parser.parse_args()
     root = Path(os.getcwd())
@@ -176,7 +117,17 @@ def main():
     if args.dry_run:
         print("[INFO] Dry run enabled, no files will be written.")
 
-    process_dataset(source_root, output_root, tuple(args.coords), dry_run=args.dry_run)
+    process_dataset(
+        source_root,
+        output_root,
+        tuple(args.coords),
+        dry_run=args.dry_run,
+        quality=args.quality,
+        workers=args.workers,
+        lossless=args.lossless,
+        auto_roi=args.auto_roi,
+        manifest=args.manifest,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Build one SQLite manifest of every cohort's files, shared by all dataset tools.
+
+Each cohort root is scanned once; for every file in ``images/``, ``overlays/``,
+``lymph_node_analysis/`` and ``annotations/`` the manifest records the fields of
+the shared filename grammar (group, cohort, treatment, queue, patient, sequence,
+NII slice thickness), the pathological T stage from the clinical JSON, and the
+file size, mtime, image dimensions and SHA-1.
+
+Rebuilds are incremental: rows whose size and mtime are unchanged are kept
+without reading the file again. Rows are written in (dataset, folder, name)
+order, so identical inputs give identical tables. Tools read the manifest with
+``load_files()`` (one indexed query) or ``folder_names()`` instead of walking
+the directories. The mtime of every scanned directory is recorded too: a
+directory that gained or lost files since the scan is stale, and
+``folder_names()`` lists it from disk instead.
+
+Arrow/Feather would need pyarrow, which the preprocessing environment does not
+ship; SQLite is in the standard library and is queried without loading it all.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from convert_clinical import T_STAGE_CODES_2019, stage_number
+
+PROJECT_ROOT = Path("/Users/huangyijun/Projects/胃癌T分期")
+CLINICAL_DIR = PROJECT_ROOT / "gastric-scan-next" / "data"
+DEFAULT_MANIFEST = PROJECT_ROOT / "dataset_manifest.sqlite"
+FOLDERS = ("images", "overlays", "lymph_node_analysis", "annotations")
+SCHEMA_VERSION = 2
+
+# 2025 naming: <Group>_<Phase>_<Patient>[ (<seq>)], e.g. "Chemo_1MC_1424711 (3)"
+CURRENT_PATTERN = re.compile(
+    r"^(?P<group>[^_]+)_(?P<phase>[^_]+)_(?P<patient>[A-Za-z0-9]+)(?:\s*\((?P<seq>\d+)\))?"
+)
+# 2019/2024 naming: <Group>_<Year>_<queue>-<patient>-<seq>[(<slice thickness>)]
+LEGACY_PATTERN = re.compile(r"^(?P<group>[^_]+)_(?P<year>\d{4})_(?P<ids>[^(]+?)\s*(?:\((?P<slice>\d+)\))?$")
+
+
+@dataclass(frozen=True)
+class Cohort:
+    """A dataset root plus the clinical table that describes its patients."""
+
+    dataset: str
+    root: Path
+    cohort: str
+    clinical_json: Optional[Path]
+
+
+DEFAULT_COHORTS = [
+    Cohort("original", PROJECT_ROOT / "Gastric_Cancer_Dataset", "2025", CLINICAL_DIR / "clinical_data.json"),
+    Cohort("cropped", PROJECT_ROOT / "Gastric_Cancer_Dataset_Cropped", "2025", CLINICAL_DIR / "clinical_data.json"),
+    Cohort("2019", PROJECT_ROOT / "Gastric_Cancer_Dataset_2019", "2019", CLINICAL_DIR / "clinical_data_2019.json"),
+    Cohort("2019_cropped", PROJECT_ROOT / "2019年直接手术" / "Cropped", "2019", CLINICAL_DIR / "clinical_data_2019.json"),
+    Cohort("2019_nac", PROJECT_ROOT / "Gastric_Cancer_Dataset_2019_nac", "2019", CLINICAL_DIR / "clinical_data_2019_nac.json"),
+    Cohort("2024", PROJECT_ROOT / "Gastric_Cancer_Dataset_2024", "2024", CLINICAL_DIR / "clinical_data_2024.json"),
+    Cohort("2024_cropped", PROJECT_ROOT / "Gastric_Cancer_Dataset_2024_Cropped", "2024",
+           CLINICAL_DIR / "clinical_data_2024.json"),
+    Cohort("2024_nac", PROJECT_ROOT / "Gastric_Cancer_Dataset_2024_nac", "2024", CLINICAL_DIR / "clinical_data_2024_nac.json"),
+]
+
+COLUMNS = (
+    "dataset", "folder", "name", "stem", "cohort", "grp", "treatment", "queue", "patient",
+    "seq", "slice_thickness", "pT", "size", "mtime_ns", "width", "height", "sha1",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    dataset TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    cohort TEXT NOT NULL,
+    grp TEXT,
+    treatment TEXT,
+    queue TEXT,
+    patient TEXT,
+    seq INTEGER,
+    slice_thickness INTEGER,
+    pT TEXT,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    sha1 TEXT NOT NULL,
+    PRIMARY KEY (dataset, folder, name)
+);
+CREATE INDEX IF NOT EXISTS files_patient ON files (cohort, treatment, patient);
+CREATE INDEX IF NOT EXISTS files_stem ON files (dataset, stem);
+CREATE TABLE IF NOT EXISTS datasets (dataset TEXT PRIMARY KEY, root TEXT NOT NULL, cohort TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS folders (
+    dataset TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (dataset, folder)
+);
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the shared dataset manifest (SQLite).")
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=DEFAULT_MANIFEST,
+        help="Manifest file to create or update.",
+    )
+    parser.add_argument(
+        "--datasets",
+        nargs="+",
+        default=None,
+        help="Only rescan these dataset names (default: all known cohorts).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of hashing processes (default: CPU count).",
+    )
+    return parser.parse_args()
+
+
+def parse_name(stem: str, cohort: str) -> Dict[str, object]:
+    """
+    Shared filename grammar for every cohort. Overlay suffixes are ignored, so an
+    image, its overlays and its annotation parse to the same fields.
+    """
+    if stem.endswith("_overlay"):
+        stem = stem[: -len("_overlay")]
+    fields: Dict[str, object] = {
+        "grp": None, "treatment": None, "queue": None, "patient": None, "seq": None, "slice_thickness": None,
+    }
+    if cohort == "2025":
+        match = CURRENT_PATTERN.match(stem)
+        if match:
+            fields["grp"] = match.group("group")
+            fields["patient"] = match.group("patient")
+            fields["seq"] = int(match.group("seq")) if match.group("seq") else None
+    else:
+        match = LEGACY_PATTERN.match(stem)
+        if match:
+            fields["grp"] = match.group("group")
+            parts = match.group("ids").split("-")
+            # Same rules as the web app: queue-patient-seq, or patient-seq, or patient
+            if len(parts) >= 3:
+                fields["queue"], fields["patient"] = parts[0], parts[1]
+                seq = parts[2]
+            elif len(parts) == 2:
+                fields["patient"], seq = parts
+            else:
+                fields["patient"], seq = parts[0], None
+            fields["seq"] = int(seq) if seq and seq.isdigit() else None
+            if match.group("slice"):
+                fields["slice_thickness"] = int(match.group("slice"))
+    group = fields["grp"]
+    if group in ("Chemo", "NAC"):
+        fields["treatment"] = "nac"
+    elif group == "Surgery":
+        fields["treatment"] = "surgery"
+    return fields
+
+
+def normalize_t_stage(value: object) -> Optional[str]:
+    """Map pT values such as "4", "5.0", "T4b" or "ypT2" to T0..T4 (T4a/T4b give T4); unknown values give None."""
+    number = stage_number(value, T_STAGE_CODES_2019, "T")
+    return None if number is None else f"T{number}"
+
+
+def load_t_stages(clinical_json: Optional[Path]) -> Dict[str, Optional[str]]:
+    if clinical_json is None or not clinical_json.exists():
+        return {}
+    records = json.loads(clinical_json.read_text(encoding="utf-8"))
+    return {
+        str(pid): normalize_t_stage((record.get("pathology") or {}).get("pT"))
+        for pid, record in records.items()
+    }
+
+
+def probe_file(path: str) -> Tuple[str, Optional[int], Optional[int]]:
+    """SHA-1 of the bytes plus image dimensions read from the header only."""
+    data = Path(path).read_bytes()
+    width = height = None
+    if not path.endswith(".json"):
+        try:
+            with Image.open(path) as img:
+                width, height = img.size
+        except OSError:
+            pass
+    return hashlib.sha1(data).hexdigest(), width, height
+
+
+def connect(manifest: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(manifest))
+    conn.executescript(SCHEMA)
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),)
+    )
+    return conn
+
+
+def scan_cohort(
+    conn: sqlite3.Connection, cohort: Cohort, workers: Optional[int]
+) -> Dict[str, int]:
+    """Rescan one dataset root and replace its rows; unchanged files are not read again."""
+    previous = {
+        (row[0], row[1]): row[2:]
+        for row in conn.execute(
+            "SELECT folder, name, size, mtime_ns, sha1, width, height FROM files WHERE dataset = ?",
+            (cohort.dataset,),
+        )
+    }
+    stages = load_t_stages(cohort.clinical_json)
+
+    rows: List[Dict[str, object]] = []
+    to_probe: List[int] = []
+    folder_mtimes: Dict[str, int] = {}
+    for folder in FOLDERS:
+        folder_dir = cohort.root / folder
+        if not folder_dir.exists():
+            continue
+        # Taken before listing, so files added during the scan leave the folder stale
+        folder_mtimes[folder] = folder_dir.stat().st_mtime_ns
+        with os.scandir(folder_dir) as it:
+            entries = sorted(
+                (e for e in it if e.is_file() and not e.name.startswith("._") and e.name.endswith((".jpg", ".json"))),
+                key=lambda e: e.name,
+            )
+        for entry in entries:
+            stat = entry.stat()
+            stem = os.path.splitext(entry.name)[0]
+            row: Dict[str, object] = {
+                "dataset": cohort.dataset,
+                "folder": folder,
+                "name": entry.name,
+                "stem": stem[: -len("_overlay")] if stem.endswith("_overlay") else stem,
+                "cohort": cohort.cohort,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                **parse_name(stem, cohort.cohort),
+            }
+            row["pT"] = stages.get(str(row["patient"])) if row["patient"] else None
+            cached = previous.get((folder, entry.name))
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                row["sha1"], row["width"], row["height"] = cached[2], cached[3], cached[4]
+            else:
+                to_probe.append(len(rows))
+                row["_path"] = entry.path
+            rows.append(row)
+
+    if to_probe:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            paths = [rows[i].pop("_path") for i in to_probe]
+            for i, (sha1, width, height) in zip(to_probe, pool.map(probe_file, paths, chunksize=32)):
+                rows[i]["sha1"], rows[i]["width"], rows[i]["height"] = sha1, width, height
+
+    with conn:
+        conn.execute("DELETE FROM files WHERE dataset = ?", (cohort.dataset,))
+        conn.executemany(
+            f"INSERT INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+            ([row.get(col) for col in COLUMNS] for row in rows),
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO datasets (dataset, root, cohort) VALUES (?, ?, ?)",
+            (cohort.dataset, str(cohort.root), cohort.cohort),
+        )
+        conn.execute("DELETE FROM folders WHERE dataset = ?", (cohort.dataset,))
+        conn.executemany(
+            "INSERT INTO folders (dataset, folder, mtime_ns) VALUES (?, ?, ?)",
+            ((cohort.dataset, folder, mtime_ns) for folder, mtime_ns in folder_mtimes.items()),
+        )
+    return {"files": len(rows), "probed": len(to_probe)}
+
+
+def build_manifest(
+    manifest: Path = DEFAULT_MANIFEST,
+    cohorts: Iterable[Cohort] = DEFAULT_COHORTS,
+    workers: Optional[int] = None,
+) -> None:
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    conn = connect(manifest)
+    try:
+        for cohort in cohorts:
+            if not cohort.root.exists():
+                print(f"[WARN] Missing dataset: {cohort.root}")
+                continue
+            stats = scan_cohort(conn, cohort, workers)
+            print(f"{cohort.dataset}: {stats['files']} files ({stats['probed']} hashed)")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def load_files(
+    manifest: Path = DEFAULT_MANIFEST,
+    folder: Optional[str] = None,
+    datasets: Optional[Iterable[str]] = None,
+) -> List[Dict[str, object]]:
+    """
+    Rows of the manifest as dicts, filtered by folder and dataset names.
+    Raises FileNotFoundError when the manifest has not been built.
+    """
+    if not manifest.exists():
+        raise FileNotFoundError(f"Dataset manifest '{manifest}' does not exist; run dataset_manifest.py.")
+    query = "SELECT * FROM files"
+    clauses, params = [], []
+    if folder is not None:
+        clauses.append("folder = ?")
+        params.append(folder)
+    if datasets is not None:
+        names = list(datasets)
+        clauses.append(f"dataset IN ({', '.join('?' for _ in names)})")
+        params.extend(names)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY dataset, folder, name"
+
+    conn = connect_readonly(manifest)
+    try:
+        return [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+
+def connect_readonly(manifest: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{manifest}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def current_datasets(manifest: Path, folder: str, roots: Dict[str, Path]) -> List[str]:
+    """
+    Datasets (name -> root) whose ``folder`` directory is unchanged since it was
+    scanned: same recorded mtime, so no file was added, removed or renamed.
+    Manifests written before directory mtimes were recorded count as stale.
+    """
+    if not manifest.exists():
+        return []
+    conn = connect_readonly(manifest)
+    try:
+        recorded = {
+            row["dataset"]: row["mtime_ns"]
+            for row in conn.execute("SELECT dataset, mtime_ns FROM folders WHERE folder = ?", (folder,))
+        }
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+    current = []
+    for dataset, root in roots.items():
+        try:
+            mtime_ns = (Path(root) / folder).stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if recorded.get(dataset) == mtime_ns:
+            current.append(dataset)
+    return current
+
+
+def folder_names(root: Path, folder: str, manifest: Path = DEFAULT_MANIFEST, suffix: str = ".jpg") -> List[str]:
+    """
+    Sorted file names ending in ``suffix`` in <root>/<folder> (AppleDouble "._"
+    files excluded). Read from the manifest when it holds the dataset at ``root``
+    and the directory is current; otherwise listed from disk. A missing directory
+    gives an empty list.
+    """
+    directory = Path(root) / folder
+    if manifest.exists():
+        conn = connect_readonly(manifest)
+        try:
+            row = conn.execute("SELECT dataset FROM datasets WHERE root = ?", (str(root),)).fetchone()
+        finally:
+            conn.close()
+        if row and current_datasets(manifest, folder, {row["dataset"]: Path(root)}):
+            return [
+                str(file["name"])
+                for file in load_files(manifest, folder=folder, datasets=[row["dataset"]])
+                if str(file["name"]).endswith(suffix)
+            ]
+    if not directory.exists():
+        return []
+    with os.scandir(directory) as it:
+        return sorted(e.name for e in it if e.is_file() and not e.name.startswith("._") and e.name.endswith(suffix))
+
+
+def main() -> None:
+    args = parse_args()
+    cohorts = DEFAULT_COHORTS
+    if args.datasets:
+        cohorts = [c for c in DEFAULT_COHORTS if c.dataset in set(args.datasets)]
+    build_manifest(args.manifest, cohorts, args.workers)
+    print(f"Manifest written to: {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Build a content-addressed duplicate index across all cohort image folders.
+
+Every image under ``<dataset>/images`` gets an exact hash (SHA-1 of the file
+bytes), a pixel hash (SHA-1 of the decoded grayscale pixels, so re-encoded
+copies still match) and a 64-bit perceptual dHash. Images are grouped by
+exact/pixel identity and by perceptual distance, and NII-derived copies of
+DICOM frames (``Surgery_2019_2-692-2(16).jpg`` next to ``Surgery_2019_692-2.jpg``)
+are flagged by pixel content instead of filename heuristics alone.
+
+The JSON report is machine-readable; ``--apply`` deletes the flagged copies
+(and their overlays/annotations) without prompting, unlike
+cleanup_nii_only_images.py. A copy is only flagged when it matches the kept
+DICOM frame itself (same pixels or within the threshold), never through a
+chain of near-duplicates.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = Path("/Users/huangyijun/Projects/胃癌T分期")
+DEFAULT_DATASETS = [
+    PROJECT_ROOT / "Gastric_Cancer_Dataset",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2019",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2019_nac",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2024",
+    PROJECT_ROOT / "Gastric_Cancer_Dataset_2024_nac",
+]
+
+# NII-derived frames keep the slice thickness suffix, e.g. "2-692-2(16)".
+NII_DERIVED_PATTERN = re.compile(r"\(\d+\)$")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Find exact and near-duplicate images across cohorts."
+    )
+    parser.add_argument(
+        "--datasets",
+        type=Path,
+        nargs="+",
+        default=DEFAULT_DATASETS,
+        help="Dataset roots that contain an images/ folder.",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=PROJECT_ROOT / "dedup_report.json",
+        help="Where to write the JSON report.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=4,
+        help="Maximum dHash Hamming distance for near-duplicates (default: 4).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of hashing processes (default: CPU count).",
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Delete flagged NII-derived copies and their overlays/annotations.",
+    )
+    return parser.parse_args()
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash: compare neighbouring pixels of a 9x8 thumbnail."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_image(path: str) -> Optional[Dict[str, object]]:
+    """Compute file, pixel and perceptual hashes for one image."""
+    data = Path(path).read_bytes()
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    return {
+        "path": path,
+        "size": len(data),
+        "shape": list(gray.shape),
+        "file_sha1": hashlib.sha1(data).hexdigest(),
+        "pixel_sha1": hashlib.sha1(gray.tobytes()).hexdigest(),
+        "dhash": dhash(gray),
+    }
+
+
+def is_nii_derived(path: str) -> bool:
+    return bool(NII_DERIVED_PATTERN.search(Path(path).stem))
+
+
+class UnionFind:
+    def __init__(self, size: int) -> None:
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def near_duplicate_groups(hashes: List[int], threshold: int) -> List[List[int]]:
+    """
+    Group hashes within ``threshold`` bits of each other.
+
+    Each hash is split into ``threshold + 1`` bands; by the pigeonhole principle
+    two hashes within the threshold share at least one identical band, so only
+    hashes that collide in some band are compared bit by bit.
+    """
+    bands = threshold + 1
+    width = -(-64 // bands)
+    mask = (1 << width) - 1
+    uf = UnionFind(len(hashes))
+
+    for band in range(bands):
+        buckets: Dict[int, List[int]] = defaultdict(list)
+        shift = band * width
+        for idx, value in enumerate(hashes):
+            buckets[(value >> shift) & mask].append(idx)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            for i, a in enumerate(members):
+                for b in members[i + 1 :]:
+                    if bin(hashes[a] ^ hashes[b]).count("1") <= threshold:
+                        uf.union(a, b)
+
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for idx in range(len(hashes)):
+        groups[uf.find(idx)].append(idx)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def build_index(datasets: List[Path], workers: Optional[int]) -> List[Dict[str, object]]:
+    paths = []
+    for root in datasets:
+        images_dir = root / "images"
+        if not images_dir.exists():
+            print(f"[WARN] Missing images directory: {images_dir}")
+            continue
+        paths.extend(
+            str(p) for p in sorted(images_dir.glob("*.jpg")) if not p.name.startswith("._")
+        )
+    print(f"Hashing {len(paths)} images from {len(datasets)} datasets...")
+
+    records = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for record in pool.map(hash_image, paths, chunksize=32):
+            if record is not None:
+                records.append(record)
+    return records
+
+
+def direct_match(
+    record: Dict[str, object], originals: List[Dict[str, object]], threshold: int
+) -> Optional[Tuple[Dict[str, object], int]]:
+    """
+    The original closest to ``record`` with (original, dHash distance): a
+    pixel-identical one first, otherwise the nearest within ``threshold``; None
+    when no original matches directly.
+    """
+    best = None
+    for original in originals:
+        if original["pixel_sha1"] == record["pixel_sha1"]:
+            return original, 0
+        distance = bin(record["dhash"] ^ original["dhash"]).count("1")
+        if distance <= threshold and (best is None or distance < best[1]):
+            best = (original, distance)
+    return best
+
+
+def build_report(records: List[Dict[str, object]], threshold: int) -> Dict[str, object]:
+    exact: Dict[str, List[str]] = defaultdict(list)
+    for record in records:
+        exact[record["pixel_sha1"]].append(record["path"])
+    exact_groups = [sorted(paths) for paths in exact.values() if len(paths) > 1]
+
+    near_groups = [
+        sorted(records[i]["path"] for i in members)
+        for members in near_duplicate_groups([r["dhash"] for r in records], threshold)
+    ]
+
+    # Within a near-duplicate group, an NII-derived frame is redundant when a
+    # DICOM-derived frame of the same dataset matches it directly. Groups are
+    # transitive (A~B~C), so sharing a group alone is not enough.
+    by_path = {record["path"]: record for record in records}
+    nii_copies = []
+    for group in near_groups:
+        by_dataset: Dict[str, List[str]] = defaultdict(list)
+        for path in group:
+            by_dataset[str(Path(path).parent.parent)].append(path)
+        for paths in by_dataset.values():
+            originals = [p for p in paths if not is_nii_derived(p)]
+            for path in paths:
+                if not originals or not is_nii_derived(path):
+                    continue
+                match = direct_match(by_path[path], [by_path[p] for p in originals], threshold)
+                if match is not None:
+                    original, distance = match
+                    nii_copies.append({"path": path, "duplicate_of": original["path"], "distance": distance})
+
+    # Groups that span datasets can leak between train and test splits.
+    cross_dataset = [
+        group for group in near_groups
+        if len({str(Path(p).parent.parent) for p in group}) > 1
+    ]
+
+    return {
+        "total_images": len(records),
+        "threshold": threshold,
+        "exact_groups": exact_groups,
+        "near_groups": near_groups,
+        "cross_dataset_groups": cross_dataset,
+        "nii_copies": nii_copies,
+        "images": [
+            {**record, "dhash": f"{record['dhash']:016x}"} for record in records
+        ],
+    }
+
+
+def remove_with_companions(image_path: Path) -> int:
+    """Delete an image plus its overlays and annotation; return files removed."""
+    root = image_path.parent.parent
+    stem = image_path.stem
+    companions = [
+        image_path,
+        root / "overlays" / f"{stem}_overlay.jpg",
+        root / "lymph_node_analysis" / f"{stem}_overlay.jpg",
+        root / "annotations" / f"{stem}.json",
+    ]
+    removed = 0
+    for path in companions:
+        if path.exists():
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main() -> None:
+    args = parse_args()
+    records = build_index(args.datasets, args.workers)
+    report = build_report(records, args.threshold)
+
+    args.report.parent.mkdir(parents=True, exist_ok=True)
+    args.report.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+
+    print(f"Indexed images: {report['total_images']}")
+    print(f"Pixel-identical groups: {len(report['exact_groups'])}")
+    print(f"Near-duplicate groups (<= {args.threshold} bits): {len(report['near_groups'])}")
+    print(f"Groups spanning datasets: {len(report['cross_dataset_groups'])}")
+    print(f"NII-derived copies of DICOM frames: {len(report['nii_copies'])}")
+    print(f"Report written to: {args.report}")
+
+    if args.apply and report["nii_copies"]:
+        removed = sum(remove_with_companions(Path(item["path"])) for item in report["nii_copies"])
+        print(f"Removed {len(report['nii_copies'])} NII-derived images ({removed} files in total).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Parse each clinical workbook once and serve later reads from a columnar snapshot.
+
+openpyxl parsing dominates every clinical script. The first read of a workbook
+opens it once, parses every sheet and stores one file per sheet under
+
+    <snapshot dir>/<workbook sha1>/<options key>/
+
+together with ``meta.json`` (sheet order, per-sheet format and parse errors).
+Later reads of the same bytes with the same ``read_excel`` options load the
+snapshot instead of the XLSX. Editing the workbook changes its hash, so stale
+snapshots are never served; the pandas version is part of the options key.
+
+Sheets are stored as Parquet when pyarrow is installed and the frame survives
+the round trip unchanged (same values and dtypes). Mixed-type object columns,
+such as ID columns holding both numbers and text, cannot be stored in Arrow
+without coercion, so those sheets - and every sheet when pyarrow is missing -
+are pickled instead, which keeps them exact.
+
+    from excel_snapshot import read_excel, sheet_names
+    df = read_excel(path)                    # first sheet, like pd.read_excel
+    df = read_excel(path, sheet_name="2024")
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+# Snapshots live in the checkout that holds these scripts (gitignored), not in a fixed home directory
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+SNAPSHOT_DIR = Path(os.environ.get("EXCEL_SNAPSHOT_DIR", PROJECT_ROOT / ".excel_snapshots"))
+META_NAME = "meta.json"
+SNAPSHOT_VERSION = 1
+
+SheetKey = Union[int, str]
+
+
+def workbook_sha1(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def options_key(options: Dict[str, object]) -> str:
+    """Stable key for the parse options (and the pandas version that produced the frames)."""
+    text = repr((SNAPSHOT_VERSION, pd.__version__, sorted(options.items())))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def write_sheet(df: pd.DataFrame, stem: Path) -> str:
+    """Write one sheet as Parquet when it round-trips exactly, else as a pickle. Returns the file name."""
+    if pyarrow is not None:
+        target = stem.with_suffix(".parquet")
+        try:
+            df.to_parquet(target)
+            back = pd.read_parquet(target)
+            if back.equals(df) and back.dtypes.equals(df.dtypes) and back.columns.equals(df.columns):
+                return target.name
+        except Exception:
+            pass
+        target.unlink(missing_ok=True)
+    target = stem.with_suffix(".pkl")
+    df.to_pickle(target)
+    return target.name
+
+
+def read_sheet(path: Path) -> pd.DataFrame:
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def build_snapshot(workbook: Path, target: Path, options: Dict[str, object]) -> Dict[str, object]:
+    """Parse every sheet through a single ExcelFile and write the snapshot directory atomically."""
+    tmp = target.with_name(f"{target.name}.tmp{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    sheets: List[Dict[str, object]] = []
+    with pd.ExcelFile(workbook) as xls:
+        for index, name in enumerate(xls.sheet_names):
+            entry: Dict[str, object] = {"name": name}
+            try:
+                df = xls.parse(name, **options)
+                entry["file"] = write_sheet(df, tmp / f"sheet{index:03d}")
+                entry["rows"] = len(df)
+            except Exception as e:
+                # Kept so that reading this sheet raises the same way every time
+                entry["error"] = f"{type(e).__name__}: {e}"
+            sheets.append(entry)
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "workbook": str(workbook),
+        "options": repr(sorted(options.items())),
+        "sheets": sheets,
+    }
+    (tmp / META_NAME).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    try:
+        os.replace(tmp, target)
+    except OSError:
+        # Another process finished the same snapshot first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return json.loads((target / META_NAME).read_text(encoding="utf-8"))
+
+
+def snapshot(path: Union[str, Path], snapshot_dir: Optional[Path] = None, **options) -> Path:
+    """Snapshot directory for this workbook and parse options, building it on first use."""
+    workbook = Path(path)
+    target = Path(snapshot_dir or SNAPSHOT_DIR) / workbook_sha1(workbook) / options_key(options)
+    if not (target / META_NAME).exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        build_snapshot(workbook, target, options)
+    return target
+
+
+def load_meta(target: Path) -> Dict[str, object]:
+    return json.loads((target / META_NAME).read_text(encoding="utf-8"))
+
+
+def sheet_names(path: Union[str, Path], snapshot_dir: Optional[Path] = None, **options) -> List[str]:
+    """Sheet names in workbook order (like ``pd.ExcelFile(path).sheet_names``)."""
+    return [sheet["name"] for sheet in load_meta(snapshot(path, snapshot_dir, **options))["sheets"]]
+
+
+def read_excel(
+    path: Union[str, Path],
+    sheet_name: Optional[SheetKey] = 0,
+    snapshot_dir: Optional[Path] = None,
+    **options,
+) -> Union[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """
+    Drop-in for ``pd.read_excel`` served from the snapshot.
+
+    ``sheet_name`` is a position or a name; ``None`` returns every readable
+    sheet as an ordered dict. Other keyword arguments are passed to the parser
+    and are part of the snapshot key.
+    """
+    target = snapshot(path, snapshot_dir, **options)
+    sheets = load_meta(target)["sheets"]
+
+    if sheet_name is None:
+        return {sheet["name"]: read_sheet(target / sheet["file"]) for sheet in sheets if "file" in sheet}
+
+    if isinstance(sheet_name, int):
+        if not -len(sheets) <= sheet_name < len(sheets):
+            raise IndexError(f"Worksheet index {sheet_name} is invalid, {len(sheets)} worksheets found")
+        sheet = sheets[sheet_name]
+    else:
+        sheet = next((s for s in sheets if s["name"] == sheet_name), None)
+        if sheet is None:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+    if "error" in sheet:
+        raise ValueError(f"Worksheet '{sheet['name']}' could not be parsed: {sheet['error']}")
+    return read_sheet(target / sheet["file"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Snapshot Excel workbooks so later reads skip XLSX parsing.")
+    parser.add_argument("workbooks", type=Path, nargs="+", help="Workbooks to snapshot")
+    parser.add_argument("--snapshot-dir", type=Path, default=None, help=f"Snapshot root (default: {SNAPSHOT_DIR})")
+    parser.add_argument("--rebuild", action="store_true", help="Drop existing snapshots of these workbooks first")
+    args = parser.parse_args()
+
+    root = args.snapshot_dir or SNAPSHOT_DIR
+    for workbook in args.workbooks:
+        if not workbook.exists():
+            print(f"[WARN] Missing workbook: {workbook}")
+            continue
+        if args.rebuild:
+            shutil.rmtree(root / workbook_sha1(workbook), ignore_errors=True)
+        start = time.time()
+        target = snapshot(workbook, root)
+        sheets = load_meta(target)["sheets"]
+        formats = sorted({Path(s["file"]).suffix.lstrip(".") for s in sheets if "file" in s})
+        failed = [s["name"] for s in sheets if "error" in s]
+        print(
+            f"{workbook}: {len(sheets)} sheet(s) as {'/'.join(formats) or '-'} in {time.time() - start:.2f}s"
+            + (f", unreadable: {', '.join(failed)}" if failed else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
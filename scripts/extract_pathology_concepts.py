@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
-"""Extract pathology concept features from the 2025 gastric cancer Excel sheet."""
+"""
+Extract pathology concept features from the 2025 gastric cancer Excel sheet.
+
+Every concept pattern in PATTERN_MAP starts with a literal marker (Ki-67, CPS,
+PD-1, CD3, 脉管, ...). Reports are scanned once with a combined trigger regex
+that finds every marker position; each concept's full pattern is then tried
+only at its own marker positions. The first match per concept is exactly what
+``pattern.search`` returned, and all matches come with character offsets into
+the cleaned report.
+"""
 
 from __future__ import annotations
 
 import argparse
 import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 
 import pandas as pd
 
+from concept_values import concept_table, default_table_path, normalize_concepts, typed_features, write_table
+from excel_snapshot import read_excel
+
 
 # Improved regex patterns to avoid greedy matching
 PATTERN_MAP: dict[str, re.Pattern] = {
@@ -35,6 +50,31 @@ PATTERN_MAP: dict[str, re.Pattern] = {
     "neural": re.compile(r"神经(?:侵犯|浸润)?(?:[^，；。\n]*?)?(?:见|有|无|未见)(?:[^，；。\n]*?)?(?:侵犯|浸润)?", re.IGNORECASE),
 }
 
+# Literal marker every PATTERN_MAP match starts with, used to trigger the full pattern
+TRIGGERS: dict[str, str] = {
+    "ki67": r"Ki-?67",
+    "cps": r"CPS",
+    "pd1": r"PD-1",
+    "foxp3": r"FoxP3",
+    "cd3": r"CD3",
+    "cd4": r"CD4",
+    "cd8": r"CD8",
+    "vascular": r"脉管|血管",
+    "neural": r"神经",
+}
+
+# Markers never overlap each other, so one alternation finds every marker position. The
+# leading character class lets the regex engine skip other positions without trying each branch.
+TRIGGER_PATTERN = re.compile(
+    "(?=[" + "".join(sorted({branch[0] for trigger in TRIGGERS.values() for branch in trigger.split("|")})) + "])"
+    "(?:" + "|".join(f"(?P<{key}>{trigger})" for key, trigger in TRIGGERS.items()) + ")",
+    re.IGNORECASE,
+)
+TRAILING_PUNCTUATION = ",.;:"
+
+# Reports per task when extracting on a process pool
+CHUNK_SIZE = 256
+
 # Mapping for numeric codes
 DIFFERENTIATION_MAP = {
     "1": "高分化",
@@ -52,6 +92,13 @@ LAUREN_MAP = {
     "10": "10" # Keep original if unknown
 }
 
+class ConceptMatch(NamedTuple):
+    concept: str
+    text: str
+    start: int
+    end: int
+
+
 def clean_text(value: object) -> str:
     if pd.isna(value):
         return ""
@@ -61,23 +108,101 @@ def clean_text(value: object) -> str:
     return re.sub(r"\s+", " ", text).strip()
 
 
+def clean_series(values: pd.Series) -> pd.Series:
+    """clean_text over a column (pandas string regexes do not treat non-breaking spaces as \\s)."""
+    return values.astype(object).map(clean_text)
+
+
+def find_concepts(search_text: str, first_only: bool = False) -> list[ConceptMatch]:
+    """
+    All concept matches in an already cleaned report, ordered by offset.
+
+    Matches of one concept do not overlap (like ``finditer``); matches of
+    different concepts may, e.g. CD3 and CD4 in "CD3、CD4阳性". With
+    ``first_only`` each concept stops at its first match.
+    """
+    matches: list[ConceptMatch] = []
+    resume: dict[str, int] = {}
+    for trigger in TRIGGER_PATTERN.finditer(search_text):
+        concept = trigger.lastgroup
+        position = trigger.start()
+        if position < resume.get(concept, 0):
+            continue
+        match = PATTERN_MAP[concept].match(search_text, position)
+        if match:
+            # Cleanup trailing garbage
+            value = match.group(0).strip().rstrip(TRAILING_PUNCTUATION).strip()
+            matches.append(ConceptMatch(concept, value, match.start(), match.end()))
+            if first_only:
+                resume[concept] = len(search_text) + 1
+                if len(resume) == len(PATTERN_MAP):
+                    break
+            else:
+                resume[concept] = max(match.end(), position + 1)
+    return matches
+
+
+def first_matches(search_text: str) -> dict[str, str]:
+    """First match per concept, in PATTERN_MAP order."""
+    found = {match.concept: match.text for match in find_concepts(search_text, first_only=True)}
+    return {key: found[key] for key in PATTERN_MAP if key in found}
+
+
 def extract_features_from_text(text: str) -> dict[str, str]:
     if not text:
         return {}
-    features: dict[str, str] = {}
-    
-    # Pre-cleaning for extraction
-    search_text = clean_text(text)
-    
-    for key, pattern in PATTERN_MAP.items():
-        match = pattern.search(search_text)
-        if match:
-            val = match.group(0).strip()
-            # Cleanup trailing garbage
-            val = re.sub(r"[,\.;:]+$", "", val).strip()
-            features[key] = val
-            
-    return features
+    return first_matches(clean_text(text))
+
+
+def _scan_chunk(job: tuple[list[str], bool]) -> list[list[ConceptMatch]]:
+    texts, first_only = job
+    return [find_concepts(text, first_only) for text in texts]
+
+
+def scan_series(texts: pd.Series, workers: int | None = 1, first_only: bool = False) -> list[list[ConceptMatch]]:
+    """Concept matches for every report in ``texts``; ``workers`` > 1 scans chunks on a process pool."""
+    cleaned = clean_series(texts).tolist()
+    if not workers or workers <= 1 or len(cleaned) <= CHUNK_SIZE:
+        return _scan_chunk((cleaned, first_only))
+    jobs = [(cleaned[i:i + CHUNK_SIZE], first_only) for i in range(0, len(cleaned), CHUNK_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [matches for chunk in pool.map(_scan_chunk, jobs) for matches in chunk]
+
+
+def extract_concepts(texts: pd.Series, workers: int | None = 1, offsets: bool = False) -> pd.DataFrame:
+    """
+    First match per concept for a whole column, like ``Series.str.extract``:
+    one column per concept, NaN where the concept is absent. With ``offsets``
+    a ``<concept>_start`` column holds each match's offset in the cleaned report.
+    """
+    rows = []
+    for matches in scan_series(texts, workers, first_only=True):
+        row: dict[str, object] = {match.concept: match.text for match in matches}
+        if offsets:
+            row.update({f"{match.concept}_start": match.start for match in matches})
+        rows.append(row)
+    columns = list(PATTERN_MAP)
+    if offsets:
+        columns += [f"{key}_start" for key in PATTERN_MAP]
+    return pd.DataFrame(rows, index=texts.index, columns=columns)
+
+
+def extractall_concepts(texts: pd.Series, workers: int | None = 1) -> pd.DataFrame:
+    """
+    Every match with offsets into the cleaned report, like ``Series.str.extractall``:
+    indexed by (original index, match number), columns concept/text/start/end.
+    """
+    records = []
+    keys = []
+    for index, matches in zip(texts.index, scan_series(texts, workers)):
+        for number, match in enumerate(matches):
+            keys.append((index, number))
+            records.append((match.concept, match.text, match.start, match.end))
+    return pd.DataFrame(
+        records,
+        index=pd.MultiIndex.from_tuples(keys, names=[texts.index.name, "match"]),
+        columns=["concept", "text", "start", "end"],
+    )
 
 
 def map_value(value: str, mapping: dict[str, str]) -> str:
@@ -98,43 +223,76 @@ def map_value(value: str, mapping: dict[str, str]) -> str:
     return value # Return original if no map found
 
 
-def parse_excel(path: Path) -> dict[str, dict[str, str]]:
-    df = pd.read_excel(path, dtype=str)
-    results: dict[str, dict[str, str]] = {}
+def map_series(values: pd.Series, mapping: dict[str, str]) -> pd.Series:
+    """Column-wise map_value."""
+    return values.map(mapping).fillna(values.str.removesuffix(".0").map(mapping)).fillna(values)
+
+
+def parse_excel(path: Path, workers: int | None = 1) -> dict[str, dict[str, object]]:
+    df = read_excel(path, dtype=str)
+
+    def column(name: str | None) -> pd.Series:
+        if name is None or name not in df.columns:
+            return pd.Series("", index=df.index)
+        return clean_series(df[name])
 
     # Column name patterns (handles slight variations)
     col_diff = next((c for c in df.columns if "分化程度" in str(c)), None)
     col_lauren = next((c for c in df.columns if "Lauren" in str(c)), None)
-    col_pt = next((c for c in df.columns if "pT" in str(c) or "pStage" in str(c)), None)
 
-    for _, row in df.iterrows():
-        patient_id = clean_text(row.get("住院号", ""))
-        if not patient_id:
-            continue
-            
-        pathology_text = clean_text(row.get("病理", ""))
-        features = extract_features_from_text(pathology_text)
-        
-        # Get mapped values
-        diff_raw = clean_text(row.get(col_diff, "")) if col_diff else ""
-        lauren_raw = clean_text(row.get(col_lauren, "")) if col_lauren else ""
-        
-        features["differentiation"] = map_value(diff_raw, DIFFERENTIATION_MAP)
-        features["lauren"] = map_value(lauren_raw, LAUREN_MAP)
-        
-        results[patient_id] = {
-            "name": clean_text(row.get("姓名", "")),
-            "age": clean_text(row.get("年龄", "")),
-            "sex": clean_text(row.get("性别： 0=女， 1=男", "")).replace("0", "Female").replace("1", "Male").replace("女", "Female").replace("男", "Male"),
-            "tumor_length_cm": clean_text(row.get("长径：cm", "")),
-            "tumor_thickness_cm": clean_text(row.get("厚径：cm", "")),
-            "cea": clean_text(row.get("CEA", "")),
-            "ca199": clean_text(row.get("CA199", "")),
-            "concept_features": features,
-        }
+    patient_ids = column("住院号")
+    df = df[patient_ids != ""]
+    patient_ids = patient_ids[patient_ids != ""]
+
+    pathology = column("病理")
+    concepts = extract_concepts(pathology, workers, offsets=True)
+    typed_rows = typed_features(normalize_concepts(concepts, pathology))
+    concepts = concepts[list(PATTERN_MAP)]
+    differentiation = map_series(column(col_diff), DIFFERENTIATION_MAP)
+    lauren = map_series(column(col_lauren), LAUREN_MAP)
+    sex = column("性别： 0=女， 1=男")
+    for old, new in (("0", "Female"), ("1", "Male"), ("女", "Female"), ("男", "Male")):
+        sex = sex.str.replace(old, new, regex=False)
+
+    fields = {
+        "name": column("姓名"),
+        "age": column("年龄"),
+        "sex": sex,
+        "tumor_length_cm": column("长径：cm"),
+        "tumor_thickness_cm": column("厚径：cm"),
+        "cea": column("CEA"),
+        "ca199": column("CA199"),
+    }
+
+    results: dict[str, dict[str, object]] = {}
+    rows = zip(
+        patient_ids.tolist(),
+        concepts.to_dict("records"),
+        typed_rows,
+        differentiation.tolist(),
+        lauren.tolist(),
+        *(series.tolist() for series in fields.values()),
+    )
+    for patient_id, found, typed, diff, lauren_type, *field_values in rows:
+        features: dict[str, object] = {key: value for key, value in found.items() if isinstance(value, str)}
+        features["differentiation"] = diff
+        features["lauren"] = lauren_type
+        features.update(typed)
+        results[patient_id] = {**dict(zip(fields, field_values)), "concept_features": features}
     return results
 
 
+def write_outputs(combined: dict[str, dict[str, object]], output_path: Path, table_path: Path | None = None) -> None:
+    """Concepts JSON plus the typed concept table (default: next to the JSON)."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(combined, ensure_ascii=False, indent=2))
+    print(f"Wrote {len(combined)} concept feature entries to {output_path}")
+
+    table_path = table_path or default_table_path(output_path.parent)
+    write_table(concept_table(combined), table_path)
+    print(f"Wrote typed concept table to {table_path}")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Extract pathology concept features from Excel.")
     parser.add_argument(
@@ -150,9 +308,20 @@ def main() -> None:
         default="scripts/extracted_pathology_concepts.json",
         help="Path to write extracted JSON.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes for concept extraction (default: CPU count).",
+    )
+    parser.add_argument(
+        "--table",
+        default=None,
+        help="Typed concept table, .parquet or .csv (default: pathology_concept_table next to --output).",
+    )
     args = parser.parse_args()
 
-    combined: dict[str, dict[str, str]] = {}
+    combined: dict[str, dict[str, object]] = {}
     for excel_path in args.input:
         path = Path(excel_path)
         if not path.exists():
@@ -166,15 +335,12 @@ def main() -> None:
                 
         try:
             print(f"Parsing {path}...")
-            extracted = parse_excel(path)
+            extracted = parse_excel(path, args.workers or os.cpu_count())
             combined.update(extracted)
         except Exception as e:
             print(f"Error parsing {path}: {e}")
 
-    output_path = Path(args.output)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    output_path.write_text(json.dumps(combined, ensure_ascii=False, indent=2))
-    print(f"Wrote {len(combined)} concept feature entries to {output_path}")
+    write_outputs(combined, Path(args.output), Path(args.table) if args.table else None)
 
 
 if __name__ == "__main__":
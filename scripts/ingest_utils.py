@@ -0,0 +1,273 @@
+"""
+DICOM + NIfTI 读取的公共工具，供 process_*_project.py 共用
+
+两阶段读取：
+1. 只读文件头（pydicom stop_before_pixels / nibabel header），收集尺寸、模态、
+   光度解释和病人ID写入清单，并提前发现与掩膜尺寸不一致的配对
+2. 只有通过检查的配对才解码像素
+
+每帧输出：轮廓只提取一次（LabelMe标注和overlay共用），图像和overlay各只编码一次，
+overlays/ 与 lymph_node_analysis/ 中相同的overlay用硬链接（失败时复制）
+
+各阶段（prescan/decode/contour/encode/write）的累计耗时记录在 STAGE_TIMES 中，
+供 benchmark_ingest.py 统计
+"""
+
+import os
+import io
+import json
+import time
+import shutil
+import functools
+from collections import defaultdict
+
+import numpy as np
+import pydicom
+import nibabel as nib
+import cv2
+from PIL import Image
+
+# 各阶段累计耗时（秒），每个进程各自累计
+STAGE_TIMES = defaultdict(float)
+
+
+def timed_stage(name):
+    """装饰器：把函数耗时累加到 STAGE_TIMES[name]"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STAGE_TIMES[name] += time.perf_counter() - start
+        return wrapper
+    return decorator
+
+
+@timed_stage("prescan")
+def read_dicom_header(dcm_path):
+    """只读取DICOM文件头，不解码像素"""
+    ds = pydicom.dcmread(dcm_path, stop_before_pixels=True)
+    return {
+        "rows": int(ds.get("Rows", 0) or 0),
+        "columns": int(ds.get("Columns", 0) or 0),
+        "samples_per_pixel": int(ds.get("SamplesPerPixel", 1) or 1),
+        "frames": int(ds.get("NumberOfFrames", 1) or 1),
+        "modality": str(ds.get("Modality", "")),
+        "photometric": str(ds.get("PhotometricInterpretation", "")),
+        "patient_id": str(ds.get("PatientID", "")),
+    }
+
+
+@timed_stage("prescan")
+def read_nii_shape(nii_path):
+    """从NIfTI头读取掩膜尺寸（去掉长度为1的维度），不加载体数据"""
+    shape = nib.load(nii_path).shape
+    return tuple(d for d in shape if d != 1)
+
+
+def prescan_pairs(pairs):
+    """
+    第一阶段：只读文件头，检查每个 (dcm_path, nii_path, ...) 配对
+    返回 (可处理的配对列表, 清单条目列表)
+    配对元组的前两个元素必须是 dcm_path 和 nii_path，其余元素原样保留
+    """
+    valid = []
+    manifest = []
+    for pair in pairs:
+        dcm_path, nii_path = pair[0], pair[1]
+        entry = {
+            "dicom": os.path.basename(dcm_path),
+            "nii": os.path.basename(nii_path),
+        }
+        try:
+            header = read_dicom_header(dcm_path)
+            mask_shape = read_nii_shape(nii_path)
+        except Exception as e:
+            entry["status"] = "unreadable"
+            entry["error"] = str(e)
+            manifest.append(entry)
+            continue
+
+        entry.update(header)
+        entry["mask_shape"] = list(mask_shape)
+
+        image_shape = (header["rows"], header["columns"])
+        if mask_shape == image_shape:
+            entry["status"] = "ok"
+            valid.append(pair)
+        elif mask_shape[::-1] == image_shape:
+            # 掩膜需要转置，与 load_mask 中的修正一致
+            entry["status"] = "ok"
+            entry["transposed"] = True
+            valid.append(pair)
+        else:
+            entry["status"] = "shape_mismatch"
+            entry["error"] = f"Shape mismatch: DICOM {image_shape} vs NIfTI {mask_shape}"
+        manifest.append(entry)
+    return valid, manifest
+
+
+def write_manifest(path, manifest):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def normalize_to_uint8(pixel_array):
+    """
+    min/max 归一化到 0-255 的 uint8
+    整数像素用 int32 原地运算（结果等价于 (x - min) / (max - min) * 255 向下取整），
+    避免 float64 中间数组；其他类型用 float32
+    """
+    img_min = pixel_array.min()
+    img_max = pixel_array.max()
+    if img_max <= img_min:
+        return np.zeros(pixel_array.shape, dtype=np.uint8)
+    if pixel_array.dtype == np.uint8 and img_min == 0 and img_max == 255:
+        return pixel_array
+
+    if pixel_array.dtype.kind in "ui" and pixel_array.dtype.itemsize <= 2:
+        work = pixel_array.astype(np.int32)
+        work -= int(img_min)
+        work *= 255
+        work //= int(img_max) - int(img_min)
+    else:
+        work = pixel_array.astype(np.float32)
+        work -= np.float32(img_min)
+        work *= np.float32(255.0 / (float(img_max) - float(img_min)))
+    return work.astype(np.uint8)
+
+
+@timed_stage("decode")
+def load_dicom_rgb(dcm_path):
+    """第二阶段：解码DICOM像素并转为RGB uint8"""
+    ds = pydicom.dcmread(dcm_path)
+    pixel_array = ds.pixel_array
+
+    if len(pixel_array.shape) == 2:
+        img_norm = normalize_to_uint8(pixel_array)
+        return cv2.cvtColor(img_norm, cv2.COLOR_GRAY2RGB)
+    return pixel_array.astype(np.uint8, copy=False)
+
+
+@timed_stage("decode")
+def load_mask(nii_path, height, width):
+    """
+    读取NIfTI掩膜并对齐到 (height, width)
+    直接取 dataobj 而不是 get_fdata()，避免把整个掩膜转成 float64
+    尺寸无法对齐时抛出 ValueError
+    """
+    nii = nib.load(nii_path)
+    mask_2d = np.squeeze(np.asanyarray(nii.dataobj))
+
+    # Transpose fix
+    if mask_2d.shape != (height, width):
+        if mask_2d.T.shape == (height, width):
+            mask_2d = mask_2d.T
+        else:
+            raise ValueError(f"Shape mismatch: DICOM {(height, width)} vs NIfTI {mask_2d.shape}")
+    return mask_2d
+
+
+def nii_slice_count(nii):
+    """体数据的切片数（2D图像视为1个切片）"""
+    return nii.shape[2] if len(nii.shape) == 3 else 1
+
+
+def read_nii_slice(nii, index):
+    """
+    只读取第 index 个切片
+    对 dataobj 切片时 nibabel 只读取该切片对应的数据，不会加载整个体
+    """
+    if len(nii.shape) == 2:
+        return np.asanyarray(nii.dataobj)
+    if len(nii.shape) != 3:
+        raise ValueError(f"Unsupported shape: {nii.shape}")
+    return np.asanyarray(nii.dataobj[:, :, index])
+
+
+def largest_area_slice(nii):
+    """逐个切片统计非零像素，返回面积最大的切片序号（同一时刻只有一个切片在内存中）"""
+    areas = [np.count_nonzero(read_nii_slice(nii, i)) for i in range(nii_slice_count(nii))]
+    return int(np.argmax(areas))
+
+
+@timed_stage("contour")
+def find_mask_contours(mask):
+    """提取掩膜外轮廓，结果同时用于LabelMe标注和overlay绘制"""
+    contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+@timed_stage("contour")
+def contours_to_shapes(contours):
+    """把轮廓转换成LabelMe的polygon shapes"""
+    shapes = []
+    for contour in contours:
+        if cv2.contourArea(contour) < 10:
+            continue
+        epsilon = 0.001 * cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, epsilon, True)
+        points = approx.squeeze().tolist()
+
+        if len(points) < 3:
+            continue
+        if not isinstance(points[0], list):
+            if isinstance(points[0], (int, float)):
+                continue
+
+        shape = {
+            "label": "lesion",
+            "points": points,
+            "group_id": None,
+            "shape_type": "polygon",
+            "flags": {}
+        }
+        shapes.append(shape)
+    return shapes
+
+
+@timed_stage("encode")
+def encode_jpeg(img_rgb):
+    """用PIL把RGB图像编码为JPEG字节，同一份字节既写入images/也作为LabelMe imageData"""
+    buffer = io.BytesIO()
+    Image.fromarray(img_rgb).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@timed_stage("encode")
+def encode_overlay(img_rgb, contours):
+    """
+    创建中间透明的overlay（只画绿色边缘，线宽2像素）并编码为JPEG字节
+    RGB->BGR 转换生成的新数组直接作画布，不再额外复制
+    """
+    overlay_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+    cv2.drawContours(overlay_bgr, contours, -1, (0, 255, 0), 2)
+    ok, buffer = cv2.imencode(".jpg", overlay_bgr)
+    if not ok:
+        raise ValueError("Failed to encode overlay JPEG")
+    return buffer.tobytes()
+
+
+@timed_stage("write")
+def write_bytes(path, data):
+    """
+    写入文件；若目标已存在先删除，
+    避免通过硬链接改写到另一个目录中的同一文件
+    """
+    if os.path.lexists(path):
+        os.remove(path)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@timed_stage("write")
+def link_or_copy(src, dst):
+    """dst 与 src 内容相同时用硬链接代替第二次写入，跨文件系统等情况退回复制"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
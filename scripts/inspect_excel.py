@@ -1,10 +1,10 @@
-import pandas as pd
+from excel_snapshot import read_excel
 
 excel_path = "/Users/huangyijun/Projects/胃癌T分期/2025胃癌临床整理.xlsx"
 
 try:
     # 读取Excel文件
-    df = pd.read_excel(excel_path)
+    df = read_excel(excel_path)
     
     # 打印列名
     print("Columns:")
@@ -2,6 +2,8 @@
 """
 将视频文件与患者静态图数据关联
 生成包含视频URL的患者数据JSON
+有病人注册表（patient_registry.py）时按注册表中的治疗方式过滤，
+同一ID的直接手术/新辅助治疗病人不会互相挂上对方的视频
 """
 
 import os
@@ -15,6 +17,7 @@ PROJECT_ROOT = Path("/Users/huangyijun/Projects/胃癌T分期")
 VIDEO_OUTPUT_ROOT = PROJECT_ROOT / "gastric-scan-next/public/videos"
 PATIENT_DATA_PATH = PROJECT_ROOT / "gastric-scan-next/public/data/patients.json"
 OUTPUT_PATH = PROJECT_ROOT / "gastric-scan-next/public/data/patients_with_videos.json"
+REGISTRY_PATH = PROJECT_ROOT / "patient_registry.sqlite"
 
 
 def extract_patient_id(filename: str) -> str:
@@ -111,10 +114,27 @@ def scan_videos() -> dict:
     return dict(video_map)
 
 
-def link_videos_to_patients():
+def registry_treatments(id_short: str, registry: Path):
+    """
+    id_short 在病人注册表中对应病人的治疗方式（surgery/nac）集合
+    没有注册表、查不到病人或治疗方式未知时返回 None，此时不过滤视频
+    """
+    # patient_registry 导入本模块的 scan_videos，只能在这里导入
+    from patient_registry import find_patients
+
+    patients = find_patients(id_short, registry) or find_patients(extract_patient_id_from_image(id_short), registry)
+    treatments = {patient["treatment"] for patient in patients}
+    if not treatments or None in treatments:
+        return None
+    return treatments
+
+
+def link_videos_to_patients(registry: Path = REGISTRY_PATH):
     """
     将视频关联到患者数据
     """
+    from patient_registry import VIDEO_TREATMENTS
+
     print("=" * 50)
     print("🔗 患者视频关联工具")
     print("=" * 50)
@@ -143,12 +163,20 @@ def link_videos_to_patients():
     linked_count = 0
     patient_ids_with_videos = set()
     
+    if not registry.exists():
+        print(f"   ⚠️ 病人注册表不存在: {registry}，不按治疗方式过滤")
     for patient in patients:
         id_short = patient.get('id_short', '')
         patient_id = extract_patient_id_from_image(id_short)
         
         if patient_id in video_map:
-            patient['video_urls'] = video_map[patient_id]
+            videos = video_map[patient_id]
+            treatments = registry_treatments(id_short, registry) if registry.exists() else None
+            if treatments is not None:
+                videos = [v for v in videos if VIDEO_TREATMENTS.get(v["treatment"]) in treatments]
+            if not videos:
+                continue
+            patient['video_urls'] = videos
             patient_ids_with_videos.add(patient_id)
             linked_count += 1
     
@@ -1,58 +1,178 @@
 #!/usr/bin/env python3
-"""Merge extracted pathology concepts into clinical_data.json files."""
+"""
+Merge extracted pathology concepts into clinical_data.json files.
 
+Each record is hashed before and after the merge; a file is rewritten only
+when at least one record changed, via a temporary file and os.replace so an
+interrupted run never leaves a torn JSON behind. Besides the pretty file read
+by the web app, a compact JSON (<name>.min.json) and/or JSON Lines
+(<name>.jsonl, one {"patient_id": ..., ...record} per line) copy can be kept
+next to it with --also; a copy older than the pretty file (which other scripts
+also rewrite) is refreshed even when nothing was merged. The patient-keyed
+store (clinical_store.py) is rewritten together with the pretty file.
+"""
+
+import os
 import json
+import hashlib
+import argparse
 from pathlib import Path
 
+from clinical_store import write_store
+
+CONCEPTS_PATH = Path("scripts/extracted_pathology_concepts.json")
+
+# List of clinical data files to update
+DATA_FILES = [
+    "gastric-scan-next/data/clinical_data.json",
+    "gastric-scan-next/data/clinical_data_2024.json",
+    "gastric-scan-next/data/clinical_data_2024_nac.json",
+    "gastric-scan-next/data/clinical_data_2019.json",
+    "gastric-scan-next/data/clinical_data_2019_nac.json",
+]
+
+EXTRA_FORMATS = ("compact", "jsonl")
+
+
 def load_json(path):
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def save_json(path, data):
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
-def main():
-    concepts_path = Path("scripts/extracted_pathology_concepts.json")
-    if not concepts_path.exists():
-        print("Extracted concepts file not found.")
-        return
+def record_hash(record):
+    """Content hash of one record, independent of key order and formatting."""
+    canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
 
-    concepts_data = load_json(concepts_path)
-    
-    # List of clinical data files to update
-    data_files = [
-        "gastric-scan-next/data/clinical_data.json",
-        "gastric-scan-next/data/clinical_data_2024.json",
-        "gastric-scan-next/data/clinical_data_2024_nac.json",
-        "gastric-scan-next/data/clinical_data_2019.json",
-        "gastric-scan-next/data/clinical_data_2019_nac.json"
-    ]
+def render(data, fmt):
+    if fmt == "pretty":
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    if fmt == "compact":
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    if fmt == "jsonl":
+        return "".join(
+            json.dumps({"patient_id": pid, **record}, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for pid, record in data.items()
+        )
+    raise ValueError(f"Unknown format: {fmt}")
 
+
+def format_path(path, fmt):
+    if fmt == "compact":
+        return path.with_suffix(".min.json")
+    if fmt == "jsonl":
+        return path.with_suffix(".jsonl")
+    return path
+
+
+def write_atomic(path, text):
+    tmp = path.with_name(f".{path.name}.tmp{os.getpid()}")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def is_stale(target, source):
+    """target is missing or was written before source was last modified."""
+    try:
+        return target.stat().st_mtime_ns < source.stat().st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+
+def merge_records(clinical_data, concepts_data):
+    """
+    Copy concept_features into matching records in place.
+    Returns {"added": [...], "changed": [...], "unchanged": int} and per-concept change counts.
+    """
+    added, changed, unchanged = [], [], 0
+    concept_changes = {}
+    for pid, record in clinical_data.items():
+        # Note: PIDs in concepts_data are strings
+        extracted = concepts_data.get(pid)
+        if not extracted or "concept_features" not in extracted:
+            continue
+        old_features = record.get("concept_features")
+        new_features = extracted["concept_features"]
+        before = record_hash(record)
+        record["concept_features"] = new_features
+        if record_hash(record) == before:
+            unchanged += 1
+            continue
+        if old_features is None:
+            added.append(pid)
+        else:
+            changed.append(pid)
+        old_features = old_features or {}
+        for key in set(old_features) | set(new_features):
+            if old_features.get(key) != new_features.get(key):
+                concept_changes[key] = concept_changes.get(key, 0) + 1
+    return {"added": added, "changed": changed, "unchanged": unchanged, "concepts": concept_changes}
+
+
+def merge_file(path, concepts_data, also=(), dry_run=False):
+    """Merge one clinical JSON; writes the pretty file (and extra formats) only when needed."""
+    clinical_data = load_json(path)
+    summary = merge_records(clinical_data, concepts_data)
+    dirty = bool(summary["added"] or summary["changed"])
+    summary["written"] = []
+    for fmt in ("pretty", *also):
+        target = format_path(path, fmt)
+        # Extra formats are also written when missing or older than the pretty file
+        if dry_run or (not dirty and not is_stale(target, path)):
+            continue
+        write_atomic(target, render(clinical_data, fmt))
+        summary["written"].append(target.name)
+        if fmt == "pretty":
+            write_store(clinical_data, path)
+    return summary
+
+
+def merge_concepts(concepts_data, data_files=DATA_FILES, also=(), dry_run=False):
+    """Merge into every existing data file; returns {path: summary}."""
+    results = {}
     for file_path_str in data_files:
         file_path = Path(file_path_str)
         if not file_path.exists():
             continue
-            
-        print(f"Processing {file_path}...")
-        clinical_data = load_json(file_path)
-        updated_count = 0
-        
-        for pid, record in clinical_data.items():
-            # Check if we have extracted concepts for this PID
-            # Note: PIDs in concepts_data are strings
-            if pid in concepts_data:
-                extracted = concepts_data[pid]
-                if "concept_features" in extracted:
-                    record["concept_features"] = extracted["concept_features"]
-                    updated_count += 1
-        
-        if updated_count > 0:
-            save_json(file_path, clinical_data)
-            print(f"  Updated {updated_count} records in {file_path.name}")
-        else:
-            print(f"  No matching records found in {file_path.name}")
+        results[file_path] = merge_file(file_path, concepts_data, also, dry_run)
+    return results
+
+
+def print_summary(results, verbose=False):
+    for path, summary in results.items():
+        added, changed = summary["added"], summary["changed"]
+        print(f"{path}: {len(added)} added, {len(changed)} changed, {summary['unchanged']} unchanged"
+              + (f" -> wrote {', '.join(summary['written'])}" if summary["written"] else ""))
+        if summary["concepts"]:
+            fields = ", ".join(f"{key} {count}" for key, count in sorted(summary["concepts"].items()))
+            print(f"  changed fields: {fields}")
+        if verbose:
+            for label, pids in (("added", added), ("changed", changed)):
+                if pids:
+                    print(f"  {label}: {' '.join(pids)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge extracted pathology concepts into the clinical JSON files.")
+    parser.add_argument("--concepts", type=Path, default=CONCEPTS_PATH, help="Extracted concepts JSON")
+    parser.add_argument("--files", nargs="+", default=DATA_FILES, help="Clinical JSON files to update")
+    parser.add_argument("--also", nargs="+", choices=EXTRA_FORMATS, default=[],
+                        help="Also keep a compact JSON (.min.json) and/or JSON Lines (.jsonl) copy")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--verbose", "-v", action="store_true", help="List the patient IDs that changed")
+    args = parser.parse_args()
+
+    if not args.concepts.exists():
+        print("Extracted concepts file not found.")
+        return
+
+    results = merge_concepts(load_json(args.concepts), args.files, args.also, args.dry_run)
+    print_summary(results, args.verbose)
+
 
 if __name__ == "__main__":
     main()
-
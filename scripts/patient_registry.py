@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+One SQLite registry of every patient across cohorts, keyed by (cohort, patient_id).
+
+The registry joins what is otherwise looked up separately by each tool:
+
+    images     rows of the dataset manifest (dataset_manifest.py)
+    clinical   the record from the cohort's clinical_data*.json
+    concepts   concept_features from extracted_pathology_concepts.json
+    videos     transcoded videos found by link_videos.scan_videos()
+
+``cohort`` is the clinical cohort name used by convert_clinical.py ("2025",
+"2019", "2019_nac", "2024", "2024_nac"), so 2019 surgery patient 7 and 2019 NAC
+patient 7 stay distinct. Patient IDs in file names are parsed once, here, with
+the shared rules of dataset_manifest.parse_name (images) and
+link_videos.extract_patient_id (videos); every image stem, video stem and
+patient ID is stored in ``aliases``, so a file name resolves to its patient
+without re-parsing it.
+
+Both tables are primary-key tables (WITHOUT ROWID), so "everything about
+patient X" is one indexed read:
+
+    from patient_registry import get_patient, find_patients
+    get_patient("2024", "1375062")
+    find_patients("Surgery_2019_1-800-6")
+
+link_videos.py reads the registry to keep each patient's videos to its own
+treatment. patient_split.py stays on the dataset manifest, which the registry's
+images come from. The process_*_project.py ingest scripts parse NII names
+before any of these tables exist.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from convert_clinical import COHORTS
+from dataset_manifest import DEFAULT_MANIFEST, PROJECT_ROOT, load_files, normalize_t_stage
+from link_videos import extract_patient_id, scan_videos
+
+DEFAULT_REGISTRY = PROJECT_ROOT / "patient_registry.sqlite"
+CONCEPTS_JSON = PROJECT_ROOT / "scripts" / "extracted_pathology_concepts.json"
+# Cohort whose Excel the concept extractor reads
+CONCEPTS_COHORT = "2025"
+SCHEMA_VERSION = 1
+
+# Video folders use their own treatment names
+VIDEO_TREATMENTS = {"direct_surgery": "surgery", "neoadjuvant": "nac"}
+
+Key = Tuple[str, str]
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE patients (
+    cohort TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    treatment TEXT,
+    pT TEXT,
+    clinical TEXT,
+    concepts TEXT,
+    images TEXT NOT NULL,
+    videos TEXT NOT NULL,
+    PRIMARY KEY (cohort, patient_id)
+) WITHOUT ROWID;
+CREATE TABLE aliases (
+    alias TEXT NOT NULL,
+    cohort TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    PRIMARY KEY (alias, cohort, patient_id)
+) WITHOUT ROWID;
+"""
+
+JSON_COLUMNS = ("clinical", "concepts", "images", "videos")
+
+
+def registry_cohort(cohort: str, treatment: Optional[str]) -> str:
+    """Clinical cohort of a manifest row: 2025 keeps both treatments in one table."""
+    if cohort != "2025" and treatment == "nac":
+        return f"{cohort}_nac"
+    return cohort
+
+
+def cohort_treatment(cohort: str) -> Optional[str]:
+    if cohort == "2025":
+        return None
+    return "nac" if cohort.endswith("_nac") else "surgery"
+
+
+class RegistryBuilder:
+    """Collects one entry per (cohort, patient_id) from every source."""
+
+    def __init__(self) -> None:
+        self.patients: Dict[Key, Dict[str, object]] = {}
+        self.aliases: Dict[str, set] = defaultdict(set)
+
+    def entry(self, cohort: str, patient_id: str) -> Dict[str, object]:
+        key = (cohort, patient_id)
+        if key not in self.patients:
+            self.patients[key] = {
+                "treatment": cohort_treatment(cohort),
+                "pT": None,
+                "clinical": None,
+                "concepts": None,
+                "images": [],
+                "videos": [],
+            }
+            self.aliases[patient_id].add(key)
+        return self.patients[key]
+
+    def add_clinical(self, cohort: str, clinical_json: Path) -> int:
+        if not clinical_json.exists():
+            print(f"[WARN] Missing clinical JSON: {clinical_json}")
+            return 0
+        records = json.loads(clinical_json.read_text(encoding="utf-8"))
+        for pid, record in records.items():
+            entry = self.entry(cohort, str(pid))
+            entry["clinical"] = record
+            entry["pT"] = normalize_t_stage((record.get("pathology") or {}).get("pT"))
+        return len(records)
+
+    def add_concepts(self, cohort: str, concepts_json: Path) -> Tuple[int, int]:
+        """
+        Attach concept features to patients already in ``cohort``; returns (linked, unmatched).
+        IDs the cohort's clinical table does not know are counted, not added as patients.
+        """
+        if not concepts_json.exists():
+            print(f"[WARN] Missing concepts JSON: {concepts_json}")
+            return 0, 0
+        concepts = json.loads(concepts_json.read_text(encoding="utf-8"))
+        linked = unmatched = 0
+        for pid, extracted in concepts.items():
+            # Only the features: the extractor output also carries the patient's name
+            if "concept_features" not in extracted:
+                continue
+            entry = self.patients.get((cohort, str(pid)))
+            if entry is None:
+                unmatched += 1
+                continue
+            entry["concepts"] = extracted["concept_features"]
+            linked += 1
+        return linked, unmatched
+
+    def add_images(self, manifest: Path) -> int:
+        try:
+            rows = load_files(manifest)
+        except FileNotFoundError as e:
+            print(f"[WARN] {e}")
+            return 0
+        count = 0
+        for row in rows:
+            if not row["patient"]:
+                continue
+            cohort = registry_cohort(row["cohort"], row["treatment"])
+            entry = self.entry(cohort, str(row["patient"]))
+            if entry["treatment"] is None:
+                entry["treatment"] = row["treatment"]
+            entry["images"].append({key: row[key] for key in ("dataset", "folder", "name", "seq", "width", "height")})
+            self.aliases[row["stem"]].add((cohort, str(row["patient"])))
+            count += 1
+        return count
+
+    def add_videos(self) -> Tuple[int, int]:
+        """Attach videos to every patient with that ID and a matching treatment; returns (linked, unmatched)."""
+        by_id: Dict[str, List[Key]] = defaultdict(list)
+        for cohort, pid in self.patients:
+            by_id[pid].append((cohort, pid))
+        linked = unmatched = 0
+        for pid, videos in scan_videos().items():
+            for video in videos:
+                treatment = VIDEO_TREATMENTS.get(video["treatment"])
+                keys = [
+                    key for key in by_id.get(pid, [])
+                    if self.patients[key]["treatment"] in (None, treatment)
+                ]
+                if not keys:
+                    unmatched += 1
+                    continue
+                stem = Path(video["filename"]).stem
+                for key in keys:
+                    self.patients[key]["videos"].append(video)
+                    self.aliases[stem].add(key)
+                linked += 1
+        return linked, unmatched
+
+    def write(self, registry: Path) -> None:
+        """Write a fresh database next to ``registry`` and swap it in."""
+        registry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = registry.with_name(f"{registry.name}.tmp{os.getpid()}")
+        tmp.unlink(missing_ok=True)
+        conn = sqlite3.connect(str(tmp))
+        try:
+            conn.executescript(SCHEMA)
+            with conn:
+                conn.execute("INSERT INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+                conn.executemany(
+                    "INSERT INTO patients VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            cohort, pid, entry["treatment"], entry["pT"],
+                            *(_dump(entry[column]) for column in JSON_COLUMNS),
+                        )
+                        for (cohort, pid), entry in sorted(self.patients.items())
+                    ),
+                )
+                conn.executemany(
+                    "INSERT INTO aliases VALUES (?, ?, ?)",
+                    ((alias, *key) for alias, keys in sorted(self.aliases.items()) for key in sorted(keys)),
+                )
+        finally:
+            conn.close()
+        os.replace(tmp, registry)
+
+
+def _dump(value: object) -> Optional[str]:
+    return None if value is None else json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def build_registry(
+    registry: Path = DEFAULT_REGISTRY,
+    manifest: Path = DEFAULT_MANIFEST,
+    concepts_json: Path = CONCEPTS_JSON,
+    videos: bool = True,
+) -> Dict[str, int]:
+    builder = RegistryBuilder()
+    stats = {"clinical": 0}
+    for name, cohort in COHORTS.items():
+        stats["clinical"] += builder.add_clinical(name, Path(cohort.output_path))
+    stats["concepts"], stats["unmatched_concepts"] = builder.add_concepts(CONCEPTS_COHORT, concepts_json)
+    stats["images"] = builder.add_images(manifest)
+    if videos:
+        stats["videos"], stats["unmatched_videos"] = builder.add_videos()
+    builder.write(registry)
+    stats["patients"] = len(builder.patients)
+    return stats
+
+
+def _connect(registry: Path) -> sqlite3.Connection:
+    if not registry.exists():
+        raise FileNotFoundError(f"Patient registry '{registry}' does not exist; run patient_registry.py.")
+    conn = sqlite3.connect(f"file:{registry}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, object]:
+    patient = dict(row)
+    for column in JSON_COLUMNS:
+        if patient[column] is not None:
+            patient[column] = json.loads(patient[column])
+    return patient
+
+
+def get_patient(cohort: str, patient_id: object, registry: Path = DEFAULT_REGISTRY) -> Optional[Dict[str, object]]:
+    """Everything known about one patient, or None. Raises FileNotFoundError without a registry."""
+    conn = _connect(registry)
+    try:
+        row = conn.execute(
+            "SELECT * FROM patients WHERE cohort = ? AND patient_id = ?", (cohort, str(patient_id))
+        ).fetchone()
+    finally:
+        conn.close()
+    return _decode(row) if row else None
+
+
+def find_patients(identifier: str, registry: Path = DEFAULT_REGISTRY) -> List[Dict[str, object]]:
+    """
+    Patients matching a patient ID, an image/overlay stem or a video file name,
+    e.g. "1048931", "Surgery_2019_1-800-6" or "1048931-1.mp4". One ID can exist in
+    several cohorts, so this returns a list.
+    """
+    stem = Path(identifier).stem if identifier.endswith((".jpg", ".json", ".mp4")) else identifier
+    if stem.endswith("_overlay"):
+        stem = stem[: -len("_overlay")]
+    conn = _connect(registry)
+    try:
+        rows = conn.execute(
+            "SELECT p.* FROM aliases a JOIN patients p ON p.cohort = a.cohort AND p.patient_id = a.patient_id "
+            "WHERE a.alias = ? ORDER BY p.cohort",
+            (stem,),
+        ).fetchall()
+        if not rows and identifier.endswith(".mp4"):
+            # Videos not linked to any cohort still name the patient
+            rows = conn.execute(
+                "SELECT p.* FROM aliases a JOIN patients p ON p.cohort = a.cohort AND p.patient_id = a.patient_id "
+                "WHERE a.alias = ? ORDER BY p.cohort",
+                (extract_patient_id(identifier),),
+            ).fetchall()
+    finally:
+        conn.close()
+    return [_decode(row) for row in rows]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or query the cross-cohort patient registry (SQLite).")
+    parser.add_argument("--registry", type=Path, default=DEFAULT_REGISTRY, help="Registry file to create or read.")
+    parser.add_argument("--manifest", type=Path, default=DEFAULT_MANIFEST, help="Dataset manifest with the images.")
+    parser.add_argument("--concepts", type=Path, default=CONCEPTS_JSON, help="Extracted pathology concepts JSON.")
+    parser.add_argument("--no-videos", action="store_true", help="Skip scanning the video folders.")
+    parser.add_argument("--show", metavar="ID", help="Print the registry entries for a patient ID or file name.")
+    args = parser.parse_args()
+
+    if args.show:
+        print(json.dumps(find_patients(args.show, args.registry), ensure_ascii=False, indent=2))
+        return
+
+    stats = build_registry(args.registry, args.manifest, args.concepts, videos=not args.no_videos)
+    print(", ".join(f"{key}: {value}" for key, value in stats.items()))
+    print(f"Registry written to: {args.registry}")
+
+
+if __name__ == "__main__":
+    main()
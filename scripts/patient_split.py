@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
 """
 Create a patient-level train/val/test split without leaking subjects across sets.
-The script scans a directory of JPG images, extracts the patient identifier from
-each filename, shuffles patients deterministically, and writes both JSON and TXT
-manifests with the requested 70/10/20 split (or custom ratios via CLI flags).
+
+Images of every cohort (2025, 2019, 2024, surgery and NAC) are read from the
+shared dataset manifest (dataset_manifest.py), which already carries patient,
+treatment and pathological T stage for every file; cohorts missing from the
+manifest, or whose images/ directory changed since it was built, are listed
+from disk with the same filename grammar. Patients are then
+split with stratification on pT x cohort x treatment, so every split (and every
+cross-validation fold) sees the same stage/cohort mix. All assignments are
+vectorised over one pandas table.
+
+Outputs (JSON plus TXT manifests): the 70/10/20 split (or custom ratios via CLI
+flags) and K group folds over the train+val patients, with the test set held out.
+File names repeat across datasets, so images are listed by full path (JSON
+entries also carry the dataset and file name).
 """
 
 from __future__ import annotations
@@ -11,31 +22,52 @@ from __future__ import annotations
 import argparse
 import json
 import math
-import random
-import re
-from collections import defaultdict
+import os
 from pathlib import Path
-from typing import Dict, List, Sequence, Tuple
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
 
-# Compile once so the regex is fast and easy to tweak if naming changes later.
-PATIENT_PATTERN = re.compile(r"^[^_]+_[^_]+_(?P<patient>[A-Za-z0-9]+)")
+from dataset_manifest import (
+    CLINICAL_DIR,
+    DEFAULT_COHORTS as MANIFEST_COHORTS,
+    DEFAULT_MANIFEST,
+    PROJECT_ROOT,
+    Cohort,
+    current_datasets,
+    load_files,
+    load_t_stages,
+    parse_name,
+)
+
+SPLIT_NAMES = ("train", "val", "test")
+# Datasets of the shared manifest that feed the split (cropped 2025 plus the legacy cohorts)
+SPLIT_DATASETS = ("cropped", "2019", "2019_nac", "2024", "2024_nac")
+DEFAULT_COHORTS = [c for c in MANIFEST_COHORTS if c.dataset in SPLIT_DATASETS]
 
 
 def parse_args() -> argparse.Namespace:
     """Configure all CLI flags so the script stays reproducible and configurable."""
     parser = argparse.ArgumentParser(
-        description="Patient-level data split for the gastric cancer dataset."
+        description="Stratified patient-level data split for the gastric cancer dataset."
     )
     parser.add_argument(
         "--image-dir",
         type=Path,
-        default=Path("/Users/huangyijun/Projects/胃癌T分期/Gastric_Cancer_Dataset_Cropped/images"),
-        help="Directory that stores all JPG images (default points to cropped dataset).",
+        default=None,
+        help="Split a single 2025-style image directory instead of all default cohorts.",
+    )
+    parser.add_argument(
+        "--clinical-json",
+        type=Path,
+        default=CLINICAL_DIR / "clinical_data.json",
+        help="Clinical JSON used with --image-dir for pT stratification.",
     )
     parser.add_argument(
         "--output-dir",
         type=Path,
-        default=Path("/Users/huangyijun/Projects/胃癌T分期/splits"),
+        default=PROJECT_ROOT / "splits",
         help="Directory where the split manifests will be written.",
     )
     parser.add_argument(
@@ -46,42 +78,96 @@ def parse_args() -> argparse.Namespace:
         metavar=("TRAIN", "VAL", "TEST"),
         help="Train/val/test ratios that must sum to 1.0 (defaults to 70/10/20).",
     )
+    parser.add_argument(
+        "--folds",
+        type=int,
+        default=5,
+        help="Number of group folds over the train+val patients (0 disables CV manifests).",
+    )
     parser.add_argument(
         "--seed",
         type=int,
         default=42,
         help="Random seed so that the patient ordering and split stay reproducible.",
     )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=DEFAULT_MANIFEST,
+        help="Shared dataset manifest; cohorts missing from it are listed from disk.",
+    )
     return parser.parse_args()
 
 
-def extract_patient_id(stem: str) -> str:
-    """Return the patient identifier encoded in the filename stem."""
-    match = PATIENT_PATTERN.match(stem)
-    if not match:
-        raise ValueError(
-            f"Filename '{stem}' does not follow the expected pattern "
-            "'<group>_<course>_<patient> (image)'."
-        )
-    return match.group("patient")
+IMAGE_COLUMNS = ["file", "dataset", "cohort", "treatment", "patient", "pT"]
 
 
-def build_patient_index(image_dir: Path) -> Dict[str, List[Path]]:
+def scan_cohort_images(cohort: Cohort) -> pd.DataFrame:
+    """List one cohort's images from disk and parse them with the manifest grammar."""
+    image_dir = cohort.root / "images"
+    if not image_dir.exists():
+        print(f"[WARN] Skipping missing cohort directory: {image_dir}")
+        return pd.DataFrame(columns=IMAGE_COLUMNS)
+    stages = load_t_stages(cohort.clinical_json)
+    rows = []
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            if not entry.name.endswith(".jpg") or entry.name.startswith("._"):
+                continue
+            fields = parse_name(entry.name[:-4], cohort.cohort)
+            rows.append({
+                "file": entry.name,
+                "dataset": cohort.dataset,
+                "cohort": cohort.cohort,
+                "treatment": fields["treatment"],
+                "patient": fields["patient"],
+                "pT": stages.get(str(fields["patient"])),
+            })
+    return pd.DataFrame(rows, columns=IMAGE_COLUMNS)
+
+
+def build_image_table(cohorts: Sequence[Cohort], manifest: Optional[Path] = None) -> pd.DataFrame:
     """
-    Walk through the directory once, bucket every image path under its patient ID,
-    and return a dictionary that maps patient -> list[Path].
+    One row per image with columns file, dataset, cohort, treatment, patient, group,
+    pT and path. ``group`` is the globally unique patient key used for splitting;
+    ``path`` is the image's full path, since file names repeat across datasets.
     """
-    if not image_dir.exists():
-        raise FileNotFoundError(f"Image directory '{image_dir}' does not exist.")
+    frames = []
+    pending = list(cohorts)
+    if manifest is not None and manifest.exists():
+        current = current_datasets(manifest, "images", {c.dataset: c.root for c in cohorts})
+        rows = load_files(manifest, folder="images", datasets=current) if current else []
+        if rows:
+            table = pd.DataFrame(rows).rename(columns={"name": "file"})
+            frames.append(table[IMAGE_COLUMNS])
+            found = set(table["dataset"])
+            pending = [c for c in cohorts if c.dataset not in found]
+        stale = [c.dataset for c in pending if (c.root / "images").exists()]
+        if stale:
+            print(f"[WARN] Manifest missing or out of date for {', '.join(stale)}; listing images from disk")
+    for cohort in pending:
+        frames.append(scan_cohort_images(cohort))
+
+    table = pd.concat(frames, ignore_index=True)
+    if table.empty:
+        raise RuntimeError("No JPG files found in any cohort directory.")
+    unparsed = table[table["patient"].isna()]
+    if not unparsed.empty:
+        raise ValueError(
+            f"Filename '{unparsed['file'].iloc[0]}' does not follow the expected pattern "
+            "'<group>_<course>_<patient> (image)'."
+        )
+    # Filenames without a Surgery/Chemo/NAC group are treated as surgery
+    table["treatment"] = table["treatment"].fillna("surgery")
+    table["pT"] = table["pT"].fillna("TX")
+    table["group"] = table["cohort"] + ":" + table["treatment"] + ":" + table["patient"].astype(str)
+    table["path"] = table["dataset"].map(image_dirs(cohorts)) + "/" + table["file"]
+    return table
 
-    patient_to_files: Dict[str, List[Path]] = defaultdict(list)
-    for path in sorted(image_dir.glob("*.jpg")):
-        patient_id = extract_patient_id(path.stem)
-        patient_to_files[patient_id].append(path)
 
-    if not patient_to_files:
-        raise RuntimeError(f"No JPG files found inside '{image_dir}'.")
-    return patient_to_files
+def image_dirs(cohorts: Sequence[Cohort]) -> Dict[str, str]:
+    """Dataset name -> its images directory."""
+    return {cohort.dataset: str(cohort.root / "images") for cohort in cohorts}
 
 
 def normalize_ratios(ratios: Sequence[float]) -> Tuple[float, float, float]:
@@ -120,97 +206,162 @@ def compute_split_counts(
     return counts[0], counts[1], counts[2]
 
 
-def assign_patients(
-    patient_ids: List[str], counts: Tuple[int, int, int], seed: int
-) -> Dict[str, List[str]]:
-    """Shuffle IDs deterministically and slice them into train/val/test buckets."""
-    random.seed(seed)
-    shuffled = patient_ids[:]
-    random.shuffle(shuffled)
+def build_patient_table(images: pd.DataFrame) -> pd.DataFrame:
+    """One row per patient group with its stratum (pT x cohort x treatment) and image count."""
+    patients = (
+        images.groupby("group", sort=True)
+        .agg(cohort=("cohort", "first"), treatment=("treatment", "first"),
+             pT=("pT", "first"), num_images=("file", "size"))
+        .reset_index()
+    )
+    patients["stratum"] = patients["pT"] + "|" + patients["cohort"] + "|" + patients["treatment"]
+    return patients
 
-    train_count, val_count, test_count = counts
-    splits = {
-        "train": shuffled[:train_count],
-        "val": shuffled[train_count : train_count + val_count],
-        "test": shuffled[train_count + val_count : train_count + val_count + test_count],
-    }
-    return splits
-
-
-def summarize_split(
-    name: str, patients: List[str], patient_to_files: Dict[str, List[Path]]
-) -> Dict[str, object]:
-    """Build a lightweight summary for JSON export."""
-    files = [str(path.name) for pid in patients for path in patient_to_files[pid]]
-    return {
-        "num_patients": len(patients),
-        "num_images": len(files),
-        "patients": sorted(patients),
-        "files": sorted(files),
-    }
+
+def stratified_order(patients: pd.DataFrame, seed: int) -> np.ndarray:
+    """
+    Row order that keeps each stratum contiguous and shuffles patients inside it.
+    Dealing labels along this order spreads every stratum evenly over the labels.
+    """
+    rng = np.random.default_rng(seed)
+    strata = patients["stratum"].astype("category").cat.codes.to_numpy()
+    return np.lexsort((rng.random(len(patients)), strata))
+
+
+def interleaved_labels(counts: Sequence[int]) -> np.ndarray:
+    """Label sequence with the given counts, spread as evenly as possible (e.g. 0,0,2,0,1,...)."""
+    positions = np.concatenate([(np.arange(c) + 0.5) / c for c in counts if c > 0])
+    labels = np.concatenate([np.full(c, i) for i, c in enumerate(counts) if c > 0])
+    return labels[np.argsort(positions, kind="stable")]
+
+
+def assign_splits(patients: pd.DataFrame, counts: Tuple[int, int, int], seed: int) -> pd.Series:
+    """Stratified group split: exact global counts, near-proportional share of every stratum."""
+    order = stratified_order(patients, seed)
+    split = np.empty(len(patients), dtype=object)
+    split[order] = np.asarray(SPLIT_NAMES, dtype=object)[interleaved_labels(counts)]
+    return pd.Series(split, index=patients.index)
+
+
+def assign_folds(patients: pd.DataFrame, folds: int, seed: int) -> pd.Series:
+    """Stratified group K-fold: dealing round-robin keeps strata and fold sizes balanced (+-1)."""
+    order = stratified_order(patients, seed + 1)
+    fold = np.empty(len(patients), dtype=np.int64)
+    fold[order] = np.arange(len(patients)) % folds
+    return pd.Series(fold, index=patients.index)
+
+
+def stage_distribution(patients: pd.DataFrame, mask: pd.Series) -> Dict[str, int]:
+    return {k: int(v) for k, v in patients.loc[mask, "pT"].value_counts().sort_index().items()}
+
+
+def write_lines(path: Path, lines: Sequence[str]) -> None:
+    path.write_text("\n".join(sorted(lines)) + "\n")
+
+
+def image_entries(images: pd.DataFrame) -> list:
+    """JSON entries for image rows, sorted by path: dataset, file name and full path."""
+    return images.sort_values("path")[["dataset", "file", "path"]].to_dict("records")
 
 
 def write_outputs(
     output_dir: Path,
-    splits: Dict[str, List[str]],
-    patient_to_files: Dict[str, List[Path]],
-    image_dir: Path,
+    images: pd.DataFrame,
+    patients: pd.DataFrame,
+    cohorts: Sequence[Cohort],
     ratios: Sequence[float],
     seed: int,
+    folds: int,
 ) -> None:
-    """Persist both JSON (rich metadata) and TXT (simple manifests)."""
+    """
+    Persist JSON (rich metadata) and TXT manifests for the split and all folds in one pass.
+    JSON lists every image with its dataset and full path; TXT manifests hold one full path per line.
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
+    split_of = dict(zip(patients["group"], patients["split"]))
+    images = images.assign(split=images["group"].map(split_of))
+    dirs = image_dirs(cohorts)
 
     payload = {
         "metadata": {
-            "image_dir": str(image_dir),
-            "total_patients": len(patient_to_files),
-            "total_images": sum(len(files) for files in patient_to_files.values()),
+            "image_dirs": {dataset: dirs[dataset] for dataset in sorted(images["dataset"].unique())},
+            "total_patients": len(patients),
+            "total_images": len(images),
             "ratios": list(normalize_ratios(ratios)),
             "seed": seed,
+            "stratify_by": ["pT", "cohort", "treatment"],
         },
-        "splits": {
-            split_name: summarize_split(split_name, patients, patient_to_files)
-            for split_name, patients in splits.items()
-        },
+        "splits": {},
     }
-
-    json_path = output_dir / "patient_split.json"
-    json_path.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
-
-    for split_name, patients in splits.items():
-        (output_dir / f"{split_name}_patients.txt").write_text(
-            "\n".join(sorted(patients)) + "\n"
-        )
-        image_list = [
-            str(patient_to_files[pid][idx].name)
-            for pid in patients
-            for idx in range(len(patient_to_files[pid]))
-        ]
-        (output_dir / f"{split_name}_images.txt").write_text(
-            "\n".join(sorted(image_list)) + "\n"
-        )
+    for split_name in SPLIT_NAMES:
+        mask = patients["split"] == split_name
+        groups = patients.loc[mask, "group"].tolist()
+        split_images = images[images["split"] == split_name]
+        payload["splits"][split_name] = {
+            "num_patients": len(groups),
+            "num_images": len(split_images),
+            "pT_distribution": stage_distribution(patients, mask),
+            "patients": sorted(groups),
+            "files": image_entries(split_images),
+        }
+        write_lines(output_dir / f"{split_name}_patients.txt", groups)
+        write_lines(output_dir / f"{split_name}_images.txt", split_images["path"].tolist())
+
+    (output_dir / "patient_split.json").write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+
+    if folds <= 0:
+        return
+    pool = patients["split"] != "test"
+    fold_of = dict(zip(patients.loc[pool, "group"], patients.loc[pool, "fold"]))
+    pool_images = images[images["group"].isin(fold_of.keys())]
+    image_fold = pool_images["group"].map(fold_of)
+
+    cv_payload = {"metadata": {**payload["metadata"], "folds": folds, "held_out": "test"}, "folds": []}
+    for k in range(folds):
+        val_mask = pool & (patients["fold"] == k)
+        train_mask = pool & (patients["fold"] != k)
+        val_files = pool_images.loc[image_fold == k, "path"].tolist()
+        train_files = pool_images.loc[image_fold != k, "path"].tolist()
+        cv_payload["folds"].append({
+            "fold": k,
+            "train_patients": sorted(patients.loc[train_mask, "group"].tolist()),
+            "val_patients": sorted(patients.loc[val_mask, "group"].tolist()),
+            "num_train_images": len(train_files),
+            "num_val_images": len(val_files),
+            "val_pT_distribution": stage_distribution(patients, val_mask),
+        })
+        write_lines(output_dir / f"fold{k}_train_images.txt", train_files)
+        write_lines(output_dir / f"fold{k}_val_images.txt", val_files)
+    (output_dir / "cv_folds.json").write_text(json.dumps(cv_payload, indent=2, ensure_ascii=False))
 
 
 def main() -> None:
     """Glue all helper functions together for a clean CLI entry-point."""
     args = parse_args()
-    patient_map = build_patient_index(args.image_dir)
-
-    train_count, val_count, test_count = compute_split_counts(
-        len(patient_map), args.ratios
-    )
-    splits = assign_patients(
-        sorted(patient_map.keys()), (train_count, val_count, test_count), args.seed
-    )
-    write_outputs(args.output_dir, splits, patient_map, args.image_dir, args.ratios, args.seed)
+    if args.image_dir:
+        cohorts = [Cohort(args.image_dir.parent.name, args.image_dir.parent, "2025", args.clinical_json)]
+        if not args.image_dir.exists():
+            raise FileNotFoundError(f"Image directory '{args.image_dir}' does not exist.")
+    else:
+        cohorts = DEFAULT_COHORTS
+    images = build_image_table(cohorts, None if args.image_dir else args.manifest)
+    patients = build_patient_table(images)
+
+    counts = compute_split_counts(len(patients), args.ratios)
+    patients["split"] = assign_splits(patients, counts, args.seed)
+    if args.folds > 0:
+        pool = patients["split"] != "test"
+        if pool.sum() < args.folds:
+            raise ValueError(f"{int(pool.sum())} train+val patients cannot form {args.folds} folds.")
+        patients["fold"] = -1
+        patients.loc[pool, "fold"] = assign_folds(patients[pool], args.folds, args.seed)
+    write_outputs(args.output_dir, images, patients, cohorts, args.ratios, args.seed, args.folds)
 
+    train_count, val_count, test_count = counts
     print(f"Finished! Train/val/test patient counts: {train_count}/{val_count}/{test_count}.")
+    print(f"Strata (pT x cohort x treatment): {patients['stratum'].nunique()}, CV folds: {max(args.folds, 0)}")
     print(f"Manifests saved to: {args.output_dir}")
 
 
 if __name__ == "__main__":
     main()
-
-
-
@@ -4,16 +4,21 @@
 2. 生成LabelMe JSON标注（如果有标注数据）
 3. 生成overlay图像
 4. 保存到Gastric_Cancer_Dataset_2019目录
+
+NII按切片惰性读取：只从 dataobj 取需要的切片，不再 get_fdata() 加载整个体；
+可一次导出多个切片或掩膜面积最大的切片，并用进程池并行处理
 """
 
 import os
-import json
+import argparse
 import numpy as np
 import nibabel as nib
 import cv2
-from PIL import Image
 import glob
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+from ingest_utils import normalize_to_uint8, nii_slice_count, read_nii_slice, largest_area_slice
 
 PROJECT_ROOT = "/Users/huangyijun/Projects/胃癌T分期"
 SOURCE_ROOT = os.path.join(PROJECT_ROOT, "2019年直接手术")
@@ -23,40 +28,52 @@ OUTPUT_ROOT = os.path.join(PROJECT_ROOT, "Gastric_Cancer_Dataset_2019")
 for subdir in ['images', 'overlays', 'annotations', 'lymph_node_analysis']:
     os.makedirs(os.path.join(OUTPUT_ROOT, subdir), exist_ok=True)
 
-def process_nii_to_jpg(nii_path, output_path):
-    """将NII文件转换为JPG"""
+def select_slices(nii, mode):
+    """
+    根据模式选择要导出的切片序号
+    mode: "mid"（中间切片，默认）、"largest"（掩膜面积最大的切片）、"all" 或逗号分隔的序号
+    """
+    count = nii_slice_count(nii)
+    if mode == "mid":
+        return [count // 2]
+    if mode == "largest":
+        return [largest_area_slice(nii)]
+    if mode == "all":
+        return list(range(count))
+    indices = [int(i) for i in mode.split(',') if i.strip()]
+    return [i for i in indices if 0 <= i < count]
+
+def slice_to_bgr(img_2d):
+    """归一化到0-255（float32或整数运算），直接生成三通道BGR用于写JPG"""
+    if img_2d.dtype.kind == 'f':
+        img_2d = np.nan_to_num(img_2d.astype(np.float32))
+    img_norm = normalize_to_uint8(img_2d)
+    return cv2.cvtColor(img_norm, cv2.COLOR_GRAY2BGR)
+
+def process_nii_to_jpg(nii_path, output_path, slices="mid"):
+    """
+    将NII文件转换为JPG
+    只导出一个切片时写入 output_path；导出多个切片时文件名加 _s{切片序号}
+    返回写入的文件数
+    """
     try:
         nii_img = nib.load(nii_path)
-        data = nii_img.get_fdata()
-        
-        # 获取中间切片（通常是最大尺寸的切片）
-        if len(data.shape) == 3:
-            mid_slice = data.shape[2] // 2
-            img_2d = data[:, :, mid_slice]
-        elif len(data.shape) == 2:
-            img_2d = data
-        else:
-            print(f"Unsupported shape: {data.shape} for {nii_path}")
-            return False
-        
-        # 归一化到0-255
-        img_2d = np.nan_to_num(img_2d)
-        img_min = np.min(img_2d)
-        img_max = np.max(img_2d)
-        if img_max > img_min:
-            img_2d = ((img_2d - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-        else:
-            img_2d = np.zeros_like(img_2d, dtype=np.uint8)
-        
-        # 转换为RGB
-        img_rgb = cv2.cvtColor(img_2d, cv2.COLOR_GRAY2RGB)
-        
-        # 保存为JPG
-        cv2.imwrite(output_path, cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR))
-        return True
+        if len(nii_img.shape) not in (2, 3):
+            print(f"Unsupported shape: {nii_img.shape} for {nii_path}")
+            return 0
+
+        indices = select_slices(nii_img, slices)
+        base, ext = os.path.splitext(output_path)
+        written = 0
+        for index in indices:
+            img_bgr = slice_to_bgr(read_nii_slice(nii_img, index))
+            target = output_path if len(indices) == 1 else f"{base}_s{index:03d}{ext}"
+            if cv2.imwrite(target, img_bgr):
+                written += 1
+        return written
     except Exception as e:
         print(f"Error processing {nii_path}: {e}")
-        return False
+        return 0
 
 def extract_patient_id_from_filename(filename):
     """从文件名提取病人ID
@@ -65,63 +82,65 @@ def extract_patient_id_from_filename(filename):
     """
     # 移除扩展名
     name = filename.replace('.nii', '').replace('.jpg', '')
-    
+
     # 提取第一个数字作为主要ID
     match = re.match(r'^(\d+)', name)
     if match:
         return match.group(1)
-    
+
     # 如果没有匹配，返回整个名称（去除括号内容）
     return re.sub(r'\([^)]*\)', '', name).strip()
 
-def process_2019_data():
+def _convert_job(job):
+    nii_path, output_path, slices = job
+    return process_nii_to_jpg(nii_path, output_path, slices)
+
+def process_2019_data(slices="mid", workers=None):
     """处理2019年的NII数据"""
-    nii1_dir = os.path.join(SOURCE_ROOT, "NII1")
-    nii2_dir = os.path.join(SOURCE_ROOT, "NII2")
-    
-    processed_count = 0
-    
-    # 处理NII1
-    if os.path.exists(nii1_dir):
-        nii_files = glob.glob(os.path.join(nii1_dir, "*.nii"))
-        print(f"Found {len(nii_files)} files in NII1")
-        
-        for nii_path in nii_files:
-            filename = os.path.basename(nii_path)
-            patient_id = extract_patient_id_from_filename(filename)
-            
-            # 生成输出文件名：Surgery_2019_{patient_id}_{original_name}.jpg
-            base_name = filename.replace('.nii', '')
-            output_filename = f"Surgery_2019_{base_name}.jpg"
-            output_path = os.path.join(OUTPUT_ROOT, 'images', output_filename)
-            
-            if process_nii_to_jpg(nii_path, output_path):
-                processed_count += 1
-                if processed_count % 50 == 0:
-                    print(f"Processed {processed_count} files...")
-    
-    # 处理NII2
-    if os.path.exists(nii2_dir):
-        nii_files = glob.glob(os.path.join(nii2_dir, "*.nii"))
-        print(f"Found {len(nii_files)} files in NII2")
-        
+    jobs = []
+    for nii_dir in [os.path.join(SOURCE_ROOT, "NII1"), os.path.join(SOURCE_ROOT, "NII2")]:
+        if not os.path.exists(nii_dir):
+            continue
+        nii_files = glob.glob(os.path.join(nii_dir, "*.nii"))
+        print(f"Found {len(nii_files)} files in {os.path.basename(nii_dir)}")
+
         for nii_path in nii_files:
             filename = os.path.basename(nii_path)
-            patient_id = extract_patient_id_from_filename(filename)
-            
-            # 生成输出文件名
+
+            # 生成输出文件名：Surgery_2019_{original_name}.jpg
             base_name = filename.replace('.nii', '')
             output_filename = f"Surgery_2019_{base_name}.jpg"
             output_path = os.path.join(OUTPUT_ROOT, 'images', output_filename)
-            
-            if process_nii_to_jpg(nii_path, output_path):
+            jobs.append((nii_path, output_path, slices))
+
+    processed_count = 0
+    written_count = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for written in pool.map(_convert_job, jobs, chunksize=8):
+            if written:
                 processed_count += 1
+                written_count += written
                 if processed_count % 50 == 0:
                     print(f"Processed {processed_count} files...")
-    
-    print(f"\nTotal processed: {processed_count} files")
+
+    print(f"\nTotal processed: {processed_count} files ({written_count} slices written)")
     print(f"Output directory: {OUTPUT_ROOT}")
 
-if __name__ == "__main__":
-    process_2019_data()
+def main():
+    parser = argparse.ArgumentParser(description="Convert 2019 NII volumes to JPG slices.")
+    parser.add_argument(
+        "--slices",
+        default="mid",
+        help="mid (default), largest (slice with the largest mask area), all, or comma-separated indices",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: CPU count)",
+    )
+    args = parser.parse_args()
+    process_2019_data(slices=args.slices, workers=args.workers)
 
+if __name__ == "__main__":
+    main()
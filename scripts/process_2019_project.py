@@ -9,16 +9,16 @@
 import os
 import json
 import base64
-import numpy as np
-import pydicom
-import nibabel as nib
-import cv2
-from PIL import Image
-import io
 import shutil
 import glob
 import re
 
+from ingest_utils import (
+    prescan_pairs, write_manifest, load_dicom_rgb, load_mask,
+    find_mask_contours, contours_to_shapes, encode_jpeg, encode_overlay,
+    write_bytes, link_or_copy,
+)
+
 # Configuration
 PROJECT_ROOT = "/Users/huangyijun/Projects/胃癌T分期"
 SOURCE_ROOT = os.path.join(PROJECT_ROOT, "2019年直接手术")
@@ -28,13 +28,6 @@ def ensure_dir(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
-def numpy_to_base64(img_arr):
-    img = Image.fromarray(img_arr)
-    buffer = io.BytesIO()
-    img.save(buffer, format="JPEG")
-    img_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    return img_str
-
 def create_labelme_json(image_path, image_data, height, width, shapes):
     return {
         "version": "4.5.6",
@@ -46,34 +39,6 @@ def create_labelme_json(image_path, image_data, height, width, shapes):
         "imageWidth": width
     }
 
-def get_contours_from_mask(mask):
-    shapes = []
-    mask = mask.astype(np.uint8)
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    for contour in contours:
-        if cv2.contourArea(contour) < 10:
-            continue
-        epsilon = 0.001 * cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, epsilon, True)
-        points = approx.squeeze().tolist()
-        
-        if len(points) < 3:
-            continue
-        if not isinstance(points[0], list):
-             if isinstance(points[0], (int, float)):
-                 continue
-
-        shape = {
-            "label": "lesion",
-            "points": points,
-            "group_id": None,
-            "shape_type": "polygon",
-            "flags": {}
-        }
-        shapes.append(shape)
-    return shapes
-
 def match_dicom_to_nii_with_queue(dcm_filename, nii_files, queue):
     """
     匹配DICOM文件名到NII文件名（指定队列）
@@ -145,34 +110,12 @@ def extract_patient_id_from_nii(nii_filename):
 
 def process_single_file(dcm_path, nii_path, out_dirs, prefix):
     try:
-        # 1. Read DICOM
-        ds = pydicom.dcmread(dcm_path)
-        pixel_array = ds.pixel_array
-        
-        if len(pixel_array.shape) == 2:
-            img_min = pixel_array.min()
-            img_max = pixel_array.max()
-            if img_max > img_min:
-                img_norm = ((pixel_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-            else:
-                img_norm = np.zeros_like(pixel_array, dtype=np.uint8)
-            img_rgb = cv2.cvtColor(img_norm, cv2.COLOR_GRAY2RGB)
-        else:
-            img_rgb = pixel_array.astype(np.uint8)
-        
+        # 1. Read DICOM (文件头已在预扫描阶段检查，这里才解码像素)
+        img_rgb = load_dicom_rgb(dcm_path)
         height, width = img_rgb.shape[:2]
         
         # 2. Read NIfTI
-        nii = nib.load(nii_path)
-        nii_data = nii.get_fdata()
-        mask_2d = np.squeeze(nii_data)
-        
-        # Transpose fix
-        if mask_2d.shape != (height, width):
-            if mask_2d.T.shape == (height, width):
-                mask_2d = mask_2d.T
-            else:
-                return False, f"Shape mismatch: DICOM {img_rgb.shape} vs NIfTI {mask_2d.shape}"
+        mask_2d = load_mask(nii_path, height, width)
 
         # 从NII文件名提取病人ID和队列号
         nii_filename = os.path.basename(nii_path)
@@ -207,12 +150,17 @@ def process_single_file(dcm_path, nii_path, out_dirs, prefix):
         overlay_path = os.path.join(out_dirs['overlays'], overlay_filename)
         overlay_transparent_path = os.path.join(out_dirs['overlaysTransparent'], overlay_filename)
         
-        # 3. Save Image (JPG)
-        Image.fromarray(img_rgb).save(jpg_path)
+        # 3. 轮廓只提取一次，LabelMe标注和overlay共用
+        contours = find_mask_contours(mask_2d)
+        shapes = contours_to_shapes(contours)
         
-        # 4. Create LabelMe JSON
-        shapes = get_contours_from_mask(mask_2d)
-        img_data_b64 = numpy_to_base64(img_rgb)
+        # 4. Save Image (JPG)
+        # 同一份JPEG字节既写入images/，也作为LabelMe的imageData
+        jpg_bytes = encode_jpeg(img_rgb)
+        write_bytes(jpg_path, jpg_bytes)
+        
+        # 5. Create LabelMe JSON
+        img_data_b64 = base64.b64encode(jpg_bytes).decode("utf-8")
         
         # Relative path for LabelMe
         relative_image_path = f"../images/{jpg_filename}"
@@ -221,18 +169,10 @@ def process_single_file(dcm_path, nii_path, out_dirs, prefix):
         with open(json_path, 'w') as f:
             json.dump(json_content, f, indent=2)
             
-        # 5. Create Overlay (中间透明，只保留边缘)
-        img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-        overlay_bgr = img_bgr.copy()
-        
-        # 只绘制边缘轮廓，中间保持透明（不填充）
-        mask_uint8 = mask_2d.astype(np.uint8)
-        contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        # 绘制绿色边缘，线宽2像素
-        cv2.drawContours(overlay_bgr, contours, -1, (0, 255, 0), 2)
-        
-        cv2.imwrite(overlay_path, overlay_bgr)
-        cv2.imwrite(overlay_transparent_path, overlay_bgr)
+        # 6. Create Overlay (中间透明，只保留边缘)，只编码一次
+        write_bytes(overlay_path, encode_overlay(img_rgb, contours))
+        # lymph_node_analysis/ 中的overlay与 overlays/ 完全相同，用硬链接代替再写一次
+        link_or_copy(overlay_path, overlay_transparent_path)
         
         return True, "Success"
         
@@ -257,6 +197,7 @@ def main():
     total_processed = 0
     total_errors = 0
     unmatched_dcm = []
+    pairs = []
     
     # 处理DICOM1和NII1 (队列1)
     dicom1_dir = os.path.join(SOURCE_ROOT, "DICOM图像", "DICOM1")
@@ -297,15 +238,7 @@ def main():
             # Prefix: Surgery_2019_Filename
             prefix = "Surgery_2019"
             
-            success, msg = process_single_file(dcm_path, nii_path, out_dirs, prefix)
-            
-            if success:
-                total_processed += 1
-                if total_processed % 50 == 0:
-                    print(f"Processed {total_processed} files...")
-            else:
-                print(f"Error {dcm_file}: {msg}")
-                total_errors += 1
+            pairs.append((dcm_path, nii_path, prefix))
     
     # 处理DICOM2和NII2 (队列2)
     dicom2_dir = os.path.join(SOURCE_ROOT, "DICOM图像", "DICOM2")
@@ -343,15 +276,28 @@ def main():
             
             prefix = "Surgery_2019"
             
-            success, msg = process_single_file(dcm_path, nii_path, out_dirs, prefix)
-            
-            if success:
-                total_processed += 1
-                if total_processed % 50 == 0:
-                    print(f"Processed {total_processed} files...")
-            else:
-                print(f"Error {dcm_file}: {msg}")
-                total_errors += 1
+            pairs.append((dcm_path, nii_path, prefix))
+    
+    # 预扫描：只读文件头，提前剔除尺寸不匹配的配对，只对有效配对解码像素
+    print(f"\nPre-scanning {len(pairs)} matched pairs (headers only)...")
+    valid_pairs, manifest = prescan_pairs(pairs)
+    write_manifest(os.path.join(OUTPUT_ROOT, "ingest_manifest.json"), manifest)
+    for entry in manifest:
+        if entry["status"] != "ok":
+            print(f"Error {entry['dicom']}: {entry['error']}")
+            total_errors += 1
+    
+    print(f"Decoding {len(valid_pairs)} valid pairs...")
+    for dcm_path, nii_path, prefix in valid_pairs:
+        success, msg = process_single_file(dcm_path, nii_path, out_dirs, prefix)
+        
+        if success:
+            total_processed += 1
+            if total_processed % 50 == 0:
+                print(f"Processed {total_processed} files...")
+        else:
+            print(f"Error {os.path.basename(dcm_path)}: {msg}")
+            total_errors += 1
     
     print(f"\nProcessing Complete.")
     print(f"Total processed: {total_processed}")
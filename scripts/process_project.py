@@ -2,14 +2,16 @@ import os
 import json
 import base64
 import numpy as np
-import pydicom
-import nibabel as nib
 import cv2
-from PIL import Image
-import io
 import shutil
 import glob
 
+from ingest_utils import (
+    prescan_pairs, write_manifest, load_dicom_rgb, load_mask,
+    find_mask_contours, contours_to_shapes, encode_jpeg, encode_overlay,
+    write_bytes,
+)
+
 # Configuration
 PROJECT_ROOT = "/Users/huangyijun/Projects/胃癌T分期"
 OUTPUT_ROOT = os.path.join(PROJECT_ROOT, "Gastric_Cancer_Dataset")
@@ -32,13 +34,6 @@ def ensure_dir(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
-def numpy_to_base64(img_arr):
-    img = Image.fromarray(img_arr)
-    buffer = io.BytesIO()
-    img.save(buffer, format="JPEG")
-    img_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    return img_str
-
 def create_labelme_json(image_path, image_data, height, width, shapes):
     return {
         "version": "4.5.6",
@@ -50,64 +45,14 @@ def create_labelme_json(image_path, image_data, height, width, shapes):
         "imageWidth": width
     }
 
-def get_contours_from_mask(mask):
-    shapes = []
-    mask = mask.astype(np.uint8)
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    for contour in contours:
-        if cv2.contourArea(contour) < 10:
-            continue
-        epsilon = 0.001 * cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, epsilon, True)
-        points = approx.squeeze().tolist()
-        
-        if len(points) < 3:
-            continue
-        if not isinstance(points[0], list):
-             if isinstance(points[0], (int, float)):
-                 continue
-
-        shape = {
-            "label": "lesion",
-            "points": points,
-            "group_id": None,
-            "shape_type": "polygon",
-            "flags": {}
-        }
-        shapes.append(shape)
-    return shapes
-
 def process_single_file(dcm_path, nii_path, out_dirs, prefix):
     try:
-        # 1. Read DICOM
-        ds = pydicom.dcmread(dcm_path)
-        pixel_array = ds.pixel_array
-        
-        if len(pixel_array.shape) == 2:
-            img_min = pixel_array.min()
-            img_max = pixel_array.max()
-            if img_max > img_min:
-                img_norm = ((pixel_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-            else:
-                img_norm = np.zeros_like(pixel_array, dtype=np.uint8)
-            img_rgb = cv2.cvtColor(img_norm, cv2.COLOR_GRAY2RGB)
-        else:
-            img_rgb = pixel_array.astype(np.uint8)
-        
+        # 1. Read DICOM (文件头已在预扫描阶段检查，这里才解码像素)
+        img_rgb = load_dicom_rgb(dcm_path)
         height, width = img_rgb.shape[:2]
         
         # 2. Read NIfTI
-        nii = nib.load(nii_path)
-        nii_data = nii.get_fdata()
-        mask_2d = np.squeeze(nii_data)
-        
-        # Transpose fix
-        if mask_2d.shape != (height, width):
-            if mask_2d.T.shape == (height, width):
-                mask_2d = mask_2d.T
-            else:
-                return False, f"Shape mismatch: DICOM {img_rgb.shape} vs NIfTI {mask_2d.shape}"
+        mask_2d = load_mask(nii_path, height, width)
 
         # Define filenames with prefix
         base_name = os.path.splitext(os.path.basename(dcm_path))[0]
@@ -124,13 +69,18 @@ def process_single_file(dcm_path, nii_path, out_dirs, prefix):
         json_path = os.path.join(out_dirs['annotations'], json_filename)
         overlay_path = os.path.join(out_dirs['overlays'], overlay_filename)
         
-        # 3. Save Image (JPG) & Copy DICOM
-        Image.fromarray(img_rgb).save(jpg_path)
+        # 3. 轮廓只提取一次，LabelMe标注和overlay共用
+        contours = find_mask_contours(mask_2d)
+        shapes = contours_to_shapes(contours)
+        
+        # 4. Save Image (JPG) & Copy DICOM
+        # 同一份JPEG字节既写入images/，也作为LabelMe的imageData
+        jpg_bytes = encode_jpeg(img_rgb)
+        write_bytes(jpg_path, jpg_bytes)
         shutil.copy2(dcm_path, dcm_out_path)
         
-        # 4. Create LabelMe JSON
-        shapes = get_contours_from_mask(mask_2d)
-        img_data_b64 = numpy_to_base64(img_rgb)
+        # 5. Create LabelMe JSON
+        img_data_b64 = base64.b64encode(jpg_bytes).decode("utf-8")
         
         # Relative path for LabelMe
         relative_image_path = f"../images/{jpg_filename}"
@@ -139,17 +89,8 @@ def process_single_file(dcm_path, nii_path, out_dirs, prefix):
         with open(json_path, 'w') as f:
             json.dump(json_content, f, indent=2)
             
-        # 5. Create Overlay (中间透明，只保留边缘)
-        img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-        overlay_bgr = img_bgr.copy()
-        
-        # 只绘制边缘轮廓，中间保持透明（不填充）
-        mask_uint8 = mask_2d.astype(np.uint8)
-        contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        # 绘制绿色边缘，线宽2像素
-        cv2.drawContours(overlay_bgr, contours, -1, (0, 255, 0), 2)
-        
-        cv2.imwrite(overlay_path, overlay_bgr)
+        # 6. Create Overlay (中间透明，只保留边缘)，只编码一次
+        write_bytes(overlay_path, encode_overlay(img_rgb, contours))
         
         return True, "Success"
         
@@ -174,6 +115,7 @@ def main():
     # 2. Process Data
     total_processed = 0
     total_errors = 0
+    pairs = []
     
     for source in DIRS_TO_PROCESS:
         base_path = source['path']
@@ -226,13 +168,25 @@ def main():
                 # e.g. Chemo_1MC_12345
                 prefix = f"{group}_{phase}"
                 
-                success, msg = process_single_file(dcm_path, nii_path, out_dirs, prefix)
-                
-                if success:
-                    total_processed += 1
-                else:
-                    print(f"Error {dcm_file}: {msg}")
-                    total_errors += 1
+                pairs.append((dcm_path, nii_path, prefix))
+    
+    # 预扫描：只读文件头，提前剔除尺寸不匹配的配对，只对有效配对解码像素
+    print(f"Pre-scanning {len(pairs)} matched pairs (headers only)...")
+    valid_pairs, manifest = prescan_pairs(pairs)
+    write_manifest(os.path.join(OUTPUT_ROOT, "ingest_manifest.json"), manifest)
+    for entry in manifest:
+        if entry["status"] != "ok":
+            print(f"Error {entry['dicom']}: {entry['error']}")
+            total_errors += 1
+    
+    for dcm_path, nii_path, prefix in valid_pairs:
+        success, msg = process_single_file(dcm_path, nii_path, out_dirs, prefix)
+        
+        if success:
+            total_processed += 1
+        else:
+            print(f"Error {os.path.basename(dcm_path)}: {msg}")
+            total_errors += 1
                     
     print(f"Processing Complete. Total: {total_processed}, Errors: {total_errors}")
     
@@ -2,14 +2,21 @@
 """
 从现有的JSON标注文件重新生成overlay图像（中间透明样式）
 并保存到 lymph_node_analysis 文件夹
+
+多边形直接用 cv2.polylines 画边缘，图像只解码一次，用进程池并行处理；
+--incremental 只重新生成标注比overlay新的文件
+标注文件列表优先取自共享数据集清单（dataset_manifest.py），清单没有该目录或目录已变化时直接列目录
 """
 
 import os
 import json
+import argparse
 import cv2
 import numpy as np
-from PIL import Image
-import glob
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from dataset_manifest import DEFAULT_MANIFEST, folder_names
 
 # Configuration
 PROJECT_ROOT = "/Users/huangyijun/Projects/胃癌T分期"
@@ -20,41 +27,91 @@ def ensure_dir(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
-def create_mask_from_shapes(shapes, height, width):
+def polygons_from_shapes(shapes, scale_x=1.0, scale_y=1.0):
     """
-    从LabelMe JSON的shapes创建mask
+    从LabelMe JSON的shapes取出多边形顶点（int32），按需缩放到图像尺寸
     """
-    mask = np.zeros((height, width), dtype=np.uint8)
-    
+    polygons = []
     for shape in shapes:
         if shape.get('shape_type') == 'polygon':
             points = shape.get('points', [])
             if len(points) >= 3:
-                # 转换为numpy数组
-                pts = np.array(points, dtype=np.int32)
-                # 填充多边形
-                cv2.fillPoly(mask, [pts], 255)
-    
-    return mask
+                pts = np.asarray(points, dtype=np.float64)
+                if scale_x != 1.0 or scale_y != 1.0:
+                    pts *= (scale_x, scale_y)
+                polygons.append(np.rint(pts).astype(np.int32))
+    return polygons
 
-def create_transparent_overlay(img_rgb, mask_2d):
+def create_transparent_overlay(img_bgr, polygons):
     """
-    创建中间透明的overlay，只保留边缘轮廓
+    创建中间透明的overlay，只画边缘轮廓（绿色，线宽2像素）
+    直接用JSON中的多边形顶点画折线，不再 fillPoly 成掩膜后再 findContours；
+    标注本身就是掩膜外轮廓（互不重叠），两种画法结果一致
+    在解码得到的数组上原地绘制，不再额外复制
     """
-    img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-    overlay_bgr = img_bgr.copy()
-    
-    # 只绘制边缘轮廓，中间保持透明（不填充）
-    mask_uint8 = mask_2d.astype(np.uint8)
-    contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    # 绘制绿色边缘，线宽2像素
-    cv2.drawContours(overlay_bgr, contours, -1, (0, 255, 0), 2)
-    
-    return overlay_bgr
+    cv2.polylines(img_bgr, polygons, True, (0, 255, 0), 2)
+    return img_bgr
 
-def process_dataset(dataset_path, dataset_name):
+def is_up_to_date(overlay_path, json_path, img_path):
+    """增量模式：overlay 比标注和图像都新时无需重新生成"""
+    if not os.path.exists(overlay_path):
+        return False
+    overlay_mtime = os.path.getmtime(overlay_path)
+    return overlay_mtime >= os.path.getmtime(json_path) and overlay_mtime >= os.path.getmtime(img_path)
+
+def regenerate_one(job):
+    """
+    处理单个标注文件，返回 (状态, 信息)，状态为 processed / unchanged / skipped / error
+    """
+    json_path, images_dir, output_overlay_dir, incremental = job
+    try:
+        # 获取基础文件名
+        base_name = os.path.splitext(os.path.basename(json_path))[0]
+
+        # 查找对应的图像文件（可能是.jpg）
+        img_path = os.path.join(images_dir, base_name + ".jpg")
+        if not os.path.exists(img_path):
+            return "skipped", None
+
+        overlay_path = os.path.join(output_overlay_dir, base_name + "_overlay.jpg")
+        if incremental and is_up_to_date(overlay_path, json_path, img_path):
+            return "unchanged", None
+
+        # 读取JSON标注
+        with open(json_path, 'r', encoding='utf-8') as f:
+            annotation = json.load(f)
+        shapes = annotation.get('shapes', [])
+        if not any(s.get('shape_type') == 'polygon' and len(s.get('points', [])) >= 3 for s in shapes):
+            # 没有有效的多边形，跳过（不必解码图像）
+            return "skipped", None
+
+        # 图像只解码一次，尺寸直接取自解码结果
+        img_bgr = cv2.imread(img_path)
+        if img_bgr is None:
+            return "error", f"无法读取图像 {img_path}"
+        img_h, img_w = img_bgr.shape[:2]
+
+        # 标注尺寸与图像不一致时把顶点缩放到图像尺寸
+        height = annotation.get('imageHeight') or img_h
+        width = annotation.get('imageWidth') or img_w
+        polygons = polygons_from_shapes(shapes, img_w / width, img_h / height)
+
+        # 创建透明overlay
+        overlay_bgr = create_transparent_overlay(img_bgr, polygons)
+
+        # process_*_project.py 会把这里的文件硬链接到 overlays/，先删除再写，
+        # 避免同时改写 overlays/ 中的原图
+        if os.path.lexists(overlay_path):
+            os.remove(overlay_path)
+        cv2.imwrite(overlay_path, overlay_bgr)
+        return "processed", None
+    except Exception as e:
+        return "error", f"处理 {json_path} 时出错: {e}"
+
+def process_dataset(dataset_path, dataset_name, workers=None, incremental=False, manifest=DEFAULT_MANIFEST):
     """
     处理单个数据集，从JSON标注重新生成overlay到新文件夹
+    incremental=True 时只重新生成标注（或图像）比overlay新的文件
     """
     print(f"\n{'='*60}")
     print(f"处理数据集: {dataset_name}")
@@ -76,7 +133,10 @@ def process_dataset(dataset_path, dataset_name):
     ensure_dir(output_overlay_dir)
     
     # 获取所有JSON标注文件
-    json_files = glob.glob(os.path.join(annotations_dir, "*.json"))
+    json_files = [
+        os.path.join(annotations_dir, name)
+        for name in folder_names(Path(dataset_path), "annotations", manifest, ".json")
+    ]
     total_files = len(json_files)
     print(f"找到 {total_files} 个标注文件")
     
@@ -84,78 +144,34 @@ def process_dataset(dataset_path, dataset_name):
         print("没有找到标注文件，跳过此数据集")
         return 0
     
-    processed_count = 0
-    skipped_count = 0
-    error_count = 0
-    
-    for json_path in json_files:
-        try:
-            # 获取基础文件名
-            base_name = os.path.splitext(os.path.basename(json_path))[0]
-            
-            # 查找对应的图像文件（可能是.jpg）
-            img_path = os.path.join(images_dir, base_name + ".jpg")
-            
-            if not os.path.exists(img_path):
-                skipped_count += 1
-                continue
-            
-            # 读取JSON标注
-            with open(json_path, 'r', encoding='utf-8') as f:
-                annotation = json.load(f)
-            
-            # 获取图像尺寸
-            height = annotation.get('imageHeight', 0)
-            width = annotation.get('imageWidth', 0)
-            shapes = annotation.get('shapes', [])
-            
-            if height == 0 or width == 0:
-                # 从图像文件读取尺寸
-                img = Image.open(img_path)
-                width, height = img.size
-            
-            # 从shapes创建mask
-            mask = create_mask_from_shapes(shapes, height, width)
-            
-            if mask.sum() == 0:
-                # 如果没有有效的mask，跳过
-                skipped_count += 1
-                continue
-            
-            # 读取图像
-            img_rgb = np.array(Image.open(img_path))
-            
-            # 确保图像尺寸匹配
-            if img_rgb.shape[:2] != (height, width):
-                # 调整mask尺寸
-                mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
-            
-            # 创建透明overlay
-            overlay_bgr = create_transparent_overlay(img_rgb, mask)
-            
-            # 保存overlay到新文件夹
-            overlay_filename = base_name + "_overlay.jpg"
-            overlay_path = os.path.join(output_overlay_dir, overlay_filename)
-            cv2.imwrite(overlay_path, overlay_bgr)
-            
-            processed_count += 1
-            if processed_count % 100 == 0:
-                print(f"  已处理: {processed_count}/{total_files}")
-                
-        except Exception as e:
-            print(f"  错误: 处理 {json_path} 时出错: {e}")
-            error_count += 1
-    
-    print(f"\n完成: 成功处理 {processed_count} 个文件")
-    print(f"      跳过 {skipped_count} 个文件")
-    print(f"      错误 {error_count} 个文件")
-    
-    return processed_count
+    counts = {"processed": 0, "unchanged": 0, "skipped": 0, "error": 0}
+    jobs = [(json_path, images_dir, output_overlay_dir, incremental) for json_path in json_files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for status, message in pool.map(regenerate_one, jobs, chunksize=16):
+            counts[status] += 1
+            if message:
+                print(f"  错误: {message}")
+            if status == "processed" and counts["processed"] % 100 == 0:
+                print(f"  已处理: {counts['processed']}/{total_files}")
+    
+    print(f"\n完成: 成功处理 {counts['processed']} 个文件")
+    if incremental:
+        print(f"      未变化 {counts['unchanged']} 个文件")
+    print(f"      跳过 {counts['skipped']} 个文件")
+    print(f"      错误 {counts['error']} 个文件")
+    
+    return counts["processed"]
 
 def main():
     """
     主函数：重新生成overlay到新文件夹
     """
+    parser = argparse.ArgumentParser(description="从JSON标注重新生成 lymph_node_analysis 中的overlay")
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认CPU核数）")
+    parser.add_argument("--incremental", action="store_true", help="只重新生成标注比overlay新的文件")
+    parser.add_argument("--manifest", type=Path, default=DEFAULT_MANIFEST, help="共享数据集清单（dataset_manifest.py）")
+    args = parser.parse_args()
+
     print("=" * 60)
     print("重新生成Overlay图像（中间透明样式）")
     print("从JSON标注文件生成，保存到 lymph_node_analysis 文件夹")
@@ -165,14 +181,16 @@ def main():
     
     # 处理原始数据集
     if os.path.exists(DATASET_ORIGINAL):
-        count = process_dataset(DATASET_ORIGINAL, "Gastric_Cancer_Dataset (Original)")
+        count = process_dataset(DATASET_ORIGINAL, "Gastric_Cancer_Dataset (Original)", args.workers, args.incremental,
+                                args.manifest)
         total_processed += count
     else:
         print(f"\n警告: 原始数据集不存在: {DATASET_ORIGINAL}")
     
     # 处理裁剪数据集
     if os.path.exists(DATASET_CROPPED):
-        count = process_dataset(DATASET_CROPPED, "Gastric_Cancer_Dataset_Cropped")
+        count = process_dataset(DATASET_CROPPED, "Gastric_Cancer_Dataset_Cropped", args.workers, args.incremental,
+                                args.manifest)
         total_processed += count
     else:
         print(f"\n警告: 裁剪数据集不存在: {DATASET_CROPPED}")
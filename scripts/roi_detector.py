@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Detect the ultrasound scan region of a frame instead of relying on one fixed
+crop rectangle.
+
+The frame is downsampled, thresholded against the dark background and opened
+so thin UI text and rulers drop out; the largest connected component is the
+scan sector. Row/column projections of that component then trim UI bars that
+touch the sector. Everything runs on whole arrays, so one detection costs a
+few milliseconds; crop_engine caches the result per layout signature.
+"""
+
+import argparse
+
+import cv2
+import numpy as np
+
+DOWNSCALE = 4
+DARK_THRESHOLD = 12
+MIN_AREA_FRACTION = 0.15
+EDGE_COVERAGE = 0.05
+
+
+def detect_roi(img, downscale=DOWNSCALE, dark_threshold=DARK_THRESHOLD,
+               min_area_fraction=MIN_AREA_FRACTION):
+    """
+    Return the scan region (x1, y1, x2, y2) in full-resolution pixels, or None
+    when no plausible region is found (blank frame, region too small).
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    small_w = max(1, width // downscale)
+    small_h = max(1, height // downscale)
+    small = cv2.resize(gray, (small_w, small_h), interpolation=cv2.INTER_AREA)
+
+    mask = (small > dark_threshold).astype(np.uint8)
+    # Opening removes text and tick marks. No closing: it would fuse the sector
+    # with UI bars a few pixels away, and dark fluid inside the sector does not
+    # split it because the surrounding tissue keeps it connected.
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if count <= 1:
+        return None
+    label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    if stats[label, cv2.CC_STAT_AREA] < min_area_fraction * mask.size:
+        return None
+
+    component = labels == label
+    rows = component.sum(axis=1)
+    cols = component.sum(axis=0)
+    # Trim sparse rows/columns at the edges (status bars fused to the sector)
+    row_keep = np.flatnonzero(rows >= EDGE_COVERAGE * rows.max())
+    col_keep = np.flatnonzero(cols >= EDGE_COVERAGE * cols.max())
+    y1, y2 = int(row_keep[0]), int(row_keep[-1]) + 1
+    x1, x2 = int(col_keep[0]), int(col_keep[-1]) + 1
+
+    scale_x = width / small_w
+    scale_y = height / small_h
+    return (
+        max(0, int(x1 * scale_x)),
+        max(0, int(y1 * scale_y)),
+        min(width, int(round(x2 * scale_x))),
+        min(height, int(round(y2 * scale_y))),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the detected scan region of ultrasound frames.")
+    parser.add_argument("images", nargs="+", help="Frames to inspect")
+    args = parser.parse_args()
+
+    for path in args.images:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"{path}: unreadable")
+            continue
+        rect = detect_roi(img)
+        if rect is None:
+            print(f"{path}: no scan region found")
+            continue
+        x1, y1, x2, y2 = rect
+        print(f"{path}: x={x1}, y={y1}, w={x2 - x1}, h={y2 - y1}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+批量把 WMV 超声视频转码为 MP4（取代 convert_videos.sh 的逐个串行转码）
+
+- 按CPU核数并行运行多个 ffmpeg 子进程（每个进程分到相应的线程数）
+- 每个文件的状态、时长、源文件大小/修改时间/SHA-1 以及输出的大小/修改时间/实际时长
+  记录在项目根目录的 transcode_manifest.json（不放在 public/ 下，源路径只记相对路径），
+  中断后重新运行会从断点继续
+- 输出先写到临时文件（<名>.mp4.part，扫描 *.mp4 时不会被当作正片）再改名；
+  重新运行时源和输出的大小/修改时间都与清单一致就直接跳过，不再探测；
+  不一致的输出才实际走一遍视频流比对时长，截断的文件会重新转码
+- 可选生成低码率预览（<组>/previews/）和封面帧（<组>/posters/），
+  不会被 link_videos.py 和 /api/patients 当作正片扫描到；正片重新转码后一并重新生成
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 路径配置
+PROJECT_ROOT = Path("/Users/huangyijun/Projects/胃癌T分期")
+VIDEO_ROOT = PROJECT_ROOT / "胃癌视频"
+OUTPUT_ROOT = PROJECT_ROOT / "gastric-scan-next" / "public" / "videos"
+MANIFEST_NAME = "transcode_manifest.json"
+# 清单不放在 public/ 下，避免被前端当作静态文件公开
+MANIFEST_PATH = PROJECT_ROOT / MANIFEST_NAME
+
+# (源目录, 输出子目录)
+GROUPS = [
+    ("直接手术", "direct_surgery"),
+    ("直接手术/喝水", "direct_surgery/water_filled"),
+    ("新辅助治疗", "neoadjuvant"),
+    ("新辅助治疗/喝水", "neoadjuvant/water_filled"),
+]
+
+# 时长允许误差：max(0.5秒, 2%)
+DURATION_TOLERANCE_S = 0.5
+DURATION_TOLERANCE_RATIO = 0.02
+
+FFMPEG = shutil.which("ffmpeg") or "ffmpeg"
+FFPROBE = shutil.which("ffprobe")
+DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+TIME_PATTERN = re.compile(r"time=(-?)(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def probe_duration(path):
+    """
+    读取媒体时长（秒），无法读取时返回 None
+    优先用 ffprobe；没有 ffprobe 时解析 `ffmpeg -i` 输出中的 Duration
+    """
+    path = str(path)
+    if FFPROBE:
+        result = subprocess.run(
+            [FFPROBE, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            capture_output=True, text=True,
+        )
+        try:
+            return float(result.stdout.strip())
+        except ValueError:
+            return None
+    result = subprocess.run([FFMPEG, "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = DURATION_PATTERN.search(result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def playable_duration(path):
+    """
+    实际可播放时长（秒）：不解码、只把视频流拷贝到 null 走一遍，取最后的 time=
+    faststart 的 MP4 把 moov 放在文件头，截断后头部记录的时长不变，只能这样检查
+    """
+    result = subprocess.run(
+        [FFMPEG, "-hide_banner", "-nostdin", "-i", str(path), "-map", "0:v:0", "-c", "copy", "-f", "null", "-"],
+        capture_output=True, text=True,
+    )
+    matches = TIME_PATTERN.findall(result.stderr)
+    if not matches:
+        return None
+    sign, hours, minutes, seconds = matches[-1]
+    if sign:
+        return 0.0
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def durations_match(expected, actual):
+    if expected is None or actual is None:
+        return False
+    return abs(expected - actual) <= max(DURATION_TOLERANCE_S, expected * DURATION_TOLERANCE_RATIO)
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def run_ffmpeg(args):
+    """运行 ffmpeg，失败时抛出带 stderr 的 RuntimeError"""
+    result = subprocess.run([FFMPEG, "-hide_banner", "-loglevel", "error", "-y", *args],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"ffmpeg exited with {result.returncode}")
+
+
+def temp_path(path):
+    """临时输出文件：扩展名不是 .mp4/.jpg，调用方用 -f 指定容器格式"""
+    return path.with_name(path.name + ".part")
+
+
+def transcode(src, dst, threads):
+    tmp = temp_path(dst)
+    run_ffmpeg([
+        "-i", str(src),
+        "-c:v", "libx264", "-preset", "fast", "-crf", "23",
+        "-c:a", "aac", "-b:a", "128k",
+        "-movflags", "+faststart",
+        "-threads", str(threads),
+        "-f", "mp4", str(tmp),
+    ])
+    os.replace(tmp, dst)
+
+
+def make_preview(src, dst, threads):
+    """低码率预览：高度360，约300kbps"""
+    tmp = temp_path(dst)
+    run_ffmpeg([
+        "-i", str(src),
+        "-vf", "scale=-2:360",
+        "-c:v", "libx264", "-preset", "veryfast", "-b:v", "300k", "-maxrate", "400k", "-bufsize", "800k",
+        "-c:a", "aac", "-b:a", "64k",
+        "-movflags", "+faststart",
+        "-threads", str(threads),
+        "-f", "mp4", str(tmp),
+    ])
+    os.replace(tmp, dst)
+
+
+def make_poster(src, dst, duration):
+    """封面帧：取第1秒（短视频取中点）"""
+    tmp = temp_path(dst)
+    seek = min(1.0, (duration or 0) / 2)
+    run_ffmpeg(["-ss", f"{seek:.2f}", "-i", str(src), "-frames:v", "1", "-q:v", "3",
+                "-f", "image2", "-update", "1", str(tmp)])
+    os.replace(tmp, dst)
+
+
+def find_jobs(video_root, output_root):
+    """列出所有 (源文件, 输出文件) 配对"""
+    jobs = []
+    for source_sub, output_sub in GROUPS:
+        source_dir = video_root / source_sub
+        if not source_dir.exists():
+            continue
+        for src in sorted(source_dir.glob("*.wmv")):
+            jobs.append((src, output_root / output_sub / f"{src.stem}.mp4"))
+    return jobs
+
+
+def companion_paths(dst):
+    return (
+        dst.parent / "previews" / f"{dst.stem}_preview.mp4",
+        dst.parent / "posters" / f"{dst.stem}.jpg",
+    )
+
+
+def same_stat(entry, path, prefix):
+    """清单中记录的大小/修改时间与文件当前状态一致"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+    return entry.get(f"{prefix}_size") == stat.st_size and entry.get(f"{prefix}_mtime_ns") == stat.st_mtime_ns
+
+
+def is_complete(entry, src, dst, preview, poster):
+    """
+    清单记录完成、源文件未变、输出的大小/修改时间与转码完成时一致（以及需要的预览/封面已存在）
+    只比较文件状态，不再探测时长：输出被截断或替换后大小/修改时间会变，交给 process_video 重新检查
+    """
+    if not entry or entry.get("status") != "done":
+        return False
+    if not same_stat(entry, src, "source") or not same_stat(entry, dst, "output"):
+        return False
+    preview_path, poster_path = companion_paths(dst)
+    if preview and not preview_path.exists():
+        return False
+    if poster and not poster_path.exists():
+        return False
+    return True
+
+
+def process_video(src, dst, video_root, output_root, threads, preview, poster, previous):
+    """
+    转码单个视频并返回清单条目
+    已有输出（例如旧脚本生成的）时长与源一致时直接沿用，只补齐预览/封面
+    """
+    start = time.time()
+    stat = src.stat()
+    entry = {
+        "source": src.relative_to(video_root).as_posix(),
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+    }
+    # 源文件未变时沿用之前算好的哈希，不再整文件读取
+    if previous and previous.get("source_size") == stat.st_size \
+            and previous.get("source_mtime_ns") == stat.st_mtime_ns and previous.get("source_sha1"):
+        entry["source_sha1"] = previous["source_sha1"]
+    else:
+        entry["source_sha1"] = file_sha1(src)
+
+    try:
+        duration = probe_duration(src)
+        entry["duration"] = duration
+        dst.parent.mkdir(parents=True, exist_ok=True)
+
+        reused = dst.exists() and durations_match(duration, playable_duration(dst))
+        if not reused:
+            transcode(src, dst, threads)
+        output_duration = playable_duration(dst)
+        if duration is not None and not durations_match(duration, output_duration):
+            raise RuntimeError(f"输出时长 {output_duration} 与源 {duration} 不一致")
+        output_stat = dst.stat()
+        entry["output_size"] = output_stat.st_size
+        entry["output_mtime_ns"] = output_stat.st_mtime_ns
+        entry["output_duration"] = output_duration
+        entry["reused_output"] = reused
+
+        # 正片重新转码后，旧的预览/封面对应的是之前的输出，也要重新生成
+        preview_path, poster_path = companion_paths(dst)
+        if preview and (not reused or not preview_path.exists()):
+            preview_path.parent.mkdir(exist_ok=True)
+            make_preview(dst, preview_path, threads)
+        if poster and (not reused or not poster_path.exists()):
+            poster_path.parent.mkdir(exist_ok=True)
+            make_poster(dst, poster_path, output_duration)
+        if preview_path.exists():
+            entry["preview"] = preview_path.relative_to(output_root).as_posix()
+        if poster_path.exists():
+            entry["poster"] = poster_path.relative_to(output_root).as_posix()
+        entry["status"] = "done"
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = str(e)
+        for path in (dst, *companion_paths(dst)):
+            tmp = temp_path(path)
+            if tmp.exists():
+                tmp.unlink()
+    entry["elapsed"] = round(time.time() - start, 2)
+    return entry
+
+
+def load_manifest(path):
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    """先写临时文件再改名，中断时不会留下半个清单"""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(manifest.items())), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def default_workers():
+    # 每个 ffmpeg 至少分到2个线程
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def transcode_all(video_root=VIDEO_ROOT, output_root=OUTPUT_ROOT, workers=None, preview=False, poster=False,
+                  manifest_path=MANIFEST_PATH):
+    """并行转码全部视频，返回 (完成数, 跳过数, 失败数)"""
+    video_root = Path(video_root)
+    output_root = Path(output_root)
+    output_root.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(manifest_path)
+    manifest = load_manifest(manifest_path)
+    # 旧版本把清单写在输出目录（public/videos）下：迁移到 manifest_path 后删除
+    legacy_path = output_root / MANIFEST_NAME
+    if legacy_path.exists() and legacy_path != manifest_path:
+        manifest = {**load_manifest(legacy_path), **manifest}
+        save_manifest(manifest_path, manifest)
+        legacy_path.unlink()
+
+    workers = workers or default_workers()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    pending = []
+    skipped = 0
+    for src, dst in find_jobs(video_root, output_root):
+        key = dst.relative_to(output_root).as_posix()
+        if is_complete(manifest.get(key), src, dst, preview, poster):
+            skipped += 1
+            continue
+        pending.append((key, src, dst))
+
+    print(f"共 {len(pending) + skipped} 个视频，跳过已完成 {skipped} 个，待转码 {len(pending)} 个")
+    print(f"并行 {workers} 个 ffmpeg 进程，每个 {threads} 线程")
+
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(process_video, src, dst, video_root, output_root, threads, preview, poster, manifest.get(key)): key
+            for key, src, dst in pending
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            entry = future.result()
+            manifest[key] = entry
+            # 每完成一个就落盘，中断后从这里继续
+            save_manifest(manifest_path, manifest)
+            if entry["status"] == "done":
+                done += 1
+                print(f"✅ 完成: {key} ({entry['elapsed']}s)")
+            else:
+                failed += 1
+                print(f"❌ 失败: {key}: {entry['error']}")
+
+    return done, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行、可断点续传的 WMV → MP4 批量转码")
+    parser.add_argument("--video-root", type=Path, default=VIDEO_ROOT, help="源视频目录")
+    parser.add_argument("--output-root", type=Path, default=OUTPUT_ROOT, help="输出目录")
+    parser.add_argument("--workers", type=int, default=None, help="并行 ffmpeg 进程数（默认CPU核数的一半）")
+    parser.add_argument("--preview", action="store_true", help="同时生成低码率预览")
+    parser.add_argument("--poster", action="store_true", help="同时生成封面帧")
+    parser.add_argument("--manifest", type=Path, default=MANIFEST_PATH, help="转码清单（不要放在 public/ 下）")
+    args = parser.parse_args()
+
+    print("=" * 42)
+    print("🎬 胃癌超声视频批量转码工具")
+    print("=" * 42)
+    print(f"输入目录: {args.video_root}")
+    print(f"输出目录: {args.output_root}")
+
+    done, skipped, failed = transcode_all(
+        args.video_root, args.output_root, args.workers, args.preview, args.poster, args.manifest
+    )
+
+    print("=" * 42)
+    print(f"✅ 成功转换: {done}")
+    print(f"⏭️  已跳过: {skipped}")
+    print(f"❌ 失败: {failed}")
+    print("=" * 42)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,193 @@
 #!/usr/bin/env python3
-"""Run extraction and merging of pathology concept data in one command."""
+"""
+Run extraction and merging of pathology concept data in one command.
+
+Each workbook's extraction result is cached under ``scripts/.concept_cache``,
+keyed by the workbook's SHA-1 and a digest of the extractor source. Only
+workbooks without a cached result are parsed, in parallel worker processes;
+the results are then combined in argument order (later workbooks win for
+duplicate patient IDs), written to the concepts JSON and table only when they
+changed, and merged in-process into the clinical JSON files given by --files.
+A workbook that fails to parse is reported and its last good cached result is
+used instead (without one, the concepts JSON and table are left unchanged); the
+others are still cached and merged, and the run exits with status 1.
+"""
 
 from __future__ import annotations
 
-import subprocess
+import argparse
+import hashlib
+import json
+import os
 import sys
-
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from excel_snapshot import workbook_sha1
+from extract_pathology_concepts import parse_excel, write_outputs
+from merge_clinical_features import DATA_FILES, merge_concepts, print_summary
+
 SCRIPT_DIR = Path(__file__).parent
+PROJECT_DIR = SCRIPT_DIR.parent
+CACHE_DIR = SCRIPT_DIR / ".concept_cache"
+STATE_NAME = "state.json"
+# Source files whose changes invalidate cached results
+EXTRACTOR_SOURCES = ("extract_pathology_concepts.py", "concept_values.py")
+
+
+def extractor_digest() -> str:
+    digest = hashlib.sha1()
+    for name in EXTRACTOR_SOURCES:
+        digest.update((SCRIPT_DIR / name).read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def resolve_workbook(name: str) -> Path | None:
+    for path in (Path(name), PROJECT_DIR / name):
+        if path.exists():
+            return path
+    return None
+
+
+def _parse(path: Path) -> dict[str, dict[str, object]]:
+    # One process per workbook; the report scan inside it stays single-process
+    return parse_excel(path, 1)
+
 
+def write_json(path: Path, data: object, **options: object) -> None:
+    """Write through a temporary file and os.replace, so readers never see half a file."""
+    tmp = path.with_name(f".{path.name}.tmp{os.getpid()}")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, **options), encoding="utf-8")
+    os.replace(tmp, path)
 
-def run_command(cmd: list[str]) -> None:
-    print(f"Running: {' '.join(cmd)}")
-    result = subprocess.run(cmd, cwd=SCRIPT_DIR.parent)
-    if result.returncode != 0:
-        sys.exit(result.returncode)
+
+def extract_workbooks(
+    paths: list[Path], cache_dir: Path, workers: int | None = None, force: bool = False
+) -> tuple[list[dict[str, dict[str, object]]], list[Path], dict[Path, str]]:
+    """
+    Per-workbook results in input order, the workbooks that had to be parsed, and
+    an error message per workbook that could not be read or parsed. A failing
+    workbook contributes its last good result from the previous run, which stays
+    cached; without one it is left out of the results.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    state_path = cache_dir / STATE_NAME
+    previous_state = json.loads(state_path.read_text(encoding="utf-8")) if state_path.exists() else {}
+    code = extractor_digest()
+    errors: dict[Path, str] = {}
+    keys: dict[Path, str] = {}
+    for path in paths:
+        try:
+            keys[path] = f"{workbook_sha1(path)}-{code}"
+        except OSError as e:
+            errors[path] = str(e)
+    results: dict[str, dict[str, dict[str, object]]] = {}
+    for key in keys.values():
+        cached = cache_dir / f"{key}.json"
+        if not force and cached.exists():
+            results[key] = json.loads(cached.read_text(encoding="utf-8"))
+
+    todo = {key: path for path, key in keys.items() if key not in results}
+    workers = workers or os.cpu_count() or 1
+    parsed: dict[str, dict[str, dict[str, object]]] = {}
+    if len(todo) <= 1 or workers == 1:
+        for key, path in todo.items():
+            try:
+                # A single workbook gets all processes for its report scan instead
+                parsed[key] = parse_excel(path, workers if len(todo) == 1 else 1)
+            except Exception as e:
+                errors[path] = f"{type(e).__name__}: {e}"
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            futures = {key: pool.submit(_parse, path) for key, path in todo.items()}
+            for key, future in futures.items():
+                try:
+                    parsed[key] = future.result()
+                except Exception as e:
+                    errors[todo[key]] = f"{type(e).__name__}: {e}"
+    for key, result in parsed.items():
+        results[key] = result
+        write_json(cache_dir / f"{key}.json", result)
+
+    # A workbook that failed this time keeps the result of its last good run
+    for path in errors:
+        last_key = previous_state.get(str(path))
+        last = cache_dir / f"{last_key}.json"
+        if last_key and last.exists():
+            keys[path] = last_key
+            results[last_key] = json.loads(last.read_text(encoding="utf-8"))
+
+    # Forget results of workbook versions that are no longer part of the last run
+    state = {str(path): key for path, key in keys.items() if key in results}
+    write_json(state_path, state, indent=2)
+    for stale in cache_dir.glob("*.json"):
+        if stale.name != STATE_NAME and stale.stem not in state.values():
+            stale.unlink()
+    ordered = [results[keys[path]] for path in paths if path in keys and keys[path] in results]
+    return ordered, [todo[key] for key in parsed], errors
 
 
 def main() -> None:
-    extract_cmd = [
-        sys.executable,
-        str(SCRIPT_DIR / "extract_pathology_concepts.py"),
-        "-i",
-        "2025胃癌临床整理.xlsx",
+    parser = argparse.ArgumentParser(description="Extract pathology concepts from workbooks and merge them.")
+    parser.add_argument(
+        "workbooks",
+        nargs="*",
+        default=["2025胃癌临床整理.xlsx"],
+        help="Excel files to scan (default: 2025胃癌临床整理.xlsx)",
+    )
+    parser.add_argument(
+        "--output",
         "-o",
-        str(SCRIPT_DIR / "extracted_pathology_concepts.json"),
-    ]
-    merge_cmd = [
-        sys.executable,
-        str(SCRIPT_DIR / "merge_clinical_features.py"),
-    ]
+        type=Path,
+        default=SCRIPT_DIR / "extracted_pathology_concepts.json",
+        help="Path to write extracted JSON.",
+    )
+    parser.add_argument("--table", type=Path, default=None, help="Typed concept table (default: next to --output).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--force", action="store_true", help="Re-extract every workbook, ignoring the cache.")
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR, help="Per-workbook result cache.")
+    parser.add_argument(
+        "--files",
+        type=Path,
+        nargs="*",
+        default=[PROJECT_DIR / path for path in DATA_FILES],
+        help="Clinical JSON files to merge into (default: the project's data files; none to skip merging).",
+    )
+    args = parser.parse_args()
+
+    paths = []
+    for name in args.workbooks:
+        path = resolve_workbook(name)
+        if path is None:
+            print(f"Warning: {name} does not exist. Skipping.")
+            continue
+        paths.append(path)
 
-    run_command(extract_cmd)
-    run_command(merge_cmd)
+    results, parsed, errors = extract_workbooks(paths, args.cache_dir, args.workers, args.force)
+    unchanged = len(paths) - len(parsed) - len(errors)
+    print(f"Extracted {len(parsed)} of {len(paths)} workbook(s); {unchanged} unchanged")
+    for path, message in errors.items():
+        print(f"Error: {path}: {message}")
+    # Failed workbooks without an earlier result would drop their patients from the outputs
+    incomplete = len(results) < len(paths)
+
+    combined: dict[str, dict[str, object]] = {}
+    for result in results:
+        combined.update(result)
+
+    previous = json.loads(args.output.read_text(encoding="utf-8")) if args.output.exists() else None
+    if incomplete:
+        print(f"{args.output} and the table left unchanged: not every workbook has a result")
+    elif combined != previous:
+        write_outputs(combined, args.output, args.table)
+    else:
+        print(f"{args.output} is up to date")
+
+    if args.files:
+        print_summary(merge_concepts(combined, args.files))
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
     main()
-
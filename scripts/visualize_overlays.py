@@ -2,85 +2,238 @@ import os
 import cv2
 import numpy as np
 import math
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-def create_overlay_grid(base_dir, output_file="overlay_summary.jpg", grid_cols=5, max_images=None):
-    """
-    Creates a grid summary of overlay images from all subdirectories.
-    """
+# cv2 decodes JPEGs at 1/2, 1/4 or 1/8 resolution directly in the DCT domain
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+DZI_TILE_SIZE = 256
+
+
+def find_overlay_images(base_dir):
+    """Collect *_overlay.jpg files from every directory whose path mentions 'overlay'."""
     overlay_images = []
-    
-    # Walk through all directories to find overlay images
     for root, dirs, files in os.walk(base_dir):
         if "overlay" in root:
             for file in files:
                 if file.endswith("_overlay.jpg") and not file.startswith("._"):
                     overlay_images.append(os.path.join(root, file))
-    
+    return sorted(overlay_images)
+
+
+def make_thumbnail(img_path, thumb_size=(300, 300), reduce=4, label=True):
+    """
+    Decode img_path at reduced resolution and letterbox it into a thumb_size tile.
+    Returns a black tile when the file cannot be read.
+    """
+    canvas = np.zeros((thumb_size[1], thumb_size[0], 3), dtype=np.uint8)
+    img = cv2.imread(img_path, REDUCED_FLAGS[reduce])
+    if img is None:
+        return canvas
+
+    # Resize maintaining aspect ratio
+    h, w = img.shape[:2]
+    scale = min(thumb_size[0]/w, thumb_size[1]/h)
+    new_w = max(1, int(w * scale))
+    new_h = max(1, int(h * scale))
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+    # Pad to make it square thumb_size
+    y_offset = (thumb_size[1] - new_h) // 2
+    x_offset = (thumb_size[0] - new_w) // 2
+    canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = resized
+
+    if label:
+        # Add filename text
+        filename = os.path.basename(img_path).replace("_overlay.jpg", "")
+        # Shorten filename if too long
+        if len(filename) > 20:
+            filename = filename[:17] + "..."
+        cv2.putText(canvas, filename, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+    return canvas
+
+
+def page_path(output_file, page, pages):
+    if pages == 1:
+        return output_file
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}_p{page:03d}{ext}"
+
+
+def create_overlay_grid(base_dir, output_file="overlay_summary.jpg", grid_cols=5, max_images=None,
+                        rows_per_page=10, thumb_size=(300, 300), reduce=4, workers=8):
+    """
+    Creates paged grid summaries of overlay images from all subdirectories.
+
+    Thumbnails are decoded at reduced resolution on a thread pool and only one
+    page (grid_cols x rows_per_page) is held in memory at a time. A single page
+    is written to output_file; more pages get a _pNNN suffix.
+    Returns the list of written pages.
+    """
+    overlay_images = find_overlay_images(base_dir)
     if not overlay_images:
         print("No overlay images found.")
-        return
+        return []
 
     print(f"Found {len(overlay_images)} overlay images.")
-    
+
+    if max_images:
+        overlay_images = overlay_images[:max_images]
+
+    per_page = grid_cols * rows_per_page
+    pages = math.ceil(len(overlay_images) / per_page)
+    written = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page in range(pages):
+            batch = overlay_images[page * per_page:(page + 1) * per_page]
+            grid_rows = math.ceil(len(batch) / grid_cols)
+            grid_image = np.zeros((grid_rows * thumb_size[1], grid_cols * thumb_size[0], 3), dtype=np.uint8)
+
+            thumbs = pool.map(lambda p: make_thumbnail(p, thumb_size, reduce), batch)
+            for idx, thumb in enumerate(thumbs):
+                row = idx // grid_cols
+                col = idx % grid_cols
+                y = row * thumb_size[1]
+                x = col * thumb_size[0]
+                grid_image[y:y+thumb_size[1], x:x+thumb_size[0]] = thumb
+
+            target = page_path(output_file, page + 1, pages)
+            cv2.imwrite(target, grid_image)
+            written.append(target)
+
+    print(f"Saved {len(written)} overlay summary page(s) to {page_path(output_file, 1, pages)}"
+          + (" ..." if pages > 1 else ""))
+    return written
+
+
+def create_overlay_dzi(base_dir, output_dir, name="overlays", max_images=None, reduce=4, workers=8,
+                       tile_format="jpg"):
+    """
+    Write the whole cohort as one Deep Zoom (DZI) image for OpenSeadragon-style viewers.
+
+    Every overlay becomes one 256x256 tile of the full-resolution level, so that
+    level is written straight from the thumbnails. Each lower level is built
+    from 2x2 tiles of the level above, read back from disk, so memory stays at a
+    few tiles regardless of cohort size. <name>_index.json maps cells to files.
+    Returns the path of the .dzi descriptor.
+    """
+    overlay_images = find_overlay_images(base_dir)
     if max_images:
         overlay_images = overlay_images[:max_images]
-        
-    # Read images to determine size (assume all are roughly same size or resize)
-    # We'll resize to a thumbnail size for the grid
-    thumb_size = (300, 300)
-    
-    thumbnails = []
-    for img_path in overlay_images:
-        img = cv2.imread(img_path)
-        if img is not None:
-            # Resize maintaining aspect ratio
-            h, w = img.shape[:2]
-            scale = min(thumb_size[0]/w, thumb_size[1]/h)
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            resized = cv2.resize(img, (new_w, new_h))
-            
-            # Pad to make it square thumb_size
-            canvas = np.zeros((thumb_size[1], thumb_size[0], 3), dtype=np.uint8)
-            y_offset = (thumb_size[1] - new_h) // 2
-            x_offset = (thumb_size[0] - new_w) // 2
-            canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = resized
-            
-            # Add filename text
-            filename = os.path.basename(img_path).replace("_overlay.jpg", "")
-            # Shorten filename if too long
-            if len(filename) > 20:
-                filename = filename[:17] + "..."
-                
-            cv2.putText(canvas, filename, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
-            
-            thumbnails.append(canvas)
-            
-    if not thumbnails:
-        return
-
-    # Create grid
-    n_images = len(thumbnails)
-    grid_rows = math.ceil(n_images / grid_cols)
-    
-    grid_h = grid_rows * thumb_size[1]
-    grid_w = grid_cols * thumb_size[0]
-    
-    grid_image = np.zeros((grid_h, grid_w, 3), dtype=np.uint8)
-    
-    for idx, thumb in enumerate(thumbnails):
-        row = idx // grid_cols
-        col = idx % grid_cols
-        
-        y = row * thumb_size[1]
-        x = col * thumb_size[0]
-        
-        grid_image[y:y+thumb_size[1], x:x+thumb_size[0]] = thumb
-        
-    cv2.imwrite(output_file, grid_image)
-    print(f"Saved overlay summary to {output_file}")
+    if not overlay_images:
+        print("No overlay images found.")
+        return None
+
+    tile = DZI_TILE_SIZE
+    cols = math.ceil(math.sqrt(len(overlay_images)))
+    rows = math.ceil(len(overlay_images) / cols)
+    width, height = cols * tile, rows * tile
+    max_level = math.ceil(math.log2(max(width, height)))
+
+    tiles_root = os.path.join(output_dir, f"{name}_files")
+    os.makedirs(output_dir, exist_ok=True)
+
+    def level_size(level):
+        factor = 2 ** (max_level - level)
+        return math.ceil(width / factor), math.ceil(height / factor)
+
+    def tile_path(level, col, row):
+        return os.path.join(tiles_root, str(level), f"{col}_{row}.{tile_format}")
+
+    # Full-resolution level: one thumbnail per tile (empty cells stay black)
+    os.makedirs(os.path.join(tiles_root, str(max_level)), exist_ok=True)
+    blank = np.zeros((tile, tile, 3), dtype=np.uint8)
+
+    def write_base_tile(index):
+        col, row = index % cols, index // cols
+        if index < len(overlay_images):
+            thumb = make_thumbnail(overlay_images[index], (tile, tile), reduce, label=False)
+        else:
+            thumb = blank
+        cv2.imwrite(tile_path(max_level, col, row), thumb)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(write_base_tile, range(cols * rows)))
+
+        # Lower levels: downsample each 2x2 block of the level above
+        for level in range(max_level - 1, -1, -1):
+            os.makedirs(os.path.join(tiles_root, str(level)), exist_ok=True)
+            level_w, level_h = level_size(level)
+            upper_w, upper_h = level_size(level + 1)
+            level_cols, level_rows = math.ceil(level_w / tile), math.ceil(level_h / tile)
+            upper_cols, upper_rows = math.ceil(upper_w / tile), math.ceil(upper_h / tile)
+
+            def write_level_tile(index, level=level, level_w=level_w, level_h=level_h,
+                                 level_cols=level_cols, upper_cols=upper_cols, upper_rows=upper_rows):
+                col, row = index % level_cols, index // level_cols
+                block_rows = []
+                for child_row in (2 * row, 2 * row + 1):
+                    if child_row >= upper_rows:
+                        continue
+                    children = [
+                        cv2.imread(tile_path(level + 1, child_col, child_row))
+                        for child_col in (2 * col, 2 * col + 1)
+                        if child_col < upper_cols
+                    ]
+                    block_rows.append(np.hstack(children))
+                block = np.vstack(block_rows)
+                target_w = min(tile, level_w - col * tile)
+                target_h = min(tile, level_h - row * tile)
+                cv2.imwrite(tile_path(level, col, row),
+                            cv2.resize(block, (target_w, target_h), interpolation=cv2.INTER_AREA))
+
+            list(pool.map(write_level_tile, range(level_cols * level_rows)))
+
+    dzi_path = os.path.join(output_dir, f"{name}.dzi")
+    with open(dzi_path, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{tile_format}" '
+            f'Overlap="0" TileSize="{tile}">\n'
+            f'  <Size Width="{width}" Height="{height}"/>\n'
+            '</Image>\n'
+        )
+    with open(os.path.join(output_dir, f"{name}_index.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "columns": cols,
+            "rows": rows,
+            "cell_size": tile,
+            "images": [os.path.relpath(p, base_dir) for p in overlay_images],
+        }, f, ensure_ascii=False, indent=2)
+
+    print(f"Saved deep zoom pyramid ({max_level + 1} levels, {len(overlay_images)} images) to {dzi_path}")
+    return dzi_path
+
 
 if __name__ == "__main__":
-    base_directory = "放化疗"
-    create_overlay_grid(base_directory, output_file="放化疗/overlay_summary.jpg")
+    parser = argparse.ArgumentParser(description="Paged contact sheets and a deep zoom pyramid of overlay images.")
+    parser.add_argument("base_dir", nargs="?", default="放化疗", help="Directory searched for *_overlay.jpg")
+    parser.add_argument("--output", default=None, help="Contact sheet path (default: <base_dir>/overlay_summary.jpg)")
+    parser.add_argument("--cols", type=int, default=5, help="Thumbnails per row")
+    parser.add_argument("--rows-per-page", type=int, default=10, help="Rows per contact sheet page")
+    parser.add_argument("--max-images", type=int, default=None, help="Only use the first N overlays")
+    parser.add_argument("--reduce", type=int, choices=sorted(REDUCED_FLAGS), default=4,
+                        help="JPEG decode reduction factor (default: 4)")
+    parser.add_argument("--workers", type=int, default=8, help="Decoding threads")
+    parser.add_argument("--dzi", default=None, help="Also write a deep zoom pyramid into this directory")
+    args = parser.parse_args()
 
+    create_overlay_grid(
+        args.base_dir,
+        output_file=args.output or os.path.join(args.base_dir, "overlay_summary.jpg"),
+        grid_cols=args.cols,
+        max_images=args.max_images,
+        rows_per_page=args.rows_per_page,
+        reduce=args.reduce,
+        workers=args.workers,
+    )
+    if args.dzi:
+        create_overlay_dzi(args.base_dir, args.dzi, max_images=args.max_images, reduce=args.reduce,
+                           workers=args.workers)